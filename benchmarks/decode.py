@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from common.utils.index import (SKIP_INTERVAL,
+                                PostingsCursor,
+                                decode_postings)
+from common.utils.skips import (read_skips,
+                                skips_fpath)
+
+# synthetic_lists returns lists of the text index, as (postings_str, skips)
+# pairs, with docid gaps and frequencies drawn as in a small corpus.
+def synthetic_lists(num_lists, num_postings, seed=1):
+    rnd = random.Random(seed)
+    lists = []
+    for _ in range(num_lists):
+        docid = 0
+        posting_strs = []
+        for _ in range(num_postings):
+            docid += rnd.randint(1, 20)
+            posting_strs.append(f"{docid},{rnd.randint(1, 9)}")
+        skips = []
+        skip_offset = 0
+        for i, posting_str in enumerate(posting_strs):
+            if i > 0 and i % SKIP_INTERVAL == 0:
+                skips.append((int(posting_str[:posting_str.index(",")]),
+                              skip_offset))
+            skip_offset += len(posting_str) + 1
+        lists.append((" ".join(posting_strs), skips))
+    return lists
+
+# index_lists returns the lists of an index file, as (postings_str, skips)
+# pairs, read through its skips file.
+def index_lists(index_fpath):
+    skips = read_skips(skips_fpath(index_fpath))
+    lists = []
+    with open(index_fpath, "r", encoding="utf-8") as f:
+        for word, (offset, word_skips) in skips.items():
+            f.seek(offset)
+            postings_str = f.readline().rstrip("\n").split(" ", 1)[1]
+            lists.append((postings_str, word_skips))
+    return lists
+
+# decode_per_posting decodes a list as the readers did before the bulk decoder:
+# one split and two int calls per posting.
+def decode_per_posting(postings_str):
+    postings = []
+    for posting_str in postings_str.split(" "):
+        docid, freq = posting_str.split(",")
+        postings.append((int(docid), int(freq)))
+    return postings
+
+def cursor_all(postings_str, skips):
+    cursor = PostingsCursor(postings_str, skips)
+    while cursor.docid != None:
+        cursor.next()
+
+# cursor_skipping moves a cursor to a docid in the middle of every fourth block
+# of SKIP_INTERVAL postings, as when a rare term drives the matching of a common
+# one.
+def cursor_skipping(postings_str, skips):
+    cursor = PostingsCursor(postings_str, skips)
+    for i in range(3, len(skips) - 1, 4):
+        cursor.next_geq((skips[i][0] + skips[i + 1][0]) // 2)
+
+BENCHMARKS = {
+    "Per posting": lambda lists: [decode_per_posting(postings_str)
+                                  for postings_str, _ in lists],
+    "Bulk": lambda lists: [decode_postings(postings_str)
+                           for postings_str, _ in lists],
+    "Cursor, all postings": lambda lists: [cursor_all(postings_str, skips)
+                                           for postings_str, skips in lists],
+    "Cursor, skipping": lambda lists: [cursor_skipping(postings_str, skips)
+                                       for postings_str, skips in lists],
+}
+
+def run_benchmark(function, lists, num_postings, number):
+    timer = timeit.Timer(lambda: function(lists))
+    # The best of several repetitions is the least disturbed by the rest of
+    # the system.
+    seconds = min(timer.repeat(repeat=5, number=number)) / number
+    return {
+        "Postings": num_postings,
+        "Seconds": round(seconds, 6),
+        "Postings per sec": round(num_postings / seconds),
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure the throughput of posting list decoding.')
+    parser.add_argument(
+        '-index',
+        dest='index',
+        action='store',
+        required=False,
+        type=str,
+        help="Path to an index file with a skips file to decode the lists of, "+
+             "instead of synthetic lists"
+    )
+    parser.add_argument(
+        '-lists',
+        dest='lists',
+        action='store',
+        required=False,
+        type=int,
+        default=100,
+        help="Number of synthetic lists"
+    )
+    parser.add_argument(
+        '-postings',
+        dest='postings',
+        action='store',
+        required=False,
+        type=int,
+        default=10000,
+        help="Number of postings of each synthetic list"
+    )
+    parser.add_argument(
+        '-number',
+        dest='number',
+        action='store',
+        required=False,
+        type=int,
+        default=3,
+        help="Number of times each benchmark decodes all the lists"
+    )
+    parser.add_argument(
+        '-o',
+        dest='output',
+        action='store',
+        required=False,
+        type=str,
+        help="Path to write all the results to, as JSON"
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.index != None:
+        lists = index_lists(args.index)
+    else:
+        lists = synthetic_lists(args.lists, args.postings)
+    num_postings = sum(postings_str.count(" ") + 1
+                       for postings_str, _ in lists if len(postings_str) > 0)
+
+    results = []
+    for name, function in BENCHMARKS.items():
+        result = {"Benchmark": name}
+        result.update(run_benchmark(function, lists, num_postings,
+                                    args.number))
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
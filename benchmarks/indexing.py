@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import write_corpus
+
+DEFAULT_NUM_DOCS = "1000,2000,4000,8000"
+DEFAULT_DOCS_PER_FILE = 1000
+DEFAULT_WORKDIR = "benchmark-indexer"
+
+# corpus returns the directory of the synthetic corpus of num_docs documents in
+# workdir, writing it the first time it is asked for.
+def corpus(workdir, num_docs, docs_per_file, seed):
+    corpus_dpath = os.path.abspath(os.path.join(
+        workdir, f"corpus-{num_docs}-{docs_per_file}-{seed}"))
+    if not os.path.exists(corpus_dpath):
+        write_corpus(corpus_dpath + "_", num_docs,
+                     num_files=max(1, -(-num_docs // docs_per_file)),
+                     seed=seed)
+        os.replace(corpus_dpath + "_", corpus_dpath)
+    return corpus_dpath
+
+# run_indexer indexes the corpus in a new empty directory, returning the wall
+# time of the indexer and the statistics it printed.
+def run_indexer(corpus_dpath, index_dpath, memory_limit, indexer_args):
+    shutil.rmtree(index_dpath, ignore_errors=True)
+    os.makedirs(index_dpath)
+    before = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "indexer.py"),
+         "-m", str(memory_limit), "-c", corpus_dpath, "-i", "index.out",
+         "-extra-statistics", "True"] + indexer_args,
+        cwd=index_dpath, stdout=subprocess.PIPE, check=True)
+    elapsed = time.perf_counter() - before
+    lines = completed.stdout.decode("utf-8").strip().split("\n")
+    return elapsed, json.loads(lines[-1])
+
+def measure(corpus_dpath, index_dpath, num_docs, memory_limit, indexer_args):
+    elapsed, statistics = run_indexer(corpus_dpath, index_dpath, memory_limit,
+                                      indexer_args)
+    return {
+        "Docs": num_docs,
+        "Elapsed": round(elapsed, 3),
+        "DocsPerSecond": round(num_docs / elapsed, 1),
+        "Tokens": statistics["Number of tokens"],
+        "IndexSize": statistics["Index Size"],
+        "NumLists": statistics["Number of Lists"],
+        # Phases run by the workers are summed over all of them.
+        "Phases": statistics["Phase times"],
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure the indexer on synthetic corpora.')
+    parser.add_argument(
+        '-docs',
+        dest='num_docs',
+        action='store',
+        required=False,
+        type=str,
+        default=DEFAULT_NUM_DOCS,
+        help="Comma separated sizes, in documents, of the corpora to index"
+    )
+    parser.add_argument(
+        '-docs-per-file',
+        dest='docs_per_file',
+        action='store',
+        required=False,
+        type=int,
+        default=DEFAULT_DOCS_PER_FILE,
+        help="Number of documents of each WARC file of the corpora"
+    )
+    parser.add_argument(
+        '-m',
+        dest='memory_limit',
+        action='store',
+        required=False,
+        type=int,
+        default=1024,
+        help="Memory limit of the indexer, in MB"
+    )
+    parser.add_argument(
+        '-workdir',
+        dest='workdir',
+        action='store',
+        required=False,
+        type=str,
+        default=DEFAULT_WORKDIR,
+        help="Directory of the corpora, reused by later runs, and indexes"
+    )
+    parser.add_argument(
+        '-runs',
+        dest='runs',
+        action='store',
+        required=False,
+        type=int,
+        default=1,
+        help="Number of times to index each corpus"
+    )
+    parser.add_argument(
+        '-seed',
+        dest='seed',
+        action='store',
+        required=False,
+        type=int,
+        default=0,
+        help="Seed of the synthetic corpora"
+    )
+    parser.add_argument(
+        '-o',
+        dest='output',
+        action='store',
+        required=False,
+        type=str,
+        help="Path to write the results to, as JSON"
+    )
+    # Any other argument, like '-positions True', is passed to the indexer.
+    return parser.parse_known_args()
+
+def main():
+    args, indexer_args = parse_args()
+    index_dpath = os.path.join(args.workdir, "index")
+
+    results = []
+    for num_docs in [int(n) for n in args.num_docs.split(",")]:
+        corpus_dpath = corpus(args.workdir, num_docs, args.docs_per_file,
+                              args.seed)
+        for run in range(args.runs):
+            result = measure(corpus_dpath, index_dpath, num_docs,
+                             args.memory_limit, indexer_args)
+            result["Run"] = run
+            print(json.dumps(result))
+            results.append(result)
+    shutil.rmtree(index_dpath, ignore_errors=True)
+
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump({"IndexerArgs": indexer_args, "Results": results}, f,
+                      indent=2)
+
+if __name__ == "__main__":
+    main()
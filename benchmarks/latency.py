@@ -0,0 +1,388 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from synthetic import write_corpus
+
+DEFAULT_QUERIES = os.path.join(REPO_DIR, "benchmarks", "queries",
+                               "queries-*.txt")
+DEFAULT_WORKDIR = "benchmark-index"
+DEFAULT_NUM_DOCS = 10000
+DEFAULT_TOLERANCE = 0.1
+
+# Metrics compared against the baseline, and whether higher values are better.
+METRICS = {
+    "InitTime": False,
+    "P50": False,
+    "P95": False,
+    "P99": False,
+    "Throughput": True,
+    "PeakRSS": False,
+    "PostingsPerQuery": False,
+}
+
+def _queries_size(fpath):
+    numbers = re.findall(r"\d+", os.path.basename(fpath))
+    return int(numbers[-1]) if len(numbers) > 0 else 0
+
+def read_queries(fpath):
+    with open(fpath, "r") as f:
+        return [line.strip() for line in f if line.strip() != ""]
+
+# build_synthetic_index indexes a synthetic corpus of num_docs documents with
+# the words of the queries, in workdir. The index is reused if it exists.
+def build_synthetic_index(workdir, num_docs, queries_fpaths, memory):
+    index_fpath = os.path.abspath(os.path.join(workdir, "index.out"))
+    if os.path.exists(index_fpath):
+        return index_fpath
+
+    words = set(word for fpath in queries_fpaths
+                for query in read_queries(fpath) for word in query.split())
+    corpus_dpath = os.path.abspath(os.path.join(workdir, "corpus"))
+    write_corpus(corpus_dpath, num_docs,
+                 num_files=max(1, num_docs // 10000), words=words)
+    # The indexer writes its runs, and the index, in the working directory.
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, "indexer.py"),
+                    "-m", str(memory), "-c", corpus_dpath, "-i",
+                    os.path.basename(index_fpath)],
+                   cwd=workdir, stdout=subprocess.DEVNULL, check=True)
+    return index_fpath
+
+def _percentile(sorted_values, percent):
+    if len(sorted_values) == 0:
+        return 0
+    idx = min(len(sorted_values) - 1,
+              int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+# _peak_rss returns the peak RSS of the process plus the largest of its
+# children, the shards of a sharded index, in MB. ru_maxrss is in kilobytes on
+# Linux.
+def _peak_rss():
+    return round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss +
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) /
+                 1024, 1)
+
+# measure initializes a ranker for the queries and ranks them one by one,
+# rounds times. It runs in a process of its own, so that its initialization
+# time and peak RSS are the ones of a fresh query processor. Budgets and
+# planner arguments are the ones of the ranker, and budgets are in seconds and
+# postings. With plans, the results have the plan of every query.
+def measure(index_fpath, queries_fpath, ranker_type, engine, mode, rounds,
+            query_budget=None, postings_budget=None, max_df=None,
+            high_df=None, plans=False):
+    from common.preprocessing.normalize import tokenize_and_normalize
+    from common.utils.shards import read_shards
+    from processor._internal.processor.engines import ranker_class
+    from processor._internal.processor.shards import ShardedRanker
+
+    queries = read_queries(queries_fpath)
+    # The paths of the files of the index are relative to the directory the
+    # indexer ran in.
+    os.chdir(os.path.dirname(index_fpath))
+
+    before = time.perf_counter()
+    if read_shards(index_fpath) != None:
+        ranker = ShardedRanker(ranker_type, index_fpath, engine=engine,
+                               mode=mode, query_budget=query_budget,
+                               postings_budget=postings_budget, max_df=max_df,
+                               high_df=high_df)
+    else:
+        ranker = ranker_class(engine)(ranker_type, index_fpath, mode=mode,
+                                      query_budget=query_budget,
+                                      postings_budget=postings_budget,
+                                      max_df=max_df, high_df=high_df)
+    ranker.init(queries)
+    init_time = time.perf_counter() - before
+
+    latencies = []
+    for _ in range(rounds):
+        for query in queries:
+            before = time.perf_counter()
+            ranker.top10(tokenize_and_normalize(query))
+            latencies.append(time.perf_counter() - before)
+    num_postings = ranker.num_postings()
+    num_approximate = ranker.num_approximate()
+    # Planning only looks up the statistics of the query words, so the plans
+    # are made again, after the queries are timed.
+    query_plans = [(query, ranker.plan(tokenize_and_normalize(query)))
+                   for query in queries]
+    plan_postings = [plan.estimated_postings() for _, plan in query_plans]
+    estimated_postings = None
+    if len(plan_postings) > 0 and None not in plan_postings:
+        estimated_postings = round(sum(plan_postings) / len(plan_postings), 1)
+    if isinstance(ranker, ShardedRanker):
+        ranker.close()
+
+    latencies.sort()
+    total_time = sum(latencies)
+    result = {
+        "Queries": os.path.basename(queries_fpath),
+        "NumQueries": len(latencies),
+        "InitTime": round(init_time, 4),
+        "Mean": round(1000 * total_time / max(len(latencies), 1), 3),
+        "P50": round(1000 * _percentile(latencies, 50), 3),
+        "P95": round(1000 * _percentile(latencies, 95), 3),
+        "P99": round(1000 * _percentile(latencies, 99), 3),
+        "Throughput": round(len(latencies) / total_time, 2)
+                      if total_time > 0 else 0,
+        "PeakRSS": _peak_rss(),
+        "Postings": num_postings,
+        "PostingsPerQuery": round(num_postings / max(len(latencies), 1), 1),
+        "Approximate": num_approximate,
+        "EstimatedPostingsPerQuery": estimated_postings,
+    }
+    if plans:
+        result["Plans"] = [dict(Query=query, **plan.to_json())
+                           for query, plan in query_plans]
+    return result
+
+# compare returns the metrics of the results that are worse than the ones of
+# the baseline by more than tolerance, as a fraction of the baseline.
+def compare(results, baseline, tolerance):
+    baseline_results = {result["Queries"]: result
+                        for result in baseline["Results"]}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(result["Queries"])
+        if baseline_result == None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old = baseline_result.get(metric)
+            new = result.get(metric)
+            if old == None or new == None or old == 0:
+                continue
+            change = (new - old) / old
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append({
+                    "Queries": result["Queries"],
+                    "Metric": metric,
+                    "Baseline": old,
+                    "Current": new,
+                    "Change": round(change, 3),
+                })
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure the latency of the query processor.')
+    parser.add_argument(
+        '-i',
+        dest='index_file',
+        action='store',
+        required=False,
+        type=str,
+        help=("Path to the index to query. Defaults to a synthetic index "+
+              "built in '-workdir'")
+    )
+    parser.add_argument(
+        '-docs',
+        dest='num_docs',
+        action='store',
+        required=False,
+        type=int,
+        default=DEFAULT_NUM_DOCS,
+        help="Number of documents of the synthetic index"
+    )
+    parser.add_argument(
+        '-workdir',
+        dest='workdir',
+        action='store',
+        required=False,
+        type=str,
+        default=DEFAULT_WORKDIR,
+        help="Directory of the synthetic index, reused if it exists"
+    )
+    parser.add_argument(
+        '-m',
+        dest='memory_limit',
+        action='store',
+        required=False,
+        type=int,
+        default=1024,
+        help="Memory limit of the indexer of the synthetic index, in MB"
+    )
+    parser.add_argument(
+        '-q',
+        dest='queries',
+        action='store',
+        required=False,
+        type=str,
+        default=DEFAULT_QUERIES,
+        help="Glob of the files of queries to replay"
+    )
+    parser.add_argument(
+        '-r',
+        dest='ranker',
+        action='store',
+        required=False,
+        type=str,
+        default="BM25",
+        help="['TFIDF' | 'BM25'] ranking function to score documents with"
+    )
+    parser.add_argument(
+        '-engine',
+        dest='engine',
+        action='store',
+        required=False,
+        type=str,
+        help="['DAAT' | 'SAAT'] query evaluation strategy"
+    )
+    parser.add_argument(
+        '-mode',
+        dest='mode',
+        action='store',
+        required=False,
+        type=str,
+        help="['OR' | 'AND' | 'PHRASE'] query mode"
+    )
+    parser.add_argument(
+        '-query-budget',
+        dest='query_budget',
+        action='store',
+        required=False,
+        type=float,
+        help="Time budget of each query, in milliseconds"
+    )
+    parser.add_argument(
+        '-postings-budget',
+        dest='postings_budget',
+        action='store',
+        required=False,
+        type=int,
+        help="Maximum number of postings scored for each query"
+    )
+    parser.add_argument(
+        '-max-df',
+        dest='max_df',
+        action='store',
+        required=False,
+        type=float,
+        help=("Fraction of the documents above which query words are dropped "+
+              "or demoted")
+    )
+    parser.add_argument(
+        '-high-df',
+        dest='high_df',
+        action='store',
+        required=False,
+        type=str,
+        help="['DEMOTE' | 'DROP'] what to do with the words above '-max-df'"
+    )
+    parser.add_argument(
+        '-plans',
+        dest='plans',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to add the plan of every query to the results: its "+
+              "words, their document frequencies, how each one is scored and "+
+              "its estimated postings")
+    )
+    parser.add_argument(
+        '-rounds',
+        dest='rounds',
+        action='store',
+        required=False,
+        type=int,
+        default=1,
+        help="Number of times to replay each file of queries"
+    )
+    parser.add_argument(
+        '-o',
+        dest='output',
+        action='store',
+        required=False,
+        type=str,
+        help="Path to write the results to, as JSON"
+    )
+    parser.add_argument(
+        '-baseline',
+        dest='baseline',
+        action='store',
+        required=False,
+        type=str,
+        help=("Path to the results of a previous run to compare with. Exits "+
+              "with status 1 if any metric regressed")
+    )
+    parser.add_argument(
+        '-tolerance',
+        dest='tolerance',
+        action='store',
+        required=False,
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=("Fraction of the baseline a metric may worsen by before it is "+
+              "flagged as a regression")
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    queries_fpaths = sorted(glob.glob(args.queries), key=_queries_size)
+    index_fpath = args.index_file
+    if index_fpath == None:
+        index_fpath = build_synthetic_index(args.workdir, args.num_docs,
+                                            queries_fpaths, args.memory_limit)
+    index_fpath = os.path.abspath(index_fpath)
+
+    query_budget = None
+    if args.query_budget != None:
+        query_budget = args.query_budget / 1000
+
+    results = []
+    # Each file of queries is measured by a new process.
+    context = multiprocessing.get_context("spawn")
+    for queries_fpath in queries_fpaths:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(measure, index_fpath, queries_fpath,
+                                     args.ranker, args.engine, args.mode,
+                                     args.rounds, query_budget,
+                                     args.postings_budget, args.max_df,
+                                     args.high_df, args.plans).result()
+        print(json.dumps(result))
+        results.append(result)
+
+    output = {
+        "Config": {
+            "Index": index_fpath,
+            "Ranker": args.ranker,
+            "Engine": args.engine,
+            "Mode": args.mode,
+            "Rounds": args.rounds,
+            "QueryBudget": args.query_budget,
+            "PostingsBudget": args.postings_budget,
+            "MaxDf": args.max_df,
+            "HighDf": args.high_df,
+        },
+        "Results": results,
+    }
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.baseline != None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(json.dumps({"Regression": regression}))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import sys
+import timeit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from common.log import log
+
+logger = log.logger()
+
+# An index of a chunk, as the one logged by the indexer: a map word ->
+# postings.
+def synthetic_index(words, postings):
+    return {f"word{i}": [(docid, 1) for docid in range(postings)]
+            for i in range(words)}
+
+# Each benchmark is a statement logging the index, or its size, in one of the
+# ways the code can log it, run with logging off, as it is by default.
+BENCHMARKS = {
+    "No logging": "pass",
+    "Eager f-string": 'logger.debug(f"Index result: {index}")',
+    "Eager f-string, size": 'logger.debug(f"Index result: {len(index)} words")',
+    "Lazy %-style, size": 'logger.debug("Index result: %d words", len(index))',
+    "Guarded": ('if log.enabled(log.DEBUG):\n'+
+                '    logger.debug(f"Index result: {index}")'),
+    "Lazy argument": ('logger.debug("Index result: %s postings", '+
+                      'log.lazy(sum, map(len, index.values())))'),
+    "Trace, not sampled": ('log.trace("Index result: %s postings", '+
+                           'log.lazy(sum, map(len, index.values())))'),
+    "Tracing check": "if log.tracing(): pass",
+}
+
+def run_benchmark(statement, index, number):
+    namespace = {"log": log, "logger": logger, "index": index}
+    timer = timeit.Timer(statement, globals=namespace)
+    # The best of several repetitions is the least disturbed by the rest of
+    # the system.
+    seconds = min(timer.repeat(repeat=5, number=number))
+    return {"Calls": number, "Ns per call": round(1e9 * seconds / number, 1)}
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure the cost of log statements with logging off.')
+    parser.add_argument(
+        '-words',
+        dest='words',
+        action='store',
+        required=False,
+        type=int,
+        default=1000,
+        help="Number of words of the logged index"
+    )
+    parser.add_argument(
+        '-postings',
+        dest='postings',
+        action='store',
+        required=False,
+        type=int,
+        default=10,
+        help="Number of postings of each word of the logged index"
+    )
+    parser.add_argument(
+        '-number',
+        dest='number',
+        action='store',
+        required=False,
+        type=int,
+        default=10000,
+        help="Number of calls of each benchmark"
+    )
+    parser.add_argument(
+        '-o',
+        dest='output',
+        action='store',
+        required=False,
+        type=str,
+        help="Path to write all the results to, as JSON"
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    index = synthetic_index(args.words, args.postings)
+    results = []
+    for name, statement in BENCHMARKS.items():
+        # Formatting the whole index is orders of magnitude slower than the
+        # others, so it is called less.
+        number = args.number
+        if name == "Eager f-string":
+            number = max(1, number // 100)
+        result = {"Benchmark": name}
+        result.update(run_benchmark(statement, index, number))
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
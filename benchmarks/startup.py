@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each benchmark is a command run in a new Python process from the root of the
+# repository, so that it pays for the whole interpreter startup and imports.
+BENCHMARKS = {
+    # The command line tools, which import all their modules but do no work.
+    "processor -h": ["processor.py", "-h"],
+    "indexer -h": ["indexer.py", "-h"],
+    # The preprocessing module alone, and normalizing a first query, which
+    # initializes it.
+    "import normalize": [
+        "-c", "import common.preprocessing.normalize",
+    ],
+    "first query": [
+        "-c", ("from common.preprocessing.normalize import "+
+               "tokenize_and_normalize; "+
+               "tokenize_and_normalize('como fazer uma horta em casa')"),
+    ],
+}
+
+def run_benchmark(args, runs):
+    times = []
+    for _ in range(runs):
+        before = time.perf_counter()
+        completed = subprocess.run([sys.executable] + args, cwd=REPO_DIR,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - before
+        if completed.returncode != 0:
+            # The message of the exception may span several lines, as the
+            # ones of nltk, so its first line is reported.
+            lines = completed.stderr.decode("utf-8").strip().split("\n")
+            errors = [line for line in lines if "Error:" in line]
+            return {"Error": errors[-1] if len(errors) > 0 else lines[-1]}
+        times.append(elapsed)
+    return {
+        "Runs": runs,
+        "Min": round(min(times), 4),
+        "Median": round(statistics.median(times), 4),
+        "Max": round(max(times), 4),
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure the startup time of the command line tools.')
+    parser.add_argument(
+        '-runs',
+        dest='runs',
+        action='store',
+        required=False,
+        type=int,
+        default=10,
+        help="Number of times to run each benchmark"
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    for name, benchmark_args in BENCHMARKS.items():
+        result = {"Benchmark": name}
+        result.update(run_benchmark(benchmark_args, args.runs))
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
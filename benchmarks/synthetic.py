@@ -0,0 +1,229 @@
+import argparse
+import io
+import itertools
+import math
+import os
+import random
+import sys
+
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from common.preprocessing.normalize import read_stopwords
+
+DEFAULT_NUM_WORDS      = 50000
+DEFAULT_ZIPF_S         = 1.0
+DEFAULT_PORTUGUESE     = 0.7
+# Document lengths, in words, follow a log-normal distribution, as the ones of
+# web pages do: most pages are a few hundred words long, and a few are much
+# longer.
+DOC_LEN_MEDIAN         = 300
+DOC_LEN_SIGMA          = 0.9
+MIN_DOC_LEN            = 20
+MAX_DOC_LEN            = 10000
+MIN_SENTENCE_LEN       = 5
+MAX_SENTENCE_LEN       = 25
+
+# Frequent content words of each language, which rank right after its
+# stopwords.
+COMMON_WORDS = {
+    "portuguese": """
+        ano anos dia dias vez vezes casa tempo parte vida governo brasil
+        cidade estado país mundo trabalho empresa pessoas forma caso grande
+        novo nova primeiro segundo melhor maior público saúde escola projeto
+        programa sistema serviço dinheiro preço história notícias fazer ser
+        ter ver dar poder saber querer ficar chegar passar deixar receita
+        comida futebol música viagem praia carro livro horta água informação
+        educação população situação produção relação questão
+        """.split(),
+    "english": """
+        time year people way day man thing woman life child world school
+        state family student group country problem hand part place case week
+        company system program question work government number night point
+        home water room mother area money story fact month lot right study
+        make know take see come think look want give use find tell ask seem
+        feel try leave call good new first last long great little own other
+        """.split(),
+}
+
+# Syllables of the synthetic words of each language, so that they are stemmed
+# like real words of the language.
+SYLLABLES = {
+    "portuguese": """
+        a e i o u ba be bi bo bu ca co cu da de di do du fa fe fi fo ga go gu
+        la le li lo lu ma me mi mo mu na ne ni no nu pa pe pi po pu ra re ri
+        ro ru sa se si so su ta te ti to tu va ve vi vo lha lho nha nho cha
+        che ção ções mente dade ão ões és ém ível
+        """.split(),
+    "english": """
+        a e i o u ba be bi bo ca co da de di do fa fe fi ga go ha he hi ho la
+        le li lo ma me mi mo na ne ni no pa pe pi po ra re ri ro sa se si so
+        ta te ti to th sh ch ing er ed ly tion ness ment able est
+        """.split(),
+}
+
+LANGUAGES = ["portuguese", "english"]
+
+# synthetic_words returns num_words distinct random words of the language,
+# made of its syllables.
+def synthetic_words(language, num_words, rnd):
+    syllables = SYLLABLES[language]
+    words = set()
+    while len(words) < num_words:
+        words.add("".join(rnd.choice(syllables)
+                          for _ in range(rnd.randint(2, 4))))
+    return sorted(words)
+
+# vocabulary returns the words of the language, by decreasing frequency: its
+# stopwords, its common words and num_words synthetic words. The given words,
+# like the words of benchmark queries, are inserted at random ranks, so that
+# queries have lists of very different lengths. Ranks are log-uniform, so that
+# as many of them are among the most frequent ten words as among the next
+# hundred, and so on.
+def vocabulary(language, num_words, words, rnd):
+    vocabulary = list(dict.fromkeys(read_stopwords(language) +
+                                    COMMON_WORDS[language]))
+    known = set(vocabulary)
+    vocabulary += [word for word in synthetic_words(language, num_words, rnd)
+                   if word not in known]
+    for word in sorted(set(words or [])):
+        rank = int(math.exp(rnd.uniform(0, math.log(len(vocabulary) + 1))))
+        vocabulary.insert(rank - 1, word)
+    return vocabulary
+
+def doc_len(rnd):
+    doc_len = int(rnd.lognormvariate(math.log(DOC_LEN_MEDIAN), DOC_LEN_SIGMA))
+    return min(max(doc_len, MIN_DOC_LEN), MAX_DOC_LEN)
+
+# doc_text returns a text of doc_len words drawn from the vocabulary, split in
+# sentences.
+def doc_text(vocabulary, cum_weights, doc_len, rnd):
+    words = rnd.choices(vocabulary, cum_weights=cum_weights, k=doc_len)
+    sentences = []
+    start = 0
+    while start < len(words):
+        end = start + rnd.randint(MIN_SENTENCE_LEN, MAX_SENTENCE_LEN)
+        sentence = " ".join(words[start:end])
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        start = end
+    return " ".join(sentences)
+
+# write_corpus writes a synthetic corpus of num_docs documents, split in
+# num_files compressed WARC files, to dpath. Each document is in Portuguese,
+# with probability portuguese, or in English, and its words follow a Zipf
+# distribution over the vocabulary of its language. The corpus only depends on
+# the arguments.
+def write_corpus(dpath, num_docs, num_files=1, num_words=DEFAULT_NUM_WORDS,
+                 words=None, portuguese=DEFAULT_PORTUGUESE, seed=0):
+    rnd = random.Random(seed)
+    vocabularies = {}
+    cum_weights = {}
+    for language in LANGUAGES:
+        vocabularies[language] = vocabulary(language, num_words, words, rnd)
+        cum_weights[language] = list(itertools.accumulate(
+            1 / (rank + 1) ** DEFAULT_ZIPF_S
+            for rank in range(len(vocabularies[language]))))
+
+    os.makedirs(dpath, exist_ok=True)
+    docid = 0
+    for file_idx in range(num_files):
+        file_docs = num_docs // num_files
+        if file_idx < num_docs % num_files:
+            file_docs += 1
+        fpath = os.path.join(dpath, f"part-{file_idx:05d}.warc.gz")
+        with open(fpath, "wb") as f:
+            writer = WARCWriter(f, gzip=True)
+            for _ in range(file_docs):
+                language = ("portuguese" if rnd.random() < portuguese
+                            else "english")
+                text = doc_text(vocabularies[language], cum_weights[language],
+                                doc_len(rnd), rnd)
+                http_headers = StatusAndHeaders(
+                    "200 OK", [("Content-Type", "text/plain; charset=utf-8")],
+                    protocol="HTTP/1.0")
+                record = writer.create_warc_record(
+                    f"http://synthetic.example/{file_idx}/{docid}", "response",
+                    payload=io.BytesIO(text.encode("utf-8")),
+                    http_headers=http_headers)
+                writer.write_record(record)
+                docid += 1
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic corpus of compressed WARC files.')
+    parser.add_argument(
+        '-o',
+        dest='output_dir',
+        action='store',
+        required=True,
+        type=str,
+        help="Directory to write the WARC files to"
+    )
+    parser.add_argument(
+        '-docs',
+        dest='num_docs',
+        action='store',
+        required=True,
+        type=int,
+        help="Number of documents of the corpus"
+    )
+    parser.add_argument(
+        '-files',
+        dest='num_files',
+        action='store',
+        required=False,
+        type=int,
+        default=1,
+        help="Number of WARC files to split the documents in"
+    )
+    parser.add_argument(
+        '-words',
+        dest='num_words',
+        action='store',
+        required=False,
+        type=int,
+        default=DEFAULT_NUM_WORDS,
+        help="Number of synthetic words of the vocabulary of each language"
+    )
+    parser.add_argument(
+        '-q',
+        dest='queries',
+        action='store',
+        required=False,
+        type=str,
+        help="Path to a file of queries, whose words are added to the corpus"
+    )
+    parser.add_argument(
+        '-portuguese',
+        dest='portuguese',
+        action='store',
+        required=False,
+        type=float,
+        default=DEFAULT_PORTUGUESE,
+        help="Fraction of the documents in Portuguese. The rest are in English"
+    )
+    parser.add_argument(
+        '-seed',
+        dest='seed',
+        action='store',
+        required=False,
+        type=int,
+        default=0,
+        help="Seed of the random generator"
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    words = None
+    if args.queries != None:
+        with open(args.queries, "r") as f:
+            words = f.read().split()
+    write_corpus(args.output_dir, args.num_docs, args.num_files,
+                 args.num_words, words, args.portuguese, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
+import functools
 import logging
+import random
+import threading
 
 FORMATTER = logging.Formatter('[%(levelname)s] %(asctime)s %(message)s')
+TRACE_FORMATTER = logging.Formatter('[TRACE] %(asctime)s %(message)s')
+
+DEBUG    = logging.DEBUG
+INFO     = logging.INFO
+WARNING  = logging.WARNING
+ERROR    = logging.ERROR
+CRITICAL = logging.CRITICAL
 
 ALL_LOGGING_LEVELS = {
     "DEBUG": logging.DEBUG,
@@ -11,6 +21,19 @@ ALL_LOGGING_LEVELS = {
 }
 LOGGING_LEVEL = logging.CRITICAL
 
+# Fraction of the units of work, like the chunks of the indexer or the queries
+# of the query processor, whose trace is logged, whatever the logging level.
+TRACE_SAMPLE_RATE = 0
+
+# _TraceState is whether the thread is in a unit of work, and whether it is
+# traced. Its attributes have defaults, so that threads that never started a
+# unit of work read them as cheaply as the others.
+class _TraceState(threading.local):
+    unit = False
+    traced = False
+
+_trace = _TraceState()
+
 all_loggers_map = {}
 
 def set_level(log_level_name):
@@ -49,3 +72,82 @@ def logger():
 
         all_loggers_map[logger_name] = logger
         return logger
+
+# enabled returns whether messages of the given level are logged. Messages
+# whose arguments are expensive to build, like whole indexes, must be guarded
+# by it, since the arguments of a message are built even if it is not logged.
+# Cheap arguments can be passed as %-style arguments of the logger instead,
+# which are only formatted if the message is logged.
+def enabled(level):
+    return level >= LOGGING_LEVEL
+
+# _Lazy is an argument of a message that is only computed if the message is
+# formatted.
+class _Lazy:
+    def __init__(self, f, args):
+        self._f = f
+        self._args = args
+
+    def __str__(self):
+        return str(self._f(*self._args))
+
+# lazy returns an argument of a message that is f(*args), computed only if the
+# message is logged.
+def lazy(f, *args):
+    return _Lazy(f, args)
+
+def trace_logger():
+    global all_loggers_map
+
+    logger_name = 'web-indexer.trace'
+
+    if all_loggers_map.get(logger_name):
+        return all_loggers_map.get(logger_name)
+    else:
+        logger = logging.getLogger(logger_name)
+        for h in logger.handlers:
+            logger.removeHandler(h)
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        h = logging.StreamHandler()
+        h.setFormatter(TRACE_FORMATTER)
+        logger.addHandler(h)
+
+        all_loggers_map[logger_name] = logger
+        return logger
+
+def set_trace_sample_rate(rate):
+    if rate < 0 or rate > 1:
+        raise ValueError(f"got invalid trace sample rate {rate}. Should be "+
+                         f"between 0 and 1")
+
+    global TRACE_SAMPLE_RATE
+    TRACE_SAMPLE_RATE = rate
+
+# trace_unit decorates a function so that each call to it is a unit of work,
+# traced with probability TRACE_SAMPLE_RATE. Calls made within a unit of work
+# belong to it.
+def trace_unit(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if TRACE_SAMPLE_RATE == 0 or _trace.unit:
+            return f(*args, **kwargs)
+        _trace.unit = True
+        _trace.traced = random.random() < TRACE_SAMPLE_RATE
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _trace.unit = False
+            _trace.traced = False
+    return wrapper
+
+# tracing returns whether the unit of work of the thread is traced. Loops
+# check it once, before they start.
+def tracing():
+    return _trace.traced
+
+# trace logs a message of the trace of the unit of work of the thread, if it
+# is traced. Its arguments are only formatted if it is.
+def trace(msg, *args):
+    if _trace.traced:
+        trace_logger().debug(msg, *args)
@@ -1,25 +1,86 @@
-import tracemalloc
+import os
 
 from .defs import MEGABYTE
 
-class Tracker:
-    tracking = False
+# Memory usage is sampled from /proc, which only costs reading a small file per
+# sample, so it is cheap enough to be always on. Samples are taken at the
+# points where usage is logged, and the peak of the samples since the last
+# reset_peak is kept, so that a worker knows how much memory a chunk needed.
 
-    def __init__(self):
-        Tracker.tracking = True
+PROC_STATM        = "/proc/self/statm"
+PROC_SMAPS_ROLLUP = "/proc/self/smaps_rollup"
 
-    def __del__(self):
-        tracemalloc.stop()
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
 
-    def track(self):
-        tracemalloc.start()
+TRACKING = False
+
+_peak_vm = 0
+_peak_rss = 0
+
+# track makes log_memory_usage log the usage of the process, besides sampling
+# it. Worker processes forked afterwards log theirs too.
+def track():
+    global TRACKING
+    TRACKING = True
+
+# memory_usage returns the virtual and resident sizes of the process, in
+# bytes. The virtual size is the one limited by memory_limit. Both are None if
+# /proc is not available.
+def memory_usage():
+    try:
+        with open(PROC_STATM, "rb") as f:
+            fields = f.read().split()
+    except OSError:
+        return None, None
+    return int(fields[0]) * PAGE_SIZE, int(fields[1]) * PAGE_SIZE
+
+# unique_memory_usage returns the memory only used by the process, in bytes:
+# its resident memory minus the pages it shares with its parent or workers.
+# It is slower to read than memory_usage, so it is only read to be logged.
+def unique_memory_usage():
+    uss = 0
+    try:
+        with open(PROC_SMAPS_ROLLUP, "r") as f:
+            for line in f:
+                if line.startswith("Private_"):
+                    uss += int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return uss
+
+def sample():
+    global _peak_vm
+    global _peak_rss
+
+    vm, rss = memory_usage()
+    if vm != None:
+        _peak_vm = max(_peak_vm, vm)
+        _peak_rss = max(_peak_rss, rss)
+    return vm, rss
+
+def reset_peak():
+    global _peak_vm
+    global _peak_rss
+
+    _peak_vm = 0
+    _peak_rss = 0
+    return sample()
+
+# peak_memory_usage returns the peak virtual and resident sizes sampled since
+# the last reset_peak.
+def peak_memory_usage():
+    if _peak_vm == 0:
+        return None, None
+    return _peak_vm, _peak_rss
+
+def _mb(value):
+    return f"{value / MEGABYTE:.2f}MB" if value != None else "unknown"
 
 def log_memory_usage(logger):
-    if not Tracker.tracking:
+    vm, rss = sample()
+    if not TRACKING:
         return
 
-    current_bytes, peak_bytes = tracemalloc.get_traced_memory()
-    current_mb = current_bytes / MEGABYTE
-    peak_mb = peak_bytes / MEGABYTE
-    logger.info(f"Current memory usage: {current_mb:.2f}MB. "+
-                f"Peak memory usage: {peak_mb:.2f}MB.")
+    logger.info(f"({os.getpid()}) Memory usage: RSS {_mb(rss)}, USS "+
+                f"{_mb(unique_memory_usage())}, virtual {_mb(vm)}. Peak "+
+                f"RSS {_mb(_peak_rss)}, peak virtual {_mb(_peak_vm)}.")
@@ -0,0 +1,217 @@
+from bisect import bisect_left
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+# Metrics are named spans, whose durations are aggregated in histograms, and
+# named counters. They are only recorded once enabled, and otherwise cost a
+# check of a global flag per span.
+
+FORMAT_JSON       = "JSON"
+FORMAT_PROMETHEUS = "PROMETHEUS"
+
+PROMETHEUS_PREFIX = "web_indexer"
+
+# Upper bounds, in seconds, of the buckets of the span histograms. The last
+# bucket has no upper bound.
+BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+ENABLED = False
+
+_lock = threading.Lock()
+# map span name -> [count of each bucket, count, sum]
+_histograms = {}
+# map counter name -> value
+_counters = {}
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+def enabled():
+    return ENABLED
+
+# init_process is the initializer of worker processes. Forked processes start
+# with a copy of the metrics of their parent, which are not theirs.
+def init_process(enabled):
+    global ENABLED
+    ENABLED = enabled
+    reset()
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def observe(name, seconds):
+    bucket = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram == None:
+            histogram = [[0] * (len(BUCKETS) + 1), 0, 0]
+            _histograms[name] = histogram
+        histogram[0][bucket] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+
+def add(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+class _Span:
+    def __init__(self, name):
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self._name, time.perf_counter() - self._start)
+        return False
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+# span returns a context manager that records the time spent in it under name.
+def span(name):
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name)
+
+# timed decorates a function so that every call to it is a span.
+def timed(name):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# snapshot returns a copy of the metrics recorded so far, which can be sent to
+# another process and merged into its metrics.
+def snapshot():
+    with _lock:
+        return {
+            "Spans": {name: [list(histogram[0]), histogram[1], histogram[2]]
+                      for name, histogram in _histograms.items()},
+            "Counters": dict(_counters),
+        }
+
+# collect returns the metrics recorded so far, and resets them, so that a
+# worker process only sends each of its metrics once. It returns None if
+# metrics are disabled.
+def collect():
+    if not ENABLED:
+        return None
+    metrics = snapshot()
+    reset()
+    return metrics
+
+def merge(metrics):
+    if metrics == None:
+        return
+    with _lock:
+        for name, (buckets, count, total) in metrics["Spans"].items():
+            histogram = _histograms.get(name)
+            if histogram == None:
+                histogram = [[0] * (len(BUCKETS) + 1), 0, 0]
+                _histograms[name] = histogram
+            for i, bucket_count in enumerate(buckets):
+                histogram[0][i] += bucket_count
+            histogram[1] += count
+            histogram[2] += total
+        for name, value in metrics["Counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+# span_sums returns the total time spent in the spans of each name with the
+# given prefix, by name.
+def span_sums(prefix):
+    with _lock:
+        return {name: histogram[2] for name, histogram in
+                sorted(_histograms.items()) if name.startswith(prefix)}
+
+# _quantile estimates a quantile of a span as the upper bound of the bucket it
+# falls in.
+def _quantile(buckets, count, q):
+    rank = q * count
+    cumulative = 0
+    for i, bucket_count in enumerate(buckets):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+    return float("inf")
+
+def to_json():
+    metrics = snapshot()
+    spans = {}
+    for name, (buckets, count, total) in sorted(metrics["Spans"].items()):
+        spans[name] = {
+            "Count": count,
+            "Sum": round(total, 6),
+            "Mean": round(total / count, 6) if count > 0 else 0,
+            "P50": _quantile(buckets, count, 0.5),
+            "P95": _quantile(buckets, count, 0.95),
+            "P99": _quantile(buckets, count, 0.99),
+            "Buckets": {str(le): bucket_count for le, bucket_count in
+                        zip(BUCKETS + ["+Inf"], buckets)},
+        }
+    return json.dumps({"Spans": spans,
+                       "Counters": dict(sorted(metrics["Counters"].items()))},
+                      indent=2)
+
+def _prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+# to_prometheus returns the metrics in the Prometheus text format: one
+# histogram of span durations, labeled by span, and one counter per counter.
+def to_prometheus():
+    metrics = snapshot()
+    histogram_name = f"{PROMETHEUS_PREFIX}_span_seconds"
+    lines = [f"# TYPE {histogram_name} histogram"]
+    for name, (buckets, count, total) in sorted(metrics["Spans"].items()):
+        cumulative = 0
+        for le, bucket_count in zip(BUCKETS + ["+Inf"], buckets):
+            cumulative += bucket_count
+            lines.append(f'{histogram_name}_bucket{{span="{name}",le="{le}"}} '+
+                         f'{cumulative}')
+        lines.append(f'{histogram_name}_sum{{span="{name}"}} {total}')
+        lines.append(f'{histogram_name}_count{{span="{name}"}} {count}')
+    for name, value in sorted(metrics["Counters"].items()):
+        counter_name = f"{PROMETHEUS_PREFIX}_{_prometheus_name(name)}_total"
+        lines.append(f"# TYPE {counter_name} counter")
+        lines.append(f"{counter_name} {value}")
+    return "\n".join(lines) + "\n"
+
+# write writes the metrics to fpath in the given format, JSON by default. The
+# file is replaced at once, so that it can be read by a collector at any time.
+def write(fpath, format=None):
+    format = format or FORMAT_JSON
+    if format == FORMAT_JSON:
+        content = to_json()
+    elif format == FORMAT_PROMETHEUS:
+        content = to_prometheus()
+    else:
+        raise ValueError(f"Invalid metrics format {format}")
+    with open(fpath + "_", "w") as f:
+        f.write(content)
+    os.replace(fpath + "_", fpath)
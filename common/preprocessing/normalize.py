@@ -1,24 +1,87 @@
-import nltk
+import os
+import threading
 
-nltk.download('punkt', quiet=True)
-nltk.download('stopwords', quiet=True)
+# nltk is only imported, and its data only looked up, the first time a text is
+# tokenized or a word normalized, so that importing this module is cheap. The
+# stopwords are read from the lists bundled in STOPWORDS_DIR, which are the
+# ones of nltk, instead of being downloaded. The punkt tokenizer models are not
+# bundled, and must be installed beforehand, with nltk.download('punkt').
+STOPWORDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "stopwords")
+STOPWORDS_LANGUAGES = ["portuguese", "english"]
 
 PUNCTUATIONS = set([',', '.', '[', ']', '(', ')', '{', '}', '/', '\\'])
-STOPWORDS = set(nltk.corpus.stopwords.words('portuguese') +
-                nltk.corpus.stopwords.words('english'))
-STEMMERS = [nltk.stem.snowball.PortugueseStemmer(),
-            #nltk.stem.snowball.EnglishStemmer(),
-]
 
 MIN_CHARS_WORD = 3
 MAX_CHARS_WORD = 20
 
+_word_tokenize = None
+_stopwords = None
+_stemmers = None
+
+# Texts are tokenized from thread pools, so initialization is serialized, and
+# the globals are only set once everything they need is ready.
+_init_lock = threading.Lock()
+
+def read_stopwords(language):
+    with open(os.path.join(STOPWORDS_DIR, language), "r",
+              encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() != ""]
+
+def _init_tokenizer():
+    global _word_tokenize
+
+    with _init_lock:
+        if _word_tokenize != None:
+            return
+
+        import nltk
+
+        # Downloading the models here would hang offline runs, which retry
+        # failed chunks, so missing models are an error instead.
+        try:
+            nltk.data.find('tokenizers/punkt')
+        except LookupError:
+            raise RuntimeError("nltk punkt tokenizer models not found. "+
+                               "Install them with "+
+                               "\"python3 -m nltk.downloader punkt\"")
+        _word_tokenize = nltk.word_tokenize
+
+def _init_normalizer():
+    global _stopwords, _stemmers
+
+    with _init_lock:
+        if _stopwords != None:
+            return
+
+        from nltk.stem.snowball import PortugueseStemmer
+
+        stopwords = set(word for language in STOPWORDS_LANGUAGES
+                        for word in read_stopwords(language))
+        stemmers = [PortugueseStemmer(),
+                    #EnglishStemmer(),
+        ]
+        # normalize_word only checks _stopwords, so it is set last.
+        _stemmers = stemmers
+        _stopwords = stopwords
+
+# check_tokenizer raises if the tokenizer cannot be initialized, so that
+# callers can fail before handing texts to workers.
+def check_tokenizer():
+    if _word_tokenize == None:
+        _init_tokenizer()
+
 def tokenize(s):
-    return nltk.word_tokenize(s)
+    if _word_tokenize == None:
+        _init_tokenizer()
+    return _word_tokenize(s)
 
 def normalize_word(word):
+    if _stopwords == None:
+        _init_normalizer()
+
     # Stopword removal
-    if word in STOPWORDS:
+    if word in _stopwords:
         return None
 
     # Malformed words removal.
@@ -29,19 +92,26 @@ def normalize_word(word):
         return None
 
     normalized_word = word
-    for stemmer in STEMMERS:
+    for stemmer in _stemmers:
         normalized_word = stemmer.stem(normalized_word)
     if len(normalized_word) > MAX_CHARS_WORD:
         normalized_word = normalized_word[:20]
 
     return normalized_word
 
-def tokenize_and_normalize(s):
+# tokenize_and_normalize looks up the tokens in vocabulary, a map of surface
+# forms to the words they normalize to, if given, and only normalizes the ones
+# not in it.
+def tokenize_and_normalize(s, vocabulary=None):
     tokens = tokenize(s)
 
     normalized_tokens = []
     for token in tokens:
-        normalized_token = normalize_word(token)
+        normalized_token = None
+        if vocabulary != None:
+            normalized_token = vocabulary.get(token)
+        if normalized_token == None:
+            normalized_token = normalize_word(token)
         if normalized_token != None:
             normalized_tokens.append(normalized_token)
 
@@ -0,0 +1,270 @@
+import cProfile
+import glob
+from multiprocessing import util
+import multiprocessing
+import os
+import pickle
+import pstats
+import re
+import shutil
+import sys
+import threading
+
+# The profiler profiles the main process and every worker process and thread,
+# into a single report. Each process records its own profile, and writes it to
+# the spool directory of the run when it exits; the main process merges all of
+# them when it writes the report.
+#
+# In deterministic mode every call is timed, with cProfile. In sampling mode,
+# the stacks of all threads are only recorded every SAMPLING_INTERVAL seconds,
+# which costs much less. Stacks are sampled in both modes, for flame graphs.
+
+MODE_DETERMINISTIC = "DETERMINISTIC"
+MODE_SAMPLING      = "SAMPLING"
+
+SAMPLING_INTERVAL = 0.01
+
+SPOOL_SUFFIX = ".d"
+
+# From Python 3.12 on, a profiler profiles all the threads of the process.
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+# (mode, spool dpath) of the run, or None if it is not profiled.
+_config = None
+# The profiles of the threads of this process, in deterministic mode.
+_profiles = []
+_profiles_lock = threading.Lock()
+_sampler = None
+
+# _Sampler records the stack of every other thread of the process every
+# interval seconds, with the name of the thread.
+class _Sampler:
+    def __init__(self, interval):
+        self.interval = interval
+        # map (thread, stack) -> number of samples. Stacks go from the
+        # outermost call to the innermost one.
+        self.samples = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="profiler-sampler")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        ident = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == ident:
+                    continue
+                stack = []
+                while frame != None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno,
+                                  code.co_name))
+                    frame = frame.f_back
+                stack.reverse()
+                key = (_role(names.get(thread_id, "Thread")), tuple(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+# _role is the name of a process or thread without its number, so that the
+# stacks of all the workers of a pool are merged.
+def _role(name):
+    return re.sub(r"[-_:0-9]+$", "", name) or name
+
+def enabled():
+    return _config != None
+
+# config returns what worker processes need to profile themselves, given to
+# init_process.
+def config():
+    return _config
+
+def _profile_thread(frame, event, arg):
+    sys.setprofile(None)
+    profile = cProfile.Profile()
+    with _profiles_lock:
+        _profiles.append(profile)
+    profile.enable()
+
+def _start():
+    global _sampler
+
+    mode = _config[0]
+    # The sampler is started first, so that it is not profiled itself.
+    _sampler = _Sampler(SAMPLING_INTERVAL)
+    _sampler.start()
+    if mode == MODE_DETERMINISTIC:
+        if not PROFILES_ALL_THREADS:
+            threading.setprofile(_profile_thread)
+        profile = cProfile.Profile()
+        _profiles.append(profile)
+        profile.enable()
+
+def _stop():
+    global _sampler
+
+    if _sampler != None:
+        _sampler.stop()
+    threading.setprofile(None)
+    for profile in _profiles:
+        profile.disable()
+
+# start profiles this process, and the worker processes initialized with
+# init_process, in the given mode, DETERMINISTIC by default.
+def start(fpath, mode=None):
+    global _config
+
+    mode = mode or MODE_DETERMINISTIC
+    if mode not in [MODE_DETERMINISTIC, MODE_SAMPLING]:
+        raise ValueError(f"Invalid profile mode {mode}")
+
+    spool_dpath = os.path.abspath(fpath + SPOOL_SUFFIX)
+    shutil.rmtree(spool_dpath, ignore_errors=True)
+    os.makedirs(spool_dpath)
+    _config = (mode, spool_dpath)
+    _start()
+
+# init_process is called by the initializer of worker processes. Forked
+# processes start with the profiles of their parent, which are not theirs, and
+# without its sampler thread. The profile of the worker is written when it
+# exits, so pools must be shut down, rather than terminated, to be profiled.
+def init_process(config):
+    global _config
+    global _profiles
+    global _sampler
+
+    for profile in _profiles:
+        profile.disable()
+    sys.setprofile(None)
+    threading.setprofile(None)
+    _profiles = []
+    _sampler = None
+    _config = config
+    if _config == None:
+        return
+
+    _start()
+    util.Finalize(None, _spool, exitpriority=0)
+
+def _thread_stats():
+    stats = pstats.Stats()
+    with _profiles_lock:
+        for profile in _profiles:
+            # Unlike create_stats, snapshot_stats does not disable the
+            # profile, which would disable the one of the calling thread.
+            profile.snapshot_stats()
+            if len(profile.stats) > 0:
+                stats.add(_StatsDict(profile.stats))
+    return stats.stats
+
+# _spool stops profiling this process and writes its profile to the spool
+# directory of the run.
+def _spool():
+    _stop()
+    profile = {
+        "Process": _role(multiprocessing.current_process().name),
+        "Stats": _thread_stats(),
+        "Samples": _sampler.samples if _sampler != None else {},
+        "Interval": SAMPLING_INTERVAL,
+    }
+    fpath = os.path.join(_config[1], f"{os.getpid()}.profile")
+    with open(fpath + "_", "wb") as f:
+        pickle.dump(profile, f)
+    os.replace(fpath + "_", fpath)
+
+# _StatsDict lets pstats load a stats dictionary, like the ones of the profiles
+# of other processes.
+class _StatsDict:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+# _sampled_stats returns the stats dictionary of pstats for sampled stacks.
+# Call counts are numbers of samples, and times are estimated from them.
+def _sampled_stats(samples, interval):
+    # map function -> [primitive calls, calls, own time, cumulative time,
+    # callers]
+    stats = {}
+    for (process, thread, stack), count in samples.items():
+        if len(stack) == 0:
+            continue
+        seconds = count * interval
+        seen = set()
+        for i, func in enumerate(stack):
+            # Recursive calls are only counted once per sample.
+            if func in seen:
+                continue
+            seen.add(func)
+            entry = stats.get(func)
+            if entry == None:
+                entry = [0, 0, 0, 0, {}]
+                stats[func] = entry
+            entry[0] += count
+            entry[1] += count
+            entry[3] += seconds
+            if i > 0:
+                own = seconds if i == len(stack) - 1 else 0
+                cc, nc, tt, ct = entry[4].get(stack[i - 1], (0, 0, 0, 0))
+                entry[4][stack[i - 1]] = (cc + count, nc + count, tt + own,
+                                          ct + seconds)
+        stats[stack[-1]][2] += seconds
+    return {func: tuple(entry) for func, entry in stats.items()}
+
+def _frame_name(func):
+    filename, lineno, name = func
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+def _collapsed(samples):
+    lines = []
+    for (process, thread, stack), count in samples.items():
+        frames = [process, thread] + [_frame_name(func) for func in stack]
+        lines.append(";".join(frame.replace(";", ":") for frame in frames) +
+                     f" {count}")
+    return "\n".join(sorted(lines)) + "\n"
+
+# write stops profiling and writes the profile of the run, merged over all
+# its processes and threads, to fpath.pstats, readable with pstats, and to
+# fpath.collapsed, with one line per sampled stack, for flame graphs. Worker
+# processes must have exited by then.
+def write(fpath):
+    global _config
+
+    if _config == None:
+        return
+    mode, spool_dpath = _config
+    _spool()
+    _config = None
+
+    stats = pstats.Stats()
+    samples = {}
+    interval = SAMPLING_INTERVAL
+    for profile_fpath in sorted(glob.glob(os.path.join(spool_dpath,
+                                                       "*.profile"))):
+        with open(profile_fpath, "rb") as f:
+            profile = pickle.load(f)
+        interval = profile["Interval"]
+        for (thread, stack), count in profile["Samples"].items():
+            key = (profile["Process"], thread, stack)
+            samples[key] = samples.get(key, 0) + count
+        if len(profile["Stats"]) > 0:
+            stats.add(_StatsDict(profile["Stats"]))
+    shutil.rmtree(spool_dpath, ignore_errors=True)
+
+    if mode == MODE_SAMPLING:
+        stats = pstats.Stats()
+        sampled_stats = _sampled_stats(samples, interval)
+        if len(sampled_stats) > 0:
+            stats.add(_StatsDict(sampled_stats))
+    stats.dump_stats(fpath + ".pstats")
+    with open(fpath + ".collapsed_", "w") as f:
+        f.write(_collapsed(samples))
+    os.replace(fpath + ".collapsed_", fpath + ".collapsed")
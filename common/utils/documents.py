@@ -0,0 +1,131 @@
+import io
+import mmap
+import os
+import struct
+
+from warcio.archiveiterator import ArchiveIterator
+
+from common.log import log
+
+logger = log.logger()
+
+DOCUMENTS_SUFFIX = ".docs"
+
+# The documents table of an index file has the location of the WARC record of
+# every document of the index, so that documents can be read back by seeking
+# directly to them instead of scanning the corpus. Entries have a fixed size
+# and are sorted by docid, so the entry of a docid is found by binary search.
+# Fixed-size integers are little endian:
+#
+#   header:   magic, number of documents (uint64)
+#   entries:  for each document, docid (uint32), index of its WARC file
+#             (uint32), offset of its record in the file (uint64), length of
+#             the record (uint32)
+#   files:    for each WARC file, path length (uint16), path (utf-8)
+#   footer:   offset of the files (uint64)
+#
+# The offset and length of a record are the ones of its gzip member in
+# compressed WARC files.
+DOCUMENTS_MAGIC = b"DOCX"
+HEADER_FORMAT   = "<4sQ"
+ENTRY_FORMAT    = "<IIQI"
+FILE_FORMAT     = "<H"
+FOOTER_FORMAT   = "<Q"
+
+def documents_fpath(index_fpath):
+    return index_fpath + DOCUMENTS_SUFFIX
+
+def has_documents(index_fpath):
+    return os.path.exists(documents_fpath(index_fpath))
+
+def _read_files(f, fpath):
+    header_size = struct.calcsize(HEADER_FORMAT)
+    magic, num_docs = struct.unpack(HEADER_FORMAT, f.read(header_size))
+    if magic != DOCUMENTS_MAGIC:
+        raise ValueError(f"'{fpath}' is not a documents table")
+
+    footer_size = struct.calcsize(FOOTER_FORMAT)
+    f.seek(-footer_size, os.SEEK_END)
+    files_end = f.tell()
+    files_offset, = struct.unpack(FOOTER_FORMAT, f.read(footer_size))
+    f.seek(files_offset)
+    data = f.read(files_end - files_offset)
+
+    files = []
+    file_size = struct.calcsize(FILE_FORMAT)
+    pos = 0
+    while pos < len(data):
+        fpath_len, = struct.unpack_from(FILE_FORMAT, data, pos)
+        pos += file_size
+        files.append(data[pos:pos + fpath_len].decode("utf-8"))
+        pos += fpath_len
+    return num_docs, files
+
+# read_documents yields the (docid, WARC file, offset, length) of every
+# document of a documents table, by increasing docid.
+def read_documents(fpath):
+    with open(fpath, "rb") as f:
+        num_docs, files = _read_files(f, fpath)
+        f.seek(struct.calcsize(HEADER_FORMAT))
+        entry_size = struct.calcsize(ENTRY_FORMAT)
+        for _ in range(num_docs):
+            docid, file_idx, offset, length = struct.unpack(
+                ENTRY_FORMAT, f.read(entry_size))
+            yield docid, files[file_idx], offset, length
+
+# DocumentsTable reads the documents table of an index file. Only its WARC
+# files are kept in memory; entries are looked up in the memory-mapped table.
+class DocumentsTable:
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self._files = None
+        self._num_docs = 0
+        self._entries = None
+
+    def init(self):
+        logger.info(f"Reading documents table from '{self.fpath}'")
+
+        with open(self.fpath, "rb") as f:
+            self._num_docs, self._files = _read_files(f, self.fpath)
+            self._entries = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        logger.info(f"Successfully read documents table from '{self.fpath}'. "+
+                    f"Documents: {self._num_docs}. WARC files: "+
+                    f"{len(self._files)}")
+
+    def _entry(self, i):
+        return struct.unpack_from(ENTRY_FORMAT, self._entries,
+                                  struct.calcsize(HEADER_FORMAT) +
+                                  i * struct.calcsize(ENTRY_FORMAT))
+
+    # location returns the (WARC file, offset, length) of the record of the
+    # document, or None if the document is not in the table.
+    def location(self, docid):
+        low = 0
+        high = self._num_docs
+        while low < high:
+            mid = (low + high) // 2
+            if self._entry(mid)[0] < docid:
+                low = mid + 1
+            else:
+                high = mid
+        if low == self._num_docs:
+            return None
+        entry_docid, file_idx, offset, length = self._entry(low)
+        if entry_docid != docid:
+            return None
+        return self._files[file_idx], offset, length
+
+# read_document reads the record at the given location of a WARC file, and
+# returns its content, or None if it has no record with the given URL. The
+# location of a document in a WARC file compressed as a whole holds several
+# records, so the record is looked up by URL.
+def read_document(fpath, offset, length, url=None):
+    with open(fpath, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    for record in ArchiveIterator(io.BytesIO(data)):
+        record_url = record.rec_headers.get_header('WARC-Target-URI')
+        if url == None or record_url == url:
+            return record.content_stream().read()
+    return None
@@ -0,0 +1,113 @@
+import os
+import struct
+
+from common.log import log
+
+logger = log.logger()
+
+IMPACTS_SUFFIX = ".impacts"
+
+IMPACT_BITS = 8
+MAX_IMPACT  = (1 << IMPACT_BITS) - 1
+
+# The impacts file of an index stores, for each word, the BM25 contribution of
+# every posting precomputed at index time and quantized to IMPACT_BITS bits.
+# The postings of a word are grouped in blocks of equal impact, sorted by
+# decreasing impact, and the docids of a block are sorted. All integers are
+# little endian:
+#
+#   header:      magic, scale (float64)
+#   blocks:      impact (uint8), count (uint32), count docids (uint32)
+#   dictionary:  for each word, word length (uint16), word (utf-8),
+#                offset of its first block (uint64), number of blocks (uint32)
+#   footer:      offset of the dictionary (uint64)
+#
+# The BM25 contribution of a posting is approximately impact * scale.
+#
+# Docids are fixed width, so any docid of a block can be reached directly, and
+# blocks need no skips.
+IMPACTS_MAGIC  = b"IMPX"
+HEADER_FORMAT  = "<4sd"
+BLOCK_FORMAT   = "<BI"
+DOCID_FORMAT   = "<{}I"
+WORD_FORMAT    = "<H"
+ENTRY_FORMAT   = "<QI"
+FOOTER_FORMAT  = "<Q"
+
+def impacts_fpath(index_fpath):
+    return index_fpath + IMPACTS_SUFFIX
+
+def has_impacts(index_fpath):
+    return os.path.exists(impacts_fpath(index_fpath))
+
+# ImpactBlock is a group of postings of a word with the same impact.
+class ImpactBlock:
+    __slots__ = ["impact", "docids"]
+
+    def __init__(self, impact, docids):
+        self.impact = impact
+        self.docids = docids
+
+# ImpactIndex reads the impact-ordered lists of an impacts file. Only the
+# dictionary entries of the given words are kept in memory; blocks are read
+# from disk when asked for.
+class ImpactIndex:
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.scale = None
+        self._entries = {}
+
+    def init(self, words):
+        logger.info(f"Reading impacts dictionary from '{self.fpath}'")
+
+        if words != None:
+            words = set(words)
+        with open(self.fpath, "rb") as f:
+            magic, self.scale = struct.unpack(
+                HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+            if magic != IMPACTS_MAGIC:
+                raise ValueError(f"'{self.fpath}' is not an impacts file")
+
+            footer_size = struct.calcsize(FOOTER_FORMAT)
+            f.seek(-footer_size, os.SEEK_END)
+            dictionary_end = f.tell()
+            dictionary_offset, = struct.unpack(FOOTER_FORMAT, f.read(footer_size))
+            f.seek(dictionary_offset)
+            dictionary = f.read(dictionary_end - dictionary_offset)
+
+        word_size = struct.calcsize(WORD_FORMAT)
+        entry_size = struct.calcsize(ENTRY_FORMAT)
+        pos = 0
+        while pos < len(dictionary):
+            word_len, = struct.unpack_from(WORD_FORMAT, dictionary, pos)
+            pos += word_size
+            word = dictionary[pos:pos + word_len].decode("utf-8")
+            pos += word_len
+            if words == None or word in words:
+                self._entries[word] = struct.unpack_from(ENTRY_FORMAT,
+                                                         dictionary, pos)
+            pos += entry_size
+
+        logger.info(f"Successfully read impacts dictionary from "+
+                    f"'{self.fpath}'. Words found: {len(self._entries)}")
+
+    def has_word(self, word):
+        return word in self._entries
+
+    # blocks returns an iterator over the blocks of the word, by decreasing
+    # impact. Blocks are read from disk one at a time, as they are asked for,
+    # so that the ones after the last block needed are not read at all.
+    def blocks(self, word):
+        if word not in self._entries:
+            return
+        offset, num_blocks = self._entries[word]
+
+        block_size = struct.calcsize(BLOCK_FORMAT)
+        with open(self.fpath, "rb") as f:
+            f.seek(offset)
+            for _ in range(num_blocks):
+                impact, count = struct.unpack(BLOCK_FORMAT, f.read(block_size))
+                docid_format = DOCID_FORMAT.format(count)
+                docids = struct.unpack(docid_format,
+                                       f.read(struct.calcsize(docid_format)))
+                yield ImpactBlock(impact, docids)
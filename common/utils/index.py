@@ -1,8 +1,15 @@
+from array import array
+import json
+
 from common.log import log
 from common.utils.utils import read_max
 
 logger = log.logger()
 
+# Every SKIP_INTERVAL postings of a list, its skips record the docid of the
+# posting and where it starts in the list.
+SKIP_INTERVAL = 64
+
 # read_index reads the inverted index in given file. It tries to use as little
 # memory as possible, based on the argument max_read_chars.
 def read_index(infpath, checkpoint, max_read_chars):
@@ -18,8 +25,8 @@ def read_index(infpath, checkpoint, max_read_chars):
     inverted_lists = index_str.split("\n")
     del index_str
     for inverted_list in inverted_lists:
-        word, postings = postings_from_str(inverted_list)
-        if len(postings) > 1:
+        word, postings = decode_list(inverted_list)
+        if len(postings[0]) > 1:
             index[word] = postings
 
     if len(inverted_lists) > 0:
@@ -29,22 +36,182 @@ def read_index(infpath, checkpoint, max_read_chars):
 
     return index, checkpoint
 
-def postings_from_str(s):
-    split_by_space = s.strip().split(" ")
-    if len(split_by_space) <= 1:
-        return '', []
-    word = split_by_space[0]
-    postings = []
-    for docfreq_str in split_by_space[1:]:
-        docfreq_split = docfreq_str.split(",")
-        postings.append((int(docfreq_split[0]), int(docfreq_split[1])))
-    del split_by_space
-    return word, postings
+# decode_postings decodes the postings of a list, given as the string that
+# follows the word in its line, into an array of docids and an array of
+# frequencies. With its spaces turned into commas, the string is a JSON array
+# of the docids and frequencies, which the JSON decoder splits and converts in
+# a single pass in C.
+def decode_postings(postings_str):
+    numbers = array("q", json.loads(
+        "[" + postings_str.strip().replace(" ", ",") + "]"))
+    return numbers[0::2], numbers[1::2]
+
+# decode_list decodes a line of the index into its word and the (docids, freqs)
+# arrays of its postings. Lines without postings have an empty word.
+def decode_list(line):
+    split_line = line.strip().split(" ", 1)
+    if len(split_line) < 2:
+        return '', (array("q"), array("q"))
+    return split_line[0], decode_postings(split_line[1])
 
 def index_docids(index):
     all_docids = set()
     for word in index:
-        postings = index[word]
-        docids = [posting[0] for posting in postings]
+        docids, _ = index[word]
         all_docids = all_docids.union(docids)
     return all_docids
+
+# _gallop returns the first index in [lo, hi) whose docid is >= target, or hi if
+# there is none, probing exponentially growing steps from lo before a binary
+# search, so that close targets are found in few steps.
+def _gallop(docids, target, lo, hi):
+    step = 1
+    while lo + step < hi and docids[lo + step] < target:
+        lo += step
+        step *= 2
+    hi = min(lo + step + 1, hi)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if docids[mid] < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+# PostingsCursor iterates over the postings of a list of the text index, given
+# as the string that follows the word in its line. The skips of the list split
+# it into blocks of SKIP_INTERVAL postings, block i + 1 starting at skip i, and
+# postings are decoded a block at a time, in bulk, when the cursor moves past
+# the first posting of the block. next_geq jumps over whole blocks using the
+# skips, without decoding them. A list without skips is a single block. docid
+# is None once the cursor is exhausted, and index is the index of the current
+# posting in the list.
+class PostingsCursor:
+    def __init__(self, postings_str, skips=None):
+        self._s = postings_str
+        self._skip_docids = [docid for docid, _ in skips or []]
+        self._skip_offsets = [offset for _, offset in skips or []]
+
+        # Only the first posting is parsed until the cursor moves, since many
+        # lists are only probed, or not read at all once the first posting is
+        # known.
+        self._block = 0
+        self._block_idx = 0
+        self._docids = None
+        self._freqs = None
+        self.index = -1
+        self.docid = None
+        self.freq = None
+        if len(self._s) > 0:
+            end = self._s.find(" ")
+            if end == -1:
+                end = len(self._s)
+            comma = self._s.index(",", 0, end)
+            self.index = 0
+            self.docid = int(self._s[:comma])
+            self.freq = int(self._s[comma + 1:end])
+
+    def __len__(self):
+        if len(self._s) == 0:
+            return 0
+        return self._s.count(" ") + 1
+
+    # _decode_block decodes the given block, and moves the cursor to its first
+    # posting.
+    def _decode_block(self, block):
+        self._block = block
+        self._block_idx = 0
+        num_skips = len(self._skip_offsets)
+        if block > num_skips or len(self._s) == 0:
+            self._docids = self._freqs = ()
+            self.docid = None
+            self.freq = None
+            return None
+
+        start = 0 if block == 0 else self._skip_offsets[block - 1]
+        end = self._skip_offsets[block] if block < num_skips else len(self._s)
+        self._docids, self._freqs = decode_postings(self._s[start:end])
+        return self._move(0)
+
+    def _move(self, block_idx):
+        self._block_idx = block_idx
+        self.index = self._block * SKIP_INTERVAL + block_idx
+        self.docid = self._docids[block_idx]
+        self.freq = self._freqs[block_idx]
+        return self.docid
+
+    def next(self):
+        if self.docid == None:
+            return None
+        if self._docids == None:
+            self._decode_block(self._block)
+        if self._block_idx + 1 < len(self._docids):
+            return self._move(self._block_idx + 1)
+        return self._decode_block(self._block + 1)
+
+    # next_geq moves the cursor to the first posting with docid >= target, and
+    # returns its docid.
+    def next_geq(self, target):
+        if self.docid == None or self.docid >= target:
+            return self.docid
+
+        # Jump to the block of the last skip with docid <= target, if it is
+        # ahead. Skips of the current block and behind it are of no use.
+        num_skips = len(self._skip_docids)
+        skip_idx = _gallop(self._skip_docids, target + 1,
+                           min(self._block, num_skips), num_skips) - 1
+        if skip_idx >= self._block:
+            self._decode_block(skip_idx + 1)
+        elif self._docids == None:
+            self._decode_block(self._block)
+
+        while self.docid != None and self.docid < target:
+            block_idx = _gallop(self._docids, target, self._block_idx,
+                                len(self._docids))
+            if block_idx < len(self._docids):
+                self._move(block_idx)
+            else:
+                self._decode_block(self._block + 1)
+        return self.docid
+
+# ArrayCursor iterates over postings held in sequences with random access, like
+# decoded lists or the fixed-width docids of the impacts file, which need no
+# skips: next_geq gallops over the docids themselves.
+class ArrayCursor:
+    def __init__(self, docids, freqs=None):
+        self._docids = docids
+        self._freqs = freqs
+        self.index = -1
+
+        self.docid = None
+        self.freq = None
+        self.next()
+
+    def __len__(self):
+        return len(self._docids)
+
+    def _move(self, idx):
+        self.index = idx
+        if idx >= len(self._docids):
+            self.docid = None
+            self.freq = None
+        else:
+            self.docid = self._docids[idx]
+            if self._freqs != None:
+                self.freq = self._freqs[idx]
+        return self.docid
+
+    def next(self):
+        return self._move(self.index + 1)
+
+    def next_geq(self, target):
+        if self.docid == None or self.docid >= target:
+            return self.docid
+        return self._move(_gallop(self._docids, target, self.index,
+                                  len(self._docids)))
+
+# postings_cursor returns a cursor over the (docids, freqs) arrays of a decoded
+# list.
+def postings_cursor(postings):
+    docids, freqs = postings
+    return ArrayCursor(docids, freqs)
@@ -0,0 +1,81 @@
+import bisect
+
+from common.log import log
+from common.memory.defs import MEGABYTE
+
+logger = log.logger()
+
+MARKS_SUFFIX = ".marks"
+
+# Marks of index files are spaced by at least MARK_SPACING bytes of lists.
+MARK_SPACING = MEGABYTE
+# Marks of skips files are spaced by at least SKIPS_MARK_SPACING bytes of
+# lines, so that the skips of a word are read in a page or two.
+SKIPS_MARK_SPACING = 4096
+
+# The marks file of an index is a sparse index of its skips file, with one line
+# per block of at least SKIPS_MARK_SPACING bytes of lines, in the order of the
+# skips file, and so sorted by word:
+#
+#   <word> <offset>
+#
+# where word is the first word of the block, and offset the byte offset of its
+# line in the skips file. The skips of a word are in the block of the last mark
+# whose word is not greater than it. Index files without skips are scanned
+# instead, and their marks, with offsets in the index file, built in memory.
+def marks_fpath(index_fpath):
+    return index_fpath + MARKS_SUFFIX
+
+# Marks is the table of the marks of a file sorted by word, so that the mark of
+# a word is found with a binary search.
+class Marks:
+    def __init__(self, words=None, offsets=None):
+        self.words = words or []
+        self.offsets = offsets or []
+
+    def __len__(self):
+        return len(self.words)
+
+    # add adds a mark after all the others. Marks must be added in increasing
+    # word order.
+    def add(self, word, offset):
+        assert len(self.words) == 0 or word > self.words[-1], word
+        self.words.append(word)
+        self.offsets.append(offset)
+
+    # checkpoint returns the offset of the block that would have the list of the
+    # word, or None if there are no marks.
+    def checkpoint(self, word):
+        if len(self.words) == 0:
+            return None
+        i = bisect.bisect_right(self.words, word) - 1
+        return self.offsets[max(i, 0)]
+
+    # checkpoints returns the offsets of the blocks that would have the lists of
+    # the given words, each once and in increasing order.
+    def checkpoints(self, words):
+        if len(self.words) == 0:
+            return []
+        return sorted(set(self.checkpoint(word) for word in words))
+
+    # blocks returns the (offset, end) of the blocks that would have the lines
+    # of the given words, each once and in increasing order. The end of the
+    # last block is None.
+    def blocks(self, words):
+        ends = dict(zip(self.offsets, self.offsets[1:]))
+        return [(offset, ends.get(offset)) for offset in
+                self.checkpoints(words)]
+
+# read_marks reads the marks file of an index.
+def read_marks(fpath):
+    logger.info(f"Reading marks from '{fpath}'")
+
+    marks = Marks()
+    with open(fpath, "r", encoding="utf-8") as f:
+        for line in f:
+            word, offset = line.rstrip("\n").split(" ")
+            marks.add(word, int(offset))
+
+    logger.info(f"Successfully read {len(marks)} marks")
+
+    return marks
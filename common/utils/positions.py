@@ -0,0 +1,151 @@
+import os
+import struct
+
+from common.log import log
+from common.utils.index import SKIP_INTERVAL
+
+logger = log.logger()
+
+POSITIONS_SUFFIX = ".positions"
+
+# The positions file of an index stores, for each word, the positions of the
+# word in every document of its list, in the order of the list. The position of
+# a token is its ordinal among the tokens of the document that survive
+# normalization, so stopwords do not take positions. The positions of each
+# posting are stored as the varint-encoded gaps between them, preceded by their
+# length in bytes as a varint, so that postings can be skipped without decoding
+# them. Fixed-size integers are little endian:
+#
+#   header:      magic
+#   postings:    for each posting, length (varint), gaps (varints)
+#   dictionary:  for each word, word length (uint16), word (utf-8),
+#                offset of its postings (uint64), their length (uint64),
+#                number of skips (uint32), and for each skip, the offset of
+#                posting SKIP_INTERVAL * (i + 1) relative to the first one
+#                (uint32)
+#   footer:      offset of the dictionary (uint64)
+POSITIONS_MAGIC = b"POSX"
+HEADER_FORMAT   = "<4s"
+WORD_FORMAT     = "<H"
+ENTRY_FORMAT    = "<QQI"
+SKIPS_FORMAT    = "<{}I"
+FOOTER_FORMAT   = "<Q"
+
+def positions_fpath(index_fpath):
+    return index_fpath + POSITIONS_SUFFIX
+
+def has_positions(index_fpath):
+    return os.path.exists(positions_fpath(index_fpath))
+
+def encode_varint(n, out: bytearray):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def decode_varint(buf, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+# encode_positions appends the encoded positions of a posting to out.
+def encode_positions(positions, out: bytearray):
+    gaps = bytearray()
+    last = 0
+    for position in positions:
+        encode_varint(position - last, gaps)
+        last = position
+    encode_varint(len(gaps), out)
+    out += gaps
+
+# read_dictionary yields the (word, entry, skips) of every word in the
+# dictionary of a positions file.
+def read_dictionary(fpath):
+    with open(fpath, "rb") as f:
+        magic, = struct.unpack(HEADER_FORMAT,
+                               f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != POSITIONS_MAGIC:
+            raise ValueError(f"'{fpath}' is not a positions file")
+
+        footer_size = struct.calcsize(FOOTER_FORMAT)
+        f.seek(-footer_size, os.SEEK_END)
+        dictionary_end = f.tell()
+        dictionary_offset, = struct.unpack(FOOTER_FORMAT, f.read(footer_size))
+        f.seek(dictionary_offset)
+        dictionary = f.read(dictionary_end - dictionary_offset)
+
+    word_size = struct.calcsize(WORD_FORMAT)
+    entry_size = struct.calcsize(ENTRY_FORMAT)
+    pos = 0
+    while pos < len(dictionary):
+        word_len, = struct.unpack_from(WORD_FORMAT, dictionary, pos)
+        pos += word_size
+        word = dictionary[pos:pos + word_len].decode("utf-8")
+        pos += word_len
+        entry = struct.unpack_from(ENTRY_FORMAT, dictionary, pos)
+        pos += entry_size
+        skips_format = SKIPS_FORMAT.format(entry[2])
+        skips = struct.unpack_from(skips_format, dictionary, pos)
+        pos += struct.calcsize(skips_format)
+        yield word, entry, skips
+
+# PositionsList holds the encoded positions of all postings of a word.
+class PositionsList:
+    def __init__(self, block, skips):
+        self._block = block
+        self._skips = skips
+
+    # positions returns the positions of the posting with the given index in
+    # the list of the word.
+    def positions(self, posting_idx):
+        skip_idx = posting_idx // SKIP_INTERVAL
+        if skip_idx == 0:
+            pos = 0
+        else:
+            pos = self._skips[skip_idx - 1]
+        for _ in range(posting_idx - skip_idx * SKIP_INTERVAL):
+            length, pos = decode_varint(self._block, pos)
+            pos += length
+
+        length, pos = decode_varint(self._block, pos)
+        end = pos + length
+        positions = []
+        position = 0
+        while pos < end:
+            gap, pos = decode_varint(self._block, pos)
+            position += gap
+            positions.append(position)
+        return positions
+
+# PositionsIndex reads the positions file of an index. Only the dictionary
+# entries of the given words are kept in memory; positions are read from disk
+# when asked for.
+class PositionsIndex:
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self._entries = {}
+
+    def init(self, words):
+        logger.info(f"Reading positions dictionary from '{self.fpath}'")
+
+        if words != None:
+            words = set(words)
+        for word, entry, skips in read_dictionary(self.fpath):
+            if words == None or word in words:
+                self._entries[word] = (entry, skips)
+
+        logger.info(f"Successfully read positions dictionary from "+
+                    f"'{self.fpath}'. Words found: {len(self._entries)}")
+
+    def positions_list(self, word):
+        (offset, length, _), skips = self._entries[word]
+        with open(self.fpath, "rb") as f:
+            f.seek(offset)
+            block = f.read(length)
+        return PositionsList(block, skips)
@@ -0,0 +1,17 @@
+from math import log as natural_log
+
+# k1 in [1.2, 2.0]
+BM25_K1 = 1.5
+BM25_B  = 0.75
+
+def idf(num_docs, df):
+    return natural_log((num_docs - df + 0.5) / (df + 0.5) + 1)
+
+def tf(freq, doc_len):
+    return freq / doc_len
+
+def bm25(freq, doc_len, avg_doc_len, term_idf, k1=BM25_K1, b=BM25_B):
+    return term_idf * (
+        (freq * (k1 + 1)) /
+        (freq + k1 * (1 - b + b * doc_len / avg_doc_len))
+    )
@@ -0,0 +1,76 @@
+import fcntl
+import json
+import os
+
+from common.log import log
+from common.utils.utils import resolve_fpath
+
+logger = log.logger()
+
+SEGMENTS_SUFFIX = ".segments"
+
+FPATH_KEY        = "fpath"
+CORPUS_FILES_KEY = "corpus_files"
+NUM_DOCS_KEY     = "num_docs"
+MIN_DOCID_KEY    = "min_docid"
+MAX_DOCID_KEY    = "max_docid"
+SUM_DOC_LENS_KEY = "sum_doc_lens"
+
+# An index may be made of several segments, each one a complete index file
+# covering a disjoint docid range. The list of segments is kept next to the
+# index, in docid order, with the paths of the segments relative to the
+# directory of the index.
+def segments_fpath(index_fpath):
+    return index_fpath + SEGMENTS_SUFFIX
+
+# The segments list is read and updated under the lock of segments_lock_fpath:
+# shared by readers, exclusive by the indexer.
+def segments_lock_fpath(index_fpath):
+    return segments_fpath(index_fpath) + ".lock"
+
+# read_segments returns the segments of the index, or None if the index is a
+# single file without segments list.
+def read_segments(index_fpath):
+    fpath = segments_fpath(index_fpath)
+    if not os.path.exists(fpath):
+        return None
+
+    with open(fpath, "r") as f:
+        segments_map = json.load(f)
+
+    segments = segments_map["segments"]
+    for segment in segments:
+        segment[FPATH_KEY] = resolve_fpath(segment[FPATH_KEY], index_fpath)
+    logger.info(f"Read {len(segments)} segments from '{fpath}'")
+
+    return segments
+
+def read_segment_fpaths(index_fpath):
+    segments = read_segments(index_fpath)
+    if segments == None:
+        return [index_fpath]
+    return [segment[FPATH_KEY] for segment in segments]
+
+# acquire_segments returns the paths of the segments of the index, and the
+# open files that keep them from being deleted for as long as they are open.
+# Merges write the merged segment to a file of its own, and only delete the
+# merged away segments once no reader holds a shared lock on them. The list is
+# read under the lock of the segments list, so that no segment of it is deleted
+# before it is locked.
+def acquire_segments(index_fpath):
+    if not os.path.exists(segments_fpath(index_fpath)):
+        return [index_fpath], []
+
+    with open(segments_lock_fpath(index_fpath), "a") as lockf:
+        fcntl.flock(lockf, fcntl.LOCK_SH)
+        try:
+            fpaths = read_segment_fpaths(index_fpath)
+            segment_locks = []
+            for fpath in fpaths:
+                segment_lock = open(fpath, "rb")
+                fcntl.flock(segment_lock, fcntl.LOCK_SH)
+                segment_locks.append(segment_lock)
+        finally:
+            fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    return fpaths, segment_locks
@@ -0,0 +1,33 @@
+import json
+import os
+
+from common.log import log
+from common.utils.utils import resolve_fpath
+
+logger = log.logger()
+
+SHARDS_SUFFIX = ".shards"
+
+# A sharded index is made of several index files, each one covering a docid
+# range of the index. Every shard has its own URL mapping, but the statistics in
+# its metadata (number of documents, average document length) are the ones of
+# the whole index, as are the document frequencies in the term statistics
+# table. That way, the scores computed by each shard can be compared.
+def shards_fpath(index_fpath):
+    return index_fpath + SHARDS_SUFFIX
+
+# read_shards returns the shard files of the index, or None if the index is not
+# sharded.
+def read_shards(index_fpath):
+    fpath = shards_fpath(index_fpath)
+    if not os.path.exists(fpath):
+        return None
+
+    with open(fpath, "r") as f:
+        shards_map = json.load(f)
+
+    shards = [resolve_fpath(shard_fpath, index_fpath)
+              for shard_fpath in shards_map["shards"]]
+    logger.info(f"Read {len(shards)} shards from '{fpath}'")
+
+    return shards
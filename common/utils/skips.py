@@ -0,0 +1,68 @@
+from common.log import log
+
+logger = log.logger()
+
+SKIPS_SUFFIX = ".skips"
+
+# The skips file of an index has one line per list of the index, in the order
+# of the index file:
+#
+#   <word> <offset> <docid>,<skip_offset> <docid>,<skip_offset> ...
+#
+# where offset is the byte offset of the line of the list in the index file,
+# and every SKIP_INTERVAL postings, docid is the docid of the posting and
+# skip_offset where it starts in the postings of the line, right after the word
+# and its separating space. Lists shorter than SKIP_INTERVAL have no skips, but
+# still have their offset, so the skips file doubles as the lexicon of the
+# index.
+def skips_fpath(index_fpath):
+    return index_fpath + SKIPS_SUFFIX
+
+def _parse_skips_line(line):
+    word, rest = line.rstrip("\n").split(" ", 1)
+    split_by_space = rest.split(" ")
+    word_skips = []
+    for skip_str in split_by_space[1:]:
+        docid, skip_offset = skip_str.split(",")
+        word_skips.append((int(docid), int(skip_offset)))
+    return word, (int(split_by_space[0]), word_skips)
+
+def _read_skips_lines(fpath):
+    with open(fpath, "r", encoding="utf-8") as f:
+        yield from f
+
+# _read_skips_blocks reads the lines of the given (offset, end) blocks of a
+# skips file.
+def _read_skips_blocks(fpath, blocks):
+    # The skips file is read in binary mode, so that offsets are byte offsets.
+    with open(fpath, "rb") as f:
+        for offset, end in blocks:
+            f.seek(offset)
+            for line in f:
+                if end != None and offset >= end:
+                    break
+                offset += len(line)
+                yield line.decode("utf-8")
+
+# read_skips returns the (offset, skips) of the lists of the given words, or of
+# all words if words is None. With the marks of the index, only the blocks of
+# the skips file that would have the words are read.
+def read_skips(fpath, words=None, marks=None):
+    logger.info(f"Reading skips from '{fpath}'")
+
+    if words != None:
+        words = set(words)
+    if words != None and marks != None:
+        lines = _read_skips_blocks(fpath, marks.blocks(words))
+    else:
+        lines = _read_skips_lines(fpath)
+    skips = {}
+    for line in lines:
+        if words != None and line[:line.index(" ")] not in words:
+            continue
+        word, word_skips = _parse_skips_line(line)
+        skips[word] = word_skips
+
+    logger.info(f"Successfully read skips of {len(skips)} words")
+
+    return skips
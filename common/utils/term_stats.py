@@ -0,0 +1,76 @@
+from common.log import log
+from common.utils.scoring import idf
+
+logger = log.logger()
+
+TERM_STATS_SUFFIX = ".termstats"
+
+# The term statistics table has one line per word of the index, sorted by word:
+#
+#   <word> <df> <cf> <max_tf> <max_bm25>
+#
+# where df is the number of documents with the word, cf the number of
+# occurrences of the word in the index, max_tf the highest frequency of the word
+# in a document, and max_bm25 the highest BM25 contribution of the word to the
+# score of a document, computed with the statistics of the index.
+def term_stats_fpath(index_fpath):
+    return index_fpath + TERM_STATS_SUFFIX
+
+class TermStats:
+    __slots__ = ["df", "cf", "max_tf", "max_bm25"]
+
+    def __init__(self, df, cf, max_tf, max_bm25):
+        self.df = df
+        self.cf = cf
+        self.max_tf = max_tf
+        self.max_bm25 = max_bm25
+
+# read_term_stats reads the statistics of the given words, or of all words if
+# words is None.
+def read_term_stats(fpath, words=None):
+    logger.info(f"Reading term statistics from '{fpath}'")
+
+    if words != None:
+        words = set(words)
+
+    term_stats = {}
+    with open(fpath, "r", encoding="utf-8") as f:
+        for line in f:
+            word, df, cf, max_tf, max_bm25 = line.split(" ")
+            if words == None or word in words:
+                term_stats[word] = TermStats(int(df), int(cf), int(max_tf),
+                                             float(max_bm25))
+
+    logger.info(f"Successfully read term statistics of {len(term_stats)} words")
+
+    return term_stats
+
+# combine_term_stats combines the statistics of index segments into the ones of
+# the whole index. The BM25 upper bound of each segment is rescaled to the idf
+# of the whole index; it stays approximate, since the average document length of
+# each segment is slightly different from the one of the whole index.
+def combine_term_stats(segments_term_stats, segments_num_docs):
+    num_docs = sum(segments_num_docs)
+
+    combined = {}
+    for term_stats in segments_term_stats:
+        for word, stats in term_stats.items():
+            if word not in combined:
+                combined[word] = TermStats(0, 0, 0, 0)
+            combined[word].df += stats.df
+            combined[word].cf += stats.cf
+            combined[word].max_tf = max(combined[word].max_tf, stats.max_tf)
+
+    for word in combined:
+        max_bm25 = 0
+        for term_stats, segment_num_docs in zip(segments_term_stats,
+                                                segments_num_docs):
+            if word not in term_stats:
+                continue
+            stats = term_stats[word]
+            max_bm25 = max(max_bm25, stats.max_bm25 *
+                           idf(num_docs, combined[word].df) /
+                           idf(segment_num_docs, stats.df))
+        combined[word].max_bm25 = max_bm25
+
+    return combined
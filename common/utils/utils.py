@@ -17,6 +17,12 @@ def suppress_output():
         finally:
             sys.stdout = old_stdout
 
+# available_cpus returns the number of cores the process can run on.
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 def truncate_file(fpath):
     open(fpath, 'w')
 
@@ -48,3 +54,12 @@ def read_max(infpath, checkpoint, max_read_chars):
     logger.info(f"Read {len(index_str)} chars from '{infpath}'.")
 
     return index_str, checkpoint
+
+# Files listed next to an index, like its shards and segments, are stored
+# relative to the directory of the index, so that it can be queried from any
+# working directory. relative_fpath and resolve_fpath convert between the two.
+def relative_fpath(fpath, index_fpath):
+    return os.path.relpath(fpath, os.path.dirname(index_fpath) or ".")
+
+def resolve_fpath(fpath, index_fpath):
+    return os.path.join(os.path.dirname(index_fpath), fpath)
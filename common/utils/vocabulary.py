@@ -0,0 +1,45 @@
+import os
+
+from common.log import log
+
+logger = log.logger()
+
+VOCABULARY_SUFFIX = ".vocab"
+
+# The vocabulary snapshot of an index maps the most frequent surface forms of
+# the tokens seen by the indexer to the words they were normalized to, so that
+# queries can be normalized without stemming them again. It has one line per
+# surface form, sorted by decreasing number of occurrences in the corpus:
+#
+#   <form> <word> <count>
+#
+# Forms that normalization discards, like stopwords, are not in it.
+def vocabulary_fpath(index_fpath):
+    return index_fpath + VOCABULARY_SUFFIX
+
+def has_vocabulary(index_fpath):
+    return os.path.exists(vocabulary_fpath(index_fpath))
+
+# read_vocabulary_counts returns the (word, count) of every form in the
+# vocabulary snapshot.
+def read_vocabulary_counts(fpath):
+    vocabulary = {}
+    with open(fpath, "r", encoding="utf-8") as f:
+        for line in f:
+            form, word, count = line.rstrip("\n").split(" ")
+            vocabulary[form] = (word, int(count))
+    return vocabulary
+
+# read_vocabulary returns the word of every form in the vocabulary snapshot.
+def read_vocabulary(fpath):
+    logger.info(f"Reading vocabulary from '{fpath}'")
+
+    vocabulary = {}
+    with open(fpath, "r", encoding="utf-8") as f:
+        for line in f:
+            form, word, _ = line.split(" ", 2)
+            vocabulary[form] = word
+
+    logger.info(f"Successfully read vocabulary of {len(vocabulary)} forms")
+
+    return vocabulary
@@ -0,0 +1,12 @@
+from common.metrics import metrics
+from common.profiling import profiler
+
+# init_worker is the initializer of worker processes. It sets up the metrics
+# and the profiling of a worker like the ones of the process that creates it,
+# given by worker_initargs.
+def init_worker(metrics_enabled, profile_config):
+    metrics.init_process(metrics_enabled)
+    profiler.init_process(profile_config)
+
+def worker_initargs():
+    return (metrics.enabled(), profiler.config())
@@ -2,8 +2,10 @@ import sys
 import argparse
 
 from common.log import log
+from common.metrics import metrics
 from common.memory.limit import memory_limit
-from common.memory.tracker import Tracker
+from common.memory import tracker
+from common.profiling import profiler
 from indexer.main import main as indexer_main
 
 logger = log.logger()
@@ -55,7 +57,7 @@ if __name__ == "__main__":
         required=False,
         type=bool,
         help=("Whether to include extra statistics in the statistics printed at "+
-              "the end of the execution.")
+              "the end of the execution, like the time spent in each phase.")
     )
     parser.add_argument(
         '-track-memory',
@@ -63,18 +65,119 @@ if __name__ == "__main__":
         action='store',
         required=False,
         type=bool,
-        help=("Whether should track memory usage. Enabling this option "+
-              "significantly affects program performance.")
+        help=("Whether to log the memory usage of every process at the end "+
+              "of each phase: its resident, unique and virtual sizes.")
+    )
+    parser.add_argument(
+        '-resume',
+        dest='resume',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to resume an interrupted run from its manifest, "+
+              "skipping the work that was already done.")
+    )
+    parser.add_argument(
+        '-incremental',
+        dest='incremental',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to only index the corpus files that are not in the "+
+              "index yet, adding them to the index as a new segment.")
+    )
+    parser.add_argument(
+        '-shards',
+        dest='shards',
+        action='store',
+        required=False,
+        type=int,
+        help=("Number of shards to split the index in. Each shard covers a "+
+              "range of docids.")
+    )
+    parser.add_argument(
+        '-impacts',
+        dest='impacts',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to also write impact-ordered lists, with the BM25 "+
+              "contribution of every posting precomputed and quantized, for "+
+              "score-at-a-time query processing.")
+    )
+    parser.add_argument(
+        '-positions',
+        dest='positions',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to also write the positions of every word in every "+
+              "document, needed by phrase queries.")
+    )
+    parser.add_argument(
+        '-metrics',
+        dest='metrics',
+        action='store',
+        required=False,
+        type=str,
+        help=("Path to write the metrics of the run to: the time spent in "+
+              "each phase, and counters of the documents and tokens indexed.")
+    )
+    parser.add_argument(
+        '-metrics-format',
+        dest='metrics_format',
+        action='store',
+        required=False,
+        type=str,
+        help="['JSON' | 'PROMETHEUS'] format of the metrics. Defaults to JSON."
+    )
+    parser.add_argument(
+        '-profile',
+        dest='profile',
+        action='store',
+        required=False,
+        type=str,
+        help=("Path to write the profile of the run to, merged over the main "+
+              "process and all workers: <PATH>.pstats, for pstats, and "+
+              "<PATH>.collapsed, with the sampled stacks, for flame graphs.")
+    )
+    parser.add_argument(
+        '-profile-mode',
+        dest='profile_mode',
+        action='store',
+        required=False,
+        type=str,
+        help=("['DETERMINISTIC' | 'SAMPLING'] how to profile. Deterministic "+
+              "profiling times every call, which slows the run down, while "+
+              "sampling only records the stacks every 10ms. Defaults to "+
+              "DETERMINISTIC.")
+    )
+    parser.add_argument(
+        '-trace-sample',
+        dest='trace_sample',
+        action='store',
+        required=False,
+        type=float,
+        help=("Fraction of the chunks whose detailed trace is logged, "+
+              "whatever the logging level, between 0 and 1. Defaults to 0.")
     )
     args = parser.parse_args()
     memory_limit(args.memory_limit)
     try:
         if args.track_memory:
-            process_tracker = Tracker()
-            process_tracker.track()
+            tracker.track()
 
         if args.log_level != None:
             log.set_level(args.log_level)
+        if args.trace_sample != None:
+            log.set_trace_sample_rate(args.trace_sample)
+
+        # The extra statistics include the time spent in each phase.
+        if args.metrics != None or args.extra_statistics:
+            metrics.enable()
+
+        if args.profile != None:
+            profiler.start(args.profile, args.profile_mode)
 
         main(args)
     except MemoryError:
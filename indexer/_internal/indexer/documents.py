@@ -0,0 +1,77 @@
+import struct
+
+from common.log import log
+from common.utils.documents import (read_documents,
+                                    DOCUMENTS_MAGIC,
+                                    HEADER_FORMAT,
+                                    ENTRY_FORMAT,
+                                    FILE_FORMAT,
+                                    FOOTER_FORMAT)
+
+logger = log.logger()
+
+# Documents runs are text files next to the URL mapping runs, with one line per
+# document of the run:
+#
+#   <docid> <offset> <length> <WARC file>
+def write_documents_run(documents, run_fpath):
+    with open(run_fpath, "a", encoding="utf-8") as f:
+        for docid, (fpath, offset, length) in documents.items():
+            f.write(f"{docid} {offset} {length} {fpath}\n")
+
+def _run_documents(run_fpath):
+    with open(run_fpath, "r", encoding="utf-8") as f:
+        for line in f:
+            docid, offset, length, fpath = line.rstrip("\n").split(" ", 3)
+            yield int(docid), fpath, int(offset), int(length)
+
+# _write_documents_file writes a documents table with the given (docid, WARC
+# file, offset, length) of every document, by increasing docid.
+def _write_documents_file(documents, outfpath):
+    files = {}
+    num_docs = 0
+    with open(outfpath, "wb") as outf:
+        outf.write(struct.pack(HEADER_FORMAT, DOCUMENTS_MAGIC, 0))
+        for docid, fpath, offset, length in documents:
+            if fpath not in files:
+                files[fpath] = len(files)
+            outf.write(struct.pack(ENTRY_FORMAT, docid, files[fpath], offset,
+                                   length))
+            num_docs += 1
+
+        files_offset = outf.tell()
+        for fpath in files:
+            encoded_fpath = fpath.encode("utf-8")
+            outf.write(struct.pack(FILE_FORMAT, len(encoded_fpath)))
+            outf.write(encoded_fpath)
+        outf.write(struct.pack(FOOTER_FORMAT, files_offset))
+
+        outf.seek(0)
+        outf.write(struct.pack(HEADER_FORMAT, DOCUMENTS_MAGIC, num_docs))
+
+    return num_docs
+
+# write_documents writes the documents table of an index file from its
+# documents runs, which must be given in docid order.
+def write_documents(run_fpaths, outfpath):
+    logger.info(f"Writing documents table of {len(run_fpaths)} runs to "+
+                f"'{outfpath}'")
+
+    num_docs = _write_documents_file(
+        (document for run_fpath in run_fpaths
+         for document in _run_documents(run_fpath)), outfpath)
+
+    logger.info(f"Successfully wrote documents table of {num_docs} documents "+
+                f"to '{outfpath}'")
+
+# merge_documents merges the documents tables of index files with disjoint and
+# increasing docid ranges, like the segments of an index, in that order.
+def merge_documents(fpaths, outfpath):
+    logger.info(f"Merging documents tables {fpaths} into '{outfpath}'")
+
+    num_docs = _write_documents_file(
+        (document for fpath in fpaths for document in read_documents(fpath)),
+        outfpath)
+
+    logger.info(f"Successfully merged documents tables of {num_docs} "+
+                f"documents into '{outfpath}'")
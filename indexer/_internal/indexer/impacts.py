@@ -0,0 +1,86 @@
+import struct
+
+from common.log import log
+from common.utils.impacts import (MAX_IMPACT,
+                                  IMPACTS_MAGIC,
+                                  HEADER_FORMAT,
+                                  BLOCK_FORMAT,
+                                  DOCID_FORMAT,
+                                  WORD_FORMAT,
+                                  ENTRY_FORMAT,
+                                  FOOTER_FORMAT)
+from common.utils.index_metadata import read_index_metadata
+from common.utils.scoring import (idf,
+                                  bm25)
+from .url_mapping import (read_doc_lens,
+                          skip_url_mapping)
+from .utils import read_index_lists
+
+logger = log.logger()
+
+def _read_term_stats_lines(term_stats_fpath):
+    with open(term_stats_fpath, "r", encoding="utf-8") as f:
+        for line in f:
+            word, df, _, _, max_bm25 = line.split(" ")
+            yield word, int(df), float(max_bm25)
+
+def _quantize(score, scale):
+    # Every posting keeps an impact of at least 1, so that no document is lost
+    # from the lists.
+    return max(1, min(MAX_IMPACT, round(score / scale)))
+
+# write_impacts writes the impacts file of an index file. Document frequencies
+# and the quantization scale are taken from the term statistics table, so that
+# the shards of an index share the statistics, and the scale, of the whole
+# index. Both the index and the table are sorted by word, so they are read in a
+# single pass.
+def write_impacts(index_fpath, term_stats_fpath, outfpath):
+    logger.info(f"Writing impacts of '{index_fpath}' to '{outfpath}'")
+
+    checkpoint = skip_url_mapping(index_fpath, 0)
+    metadata, _ = read_index_metadata(index_fpath, checkpoint)
+    doc_lens = {}
+    read_doc_lens(index_fpath, doc_lens)
+
+    max_bm25 = max((stats[2] for stats in
+                    _read_term_stats_lines(term_stats_fpath)), default=0)
+    scale = max_bm25 / MAX_IMPACT if max_bm25 > 0 else 1
+
+    num_words = 0
+    dictionary = bytearray()
+    term_stats = _read_term_stats_lines(term_stats_fpath)
+    with open(outfpath, "wb") as outf:
+        outf.write(struct.pack(HEADER_FORMAT, IMPACTS_MAGIC, scale))
+        for word, (docids, freqs) in read_index_lists(index_fpath):
+            if len(docids) == 0:
+                continue
+            stats_word, df, _ = next(term_stats)
+            while stats_word != word:
+                stats_word, df, _ = next(term_stats)
+
+            term_idf = idf(metadata.num_docs, df)
+            blocks = {}
+            for docid, freq in zip(docids, freqs):
+                impact = _quantize(bm25(freq, doc_lens[docid],
+                                        metadata.avg_doc_len, term_idf), scale)
+                if impact not in blocks:
+                    blocks[impact] = []
+                blocks[impact].append(docid)
+
+            encoded_word = word.encode("utf-8")
+            dictionary += struct.pack(WORD_FORMAT, len(encoded_word))
+            dictionary += encoded_word
+            dictionary += struct.pack(ENTRY_FORMAT, outf.tell(), len(blocks))
+            for impact in sorted(blocks, reverse=True):
+                docids = blocks[impact]
+                outf.write(struct.pack(BLOCK_FORMAT, impact, len(docids)))
+                outf.write(struct.pack(DOCID_FORMAT.format(len(docids)),
+                                       *docids))
+            num_words += 1
+
+        dictionary_offset = outf.tell()
+        outf.write(dictionary)
+        outf.write(struct.pack(FOOTER_FORMAT, dictionary_offset))
+
+    logger.info(f"Successfully wrote impacts of {num_words} words to "+
+                f"'{outfpath}'")
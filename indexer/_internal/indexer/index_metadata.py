@@ -1,5 +1,9 @@
 from common.log import log
-from common.utils.index_metadata import (BEGIN_INDEX_METADATA, END_INDEX_METADATA)
+from common.utils.index_metadata import (BEGIN_INDEX_METADATA,
+                                         END_INDEX_METADATA,
+                                         NUM_DOCS_KEY,
+                                         MAX_DOCID_KEY,
+                                         AVG_DOC_LEN_KEY)
 
 logger = log.logger()
 
@@ -11,6 +15,14 @@ def write_index_metadata_end(outfpath):
     with open(outfpath, "a") as f:
         f.write(END_INDEX_METADATA)
 
+def write_index_metadata(outfpath, num_docs, max_docid, avg_doc_len):
+    write_index_metadata_begin(outfpath)
+    with open(outfpath, "a") as f:
+        f.write(f"{NUM_DOCS_KEY} {num_docs}\n")
+        f.write(f"{MAX_DOCID_KEY} {max_docid}\n")
+        f.write(f"{AVG_DOC_LEN_KEY} {avg_doc_len}\n")
+    write_index_metadata_end(outfpath)
+
 def skip_index_metadata(infpath, checkpoint):
     logger.info(f"Skipping index metadata from '{infpath}'. Starting from "+
                 f"checkpoint {checkpoint}")
@@ -4,85 +4,270 @@ import gc
 import glob
 import os
 import shutil
+import sys
 from threading import get_ident
 from typing import Mapping, List, Tuple
 
-from warcio.archiveiterator import ArchiveIterator
-
-from .parser import PlaintextParser
 from .statistics import Statistics
 from .subindex import Subindex
 from .utils import (write_index,
-                    move_file,
-                    is_useful_warcio_record,
-                    get_warcio_record_url)
-from .index_metadata import (write_index_metadata_begin,
-                             write_index_metadata_end,
-                             skip_index_metadata)
+                    remove_index_file,
+                    merge_index_files,
+                    read_index_lists,
+                    copy_file)
+from .index_metadata import write_index_metadata
 from .url_mapping import (write_url_mapping_begin,
                           write_url_mapping_end,
-                          write_url_mapping,
-                          skip_url_mapping)
-from common.utils.index_metadata import (NUM_DOCS_KEY,
-                                         MAX_DOCID_KEY,
-                                         AVG_DOC_LEN_KEY)
+                          write_url_mapping)
+from .segments import (SegmentList,
+                       new_segment)
+from .shards import (write_shards,
+                     remove_shards)
+from .term_stats import write_term_stats
+from .impacts import write_impacts
+from .skips import write_skips
+from .marks import write_marks
+from .documents import (write_documents_run,
+                        write_documents)
+from .positions import (write_positions_run,
+                        write_positions,
+                        positions_str)
+from .tokenizer import (tokenizer_pool,
+                        split_batches,
+                        process_batch)
+from .warc import (record_offsets,
+                   read_records)
+from .vocabulary import (add_forms,
+                         write_forms,
+                         write_vocabulary)
+from .manifest import (Manifest,
+                       read_manifest,
+                       PHASE_PRODUCING,
+                       PHASE_MERGING)
 from common.log import log
+from common.preprocessing.normalize import check_tokenizer
+from common.metrics import metrics
+from common.utils.segments import FPATH_KEY
+from common.utils.term_stats import term_stats_fpath
+from common.utils.impacts import (impacts_fpath,
+                                  has_impacts)
+from common.utils.skips import skips_fpath
+from common.utils.marks import marks_fpath
+from common.utils.positions import (positions_fpath,
+                                    has_positions)
+from common.utils.vocabulary import (vocabulary_fpath,
+                                     read_vocabulary_counts)
+from common.utils.documents import documents_fpath
 from common.memory.defs import (MEGABYTE,
                                 MAX_DOCS_PER_FILE)
 from common.memory.limit import memory_limit
-from common.memory.tracker import log_memory_usage
+from common.memory.tracker import (log_memory_usage,
+                                   reset_peak,
+                                   peak_memory_usage)
 from common.utils.utils import (truncate_file,
-                                truncate_dir)
-from common.utils.index import read_index
-from common.preprocessing.normalize import (tokenize,
-                                            normalize_word)
+                                truncate_dir,
+                                available_cpus)
+from common.utils.workers import (init_worker,
+                                  worker_initargs)
 
 logger = log.logger()
 
 class Indexer:
     _estimate_max_memory_consumed_per_doc = 0.4 # MB
+    _min_memory_per_process = 128 # MB
+    _merge_fan_in = 64
+    # Workers size their chunks to peak at this fraction of their memory
+    # limit.
+    _target_memory_fraction = 0.75
+    # Approximate sizes, in bytes, of a list and of a posting of the index
+    # buffer, so that its size is counted as postings are added to it rather
+    # than measured by walking it.
+    _bytes_per_list = sys.getsizeof([]) + 32
+    _bytes_per_posting = (sys.getsizeof((0, 0)) +
+                          sys.getsizeof(MAX_DOCS_PER_FILE) + 8)
 
     def __init__(self, config):
         self._corpus = config.corpus
         self._memory_limit = config.memory_limit
+        self._index_fpath = config.output_file
         self._output_file = config.output_file
         self._extra_statistics = config.extra_statistics
+        self._resume = config.resume
+        self._incremental = config.incremental
+        self._num_shards = config.shards or 1
+        self._impacts = config.impacts
+        self._positions = config.positions
 
         self._corpus_files = None
         self._index: Mapping[str, List[Tuple[int, int]]] = {}
         self._subindexes_dir = "subindexes"
         self._urlmapping_dir = "urlmapping"
+        self._offsets_dir = "warcoffsets"
+        self._vocabulary_dir = "vocabulary"
+        self._segment_list = SegmentList(self._index_fpath)
+        self._manifest = None
 
         self._num_docs = 0
         self._num_tokens = 0
+        self._docid_base = 0
         self._max_docid = 0
         self._sum_doc_lens = 0
+        # Surface forms seen in the corpus, with the word they are normalized
+        # to and their number of occurrences. The forms of every completed
+        # unit are also saved along with the manifest, so that a resumed run
+        # restores them.
+        self._vocabulary = {}
+
+    # The indexer is sent to a worker with every job. The vocabulary and the
+    # manifest grow with the run and are only used by the main process, so
+    # they are left out, or they would make up most of the memory of the
+    # workers on a large corpus.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_vocabulary"] = None
+        state["_manifest"] = None
+        return state
 
     # init is separated from __init__ because it might throw exceptions.
     def init(self):
         # The order in which the sub-init functions are called is very
         # important.
         logger.info("Initializing indexer.")
+        self._init_segment()
         self._init_files()
+        if len(self._corpus_files) == 0:
+            logger.info("No corpus files to index.")
+            return
+        # Workers retry failed chunks, so a missing tokenizer must fail here.
+        check_tokenizer()
         self._init_limits()
         self._init_subindexes()
         logger.info("Successfully initialized indexer.")
 
+    # _init_segment decides which segment of the index this run produces. A
+    # full run replaces all the segments of the index, while an incremental run
+    # only indexes new corpus files into a new segment, with docids after the
+    # ones already in the index.
+    def _init_segment(self):
+        if not self._incremental:
+            return
+        if self._num_shards > 1:
+            raise ValueError("incremental runs cannot produce a sharded index")
+
+        with self._segment_list.locked():
+            if (not self._segment_list.exists() and
+                os.path.exists(self._index_fpath)
+            ):
+                raise ValueError(f"index '{self._index_fpath}' has no segments "+
+                                 f"list, so an incremental run cannot know "+
+                                 f"which corpus files it covers. Indexes "+
+                                 f"meant to grow must be built with "+
+                                 f"'-incremental True' from the start")
+            if len(self._segment_list.segments) > 0:
+                self._output_file = self._segment_list.new_segment_fpath()
+            self._docid_base = self._segment_list.max_docid()
+            self._indexed_files = self._segment_list.corpus_files()
+
+        logger.info(f"Indexing new segment '{self._output_file}' of index "+
+                    f"'{self._index_fpath}', starting at docid {self._docid_base}")
+
     def _init_files(self):
-        self._corpus_files = glob.glob(self._corpus + "/*")
-        truncate_file(self._output_file)
+        # Files are sorted so that a resumed run assigns them to the same
+        # subindexes as the original run.
+        self._corpus_files = sorted(glob.glob(self._corpus + "/*"))
+        if self._incremental:
+            self._corpus_files = [
+                fpath for fpath in self._corpus_files
+                if os.path.abspath(fpath) not in self._indexed_files
+            ]
+            logger.info(f"Found {len(self._corpus_files)} new corpus files")
+            if len(self._corpus_files) == 0:
+                return
+
+        self._manifest_fpath = f"{self._output_file}.manifest"
+
+        if self._resume and os.path.exists(self._manifest_fpath):
+            self._manifest = read_manifest(self._manifest_fpath)
+            self._restore_from_manifest()
+            return
+        elif self._resume:
+            logger.warning(f"Asked to resume, but manifest "+
+                           f"'{self._manifest_fpath}' does not exist. "+
+                           f"Starting from scratch.")
+
+        # A sharded index has no file of its own, only its shards, so the
+        # unsharded index left by a previous run is removed instead.
+        if self._num_shards == 1:
+            truncate_file(self._output_file)
+        else:
+            remove_index_file(self._output_file)
         truncate_dir(self._subindexes_dir)
         truncate_dir(self._urlmapping_dir)
+        truncate_dir(self._offsets_dir)
+        truncate_dir(self._vocabulary_dir)
+        self._manifest = Manifest(self._manifest_fpath)
+
+    # _restore_from_manifest restores the counters and the vocabulary of the
+    # interrupted run, and removes runs that were being written when the run
+    # was interrupted. Those are redone from the last checkpoint recorded in
+    # the manifest.
+    def _restore_from_manifest(self):
+        counters = self._manifest.counters
+        self._num_docs = counters.get("num_docs", 0)
+        self._num_tokens = counters.get("num_tokens", 0)
+        self._max_docid = counters.get("max_docid", 0)
+        self._sum_doc_lens = counters.get("sum_doc_lens", 0)
+
+        # Record offsets of the corpus files are kept, since they are still
+        # valid.
+        os.makedirs(self._offsets_dir, exist_ok=True)
+        known_fpaths = (set(self._manifest.runs) |
+                        set(positions_fpath(fpath) for fpath in
+                            self._manifest.runs) |
+                        set(self._manifest.url_mappings) |
+                        set(documents_fpath(fpath) for fpath in
+                            self._manifest.url_mappings) |
+                        set(self._manifest.vocabularies))
+        for dpath in [self._subindexes_dir, self._urlmapping_dir,
+                      self._vocabulary_dir]:
+            os.makedirs(dpath, exist_ok=True)
+            for fpath in glob.glob(f"{dpath}/*"):
+                if fpath not in known_fpaths:
+                    logger.info(f"Removing unfinished run '{fpath}'")
+                    os.remove(fpath)
+
+        for fpath in self._manifest.vocabularies:
+            add_forms(self._vocabulary, read_vocabulary_counts(fpath))
+
+        logger.info(f"Resuming indexer run in phase '{self._manifest.phase}', "+
+                    f"with {len(self._manifest.completed_units)} completed "+
+                    f"units of work")
+
+    def _save_manifest(self):
+        self._manifest.counters = {
+            "num_docs": self._num_docs,
+            "num_tokens": self._num_tokens,
+            "max_docid": self._max_docid,
+            "sum_doc_lens": self._sum_doc_lens,
+        }
+        self._manifest.save()
 
     # _init_limits assumes that the corpus files have already been located.
     def _init_limits(self):
         safe_memory_margin = 0.5
         min_docs_per_process = 25
 
-        # The maximum of processes was imposed due to specific requirements of
-        # the assignment. This should be more flexible in a production-level
-        # implementation.
-        self._max_num_process = int(min(6, len(self._corpus_files)))
+        # There is a process per available core, as long as each one gets at
+        # least _min_memory_per_process. Corpus files are indexed by up to that
+        # many worker processes, and the cores left over when there are fewer
+        # files than that tokenize the docs of each file in parallel.
+        max_num_process = int(max(1, min(
+            available_cpus(),
+            self._memory_limit // self._min_memory_per_process,
+        )))
+        self._max_num_process = int(min(max_num_process,
+                                        len(self._corpus_files)))
+        self._num_tokenizers = max(1, max_num_process // self._max_num_process)
         safe_memory_limit = int(
             (self._memory_limit * safe_memory_margin) / self._max_num_process
         )
@@ -95,7 +280,8 @@ class Indexer:
                                    len(self._corpus_files))
 
         self._memory_per_subprocess = int(
-            self._memory_limit / (self._max_num_process + 1)
+            self._memory_limit / (self._max_num_process * self._num_tokenizers
+                                  + 1)
         )
 
         self._max_read_chars_subindex = int(
@@ -108,16 +294,33 @@ class Indexer:
                 self._bytes_per_warcio_record * 8
             )
         )
+        # The size of chunks is adjusted while indexing, between these bounds,
+        # after the memory used by the workers.
+        self._min_read_bytes = self._bytes_per_warcio_record
+        self._max_read_bytes_cap = max(self._max_read_bytes,
+                                       self._memory_per_subprocess *
+                                       MEGABYTE // 16)
 
         # Print limits in alphabetical order.
         logger.info(f"Limit max_docs_per_process={self._max_docs_per_process}")
         logger.info(f"Limit max_num_process={self._max_num_process}")
+        logger.info(f"Limit max_read_bytes={self._max_read_bytes}")
         logger.info(f"Limit max_read_chars_subindex={self._max_read_chars_subindex}")
         logger.info(f"Limit memory_per_subprocess={self._memory_per_subprocess}")
         logger.info(f"Limit num_subindexes={self._num_subindexes}")
+        logger.info(f"Limit num_tokenizers={self._num_tokenizers}")
 
     # _init_subindexes assumes that the corpus files have already been located.
     def _init_subindexes(self):
+        if len(self._manifest.subindexes) > 0:
+            # Resuming: the subindexes keep the files and checkpoints they had
+            # when the manifest was last saved.
+            self._subindexes = [subindex for subindex in
+                                self._manifest.get_subindexes()
+                                if len(subindex) > 0]
+            self._init_shards()
+            return
+
         self._subindexes = [Subindex(id) for id in range(self._num_subindexes)]
         subindex_id = 0
         file_idx = 0
@@ -133,14 +336,187 @@ class Indexer:
         # Define the document offset of each subindex.
         num_files = 0
         for subindex in self._subindexes:
-            subindex.docid_offset = num_files * MAX_DOCS_PER_FILE
+            subindex.docid_offset = (self._docid_base +
+                                     num_files * MAX_DOCS_PER_FILE)
             num_files += len(subindex)
-
+            self._manifest.set_subindex(subindex)
+        self._save_manifest()
+
+        self._init_shards()
+
+    # _init_shards assumes that the subindexes have already been initialized.
+    # Shards are groups of consecutive subindexes, so each one covers a docid
+    # range of the index.
+    def _init_shards(self):
+        num_subindexes = len(self._manifest.subindexes)
+        if self._num_shards > num_subindexes:
+            logger.warning(f"Cannot split {num_subindexes} subindexes in "+
+                           f"{self._num_shards} shards. Producing "+
+                           f"{num_subindexes} shards instead.")
+            self._num_shards = num_subindexes
+
+    def _shard_subindex_ids(self, shard):
+        num_subindexes = len(self._manifest.subindexes)
+        return set(id for id in self._manifest.subindexes
+                   if id * self._num_shards // num_subindexes == shard)
+
+    @metrics.timed("indexer.run")
     def run(self):
+        if len(self._corpus_files) == 0:
+            return
+
         before = datetime.now()
 
+        if self._manifest.phase == PHASE_PRODUCING:
+            self._produce_runs()
+            self._manifest.phase = PHASE_MERGING
+            self._save_manifest()
+
+        if self._num_shards == 1:
+            index_fpaths = [self._write_index_file(self._output_file,
+                                                   self._manifest.subindexes)]
+        else:
+            index_fpaths = self._write_shards()
+        self._write_sidecars(index_fpaths)
+
+        elapsed_secs = (datetime.now() - before).seconds
+
+        statistics = self._gather_statistics(index_fpaths)
+        statistics.set_elapsed_time(elapsed_secs)
+        statistics.set_phase_times(metrics.span_sums("indexer."))
+        print(statistics.to_json(self._extra_statistics))
+
+        if self._num_shards == 1:
+            if not self._incremental:
+                remove_shards(self._index_fpath)
+            self._register_segment()
+        else:
+            self._register_shards(index_fpaths)
+        self._cleanup()
+
+    # _write_sidecars writes the files that go along with the index files. The
+    # term statistics and impacts of shards are written when they are
+    # registered, since they are the ones of the whole index.
+    @metrics.timed("indexer.sidecars")
+    def _write_sidecars(self, index_fpaths):
+        if self._num_shards == 1:
+            write_term_stats(index_fpaths, term_stats_fpath(self._output_file))
+            self._write_impacts(index_fpaths,
+                                term_stats_fpath(self._output_file))
+        for index_fpath in index_fpaths:
+            write_skips(index_fpath, skips_fpath(index_fpath))
+            write_marks(skips_fpath(index_fpath), marks_fpath(index_fpath))
+        write_vocabulary(self._vocabulary, vocabulary_fpath(self._index_fpath),
+                         merge=self._incremental)
+
+    # _write_index_file writes an index file with the runs of the given
+    # subindexes.
+    @metrics.timed("indexer.merge")
+    def _write_index_file(self, outfpath, subindex_ids):
+        url_mapping_fpaths = [fpath for fpath, id in
+                              self._manifest.url_mappings.items()
+                              if id in subindex_ids]
+        run_fpaths = [fpath for fpath, id in self._manifest.runs.items()
+                      if id in subindex_ids]
+        max_docid = self._docid_base
+        for id in subindex_ids:
+            subindex = self._manifest.subindexes[id]
+            max_docid = max(max_docid,
+                            subindex["docid_offset"] + subindex["docid"])
+
+        truncate_file(outfpath)
+        if has_positions(outfpath):
+            os.remove(positions_fpath(outfpath))
+        self._merge_url_mappings(outfpath, url_mapping_fpaths)
+        write_documents([documents_fpath(fpath) for fpath in
+                         sorted(url_mapping_fpaths, key=self._run_first_docid)],
+                        documents_fpath(outfpath))
+        self._append_index_metadata(outfpath, max_docid)
+        self._merge_index(outfpath, run_fpaths)
+
+        return outfpath
+
+    # _write_shards writes one index file per shard.
+    def _write_shards(self):
+        logger.info(f"Writing {self._num_shards} shards of index "+
+                    f"'{self._output_file}'")
+
+        shard_fpaths = []
+        for shard in range(self._num_shards):
+            shard_fpath = f"{self._output_file}.shard{shard}"
+            self._write_index_file(shard_fpath, self._shard_subindex_ids(shard))
+            shard_fpaths.append(shard_fpath)
+
+        logger.info(f"Successfully wrote {self._num_shards} shards of index "+
+                    f"'{self._output_file}'")
+
+        return shard_fpaths
+
+    # _write_impacts writes the impacts files of the given index files if asked
+    # to, and otherwise removes the ones left by previous runs, which would no
+    # longer match the index.
+    def _write_impacts(self, index_fpaths, term_stats_fpath):
+        for index_fpath in index_fpaths:
+            if self._impacts:
+                write_impacts(index_fpath, term_stats_fpath,
+                              impacts_fpath(index_fpath))
+            elif has_impacts(index_fpath):
+                os.remove(impacts_fpath(index_fpath))
+
+    # _register_shards lists the shards of the index, and writes the term
+    # statistics of the whole index, which the shards share.
+    def _register_shards(self, shard_fpaths):
+        # The shards replace whatever segments the index had.
+        self._remove_segment_list()
+
+        write_term_stats(shard_fpaths, term_stats_fpath(self._output_file))
+        self._write_impacts(shard_fpaths, term_stats_fpath(self._output_file))
+        write_shards(self._index_fpath, shard_fpaths)
+
+    # _remove_segment_list removes the segments of the index, but the output
+    # file of this run, and their list, if the index has one.
+    def _remove_segment_list(self):
+        if not self._segment_list.exists():
+            return
+        with self._segment_list.locked():
+            self._segment_list.segments = [
+                segment for segment in self._segment_list.segments
+                if segment[FPATH_KEY] != self._output_file]
+            self._segment_list.retired = [
+                fpath for fpath in self._segment_list.retired
+                if fpath != self._output_file]
+            self._segment_list.remove()
+
+    # _register_segment adds the produced index to the segments of the index. It
+    # is only called once the index file is complete. Only incremental runs
+    # keep a segments list: a full run leaves a single index file.
+    def _register_segment(self):
+        if not self._incremental:
+            self._remove_segment_list()
+            logger.info(f"Wrote index '{self._index_fpath}'")
+            return
+
+        segment = new_segment(
+            fpath=self._output_file,
+            corpus_files=[os.path.abspath(f) for f in self._corpus_files],
+            num_docs=self._num_docs,
+            min_docid=self._docid_base,
+            max_docid=max(self._max_docid, self._docid_base),
+            sum_doc_lens=self._sum_doc_lens,
+        )
+        with self._segment_list.locked():
+            self._segment_list.segments.append(segment)
+            self._segment_list.next_segment_id += 1
+            self._segment_list.save()
+
+        logger.info(f"Registered segment '{self._output_file}' of index "+
+                    f"'{self._index_fpath}'")
+
+    def _produce_runs(self):
         with concurrent.futures.ProcessPoolExecutor(
-                max_workers=self._max_num_process
+                max_workers=self._max_num_process,
+                initializer=init_worker,
+                initargs=worker_initargs(),
         ) as executor:
             results = []
 
@@ -161,8 +537,10 @@ class Indexer:
                     if subindex != None:
                         subindexes.append(subindex)
 
+                # Subindexes with chunks left are submitted again on the next
+                # iteration, even if no other job is running.
                 results = list(not_completed)
-                if len(results) == 0:
+                if len(results) == 0 and len(subindexes) == 0:
                     logger.info("Stopping indexer: no jobs left.")
                     break
         try:
@@ -172,64 +550,107 @@ class Indexer:
             logger.info(f"Error cleaning up memory from indexes production: {e}",
                         exc_info=True)
 
-        self._merge_url_mappings()
-        self._append_index_metadata()
-        self._merge_index()
-
-        elapsed_secs = (datetime.now() - before).seconds
-
-        statistics = self._gather_statistics()
-        statistics.set_elapsed_time(elapsed_secs)
-        print(statistics.to_json(self._extra_statistics))
-
-        self._cleanup()
-
     def _submit_jobs(self, executor, results, subindexes):
         for subindex in subindexes:
             results.append(executor.submit(self._run, subindex))
 
     def _process_complete_job(self, future):
-        subindex, completed_subindex, sum_doc_lens, num_tokens = future.result()
+        (subindex, completed_subindex, sum_doc_lens, num_tokens, forms,
+         work_unit, job_metrics, chunk_memory) = future.result()
 
+        metrics.merge(job_metrics)
+        self._adjust_max_read_bytes(*chunk_memory)
         self._sum_doc_lens += sum_doc_lens
         self._num_tokens += num_tokens
+        add_forms(self._vocabulary, forms)
 
-        if not completed_subindex:
-            return subindex
-        else:
+        if completed_subindex:
             self._num_docs += subindex.docid
             if subindex.docid_offset + subindex.docid > self._max_docid:
                 self._max_docid = subindex.docid_offset + subindex.docid
+
+        if work_unit != None:
+            self._manifest.add_completed_unit(*work_unit)
+            # The forms of the unit are named after its position in the
+            # completed units, which resumed runs keep counting from.
+            forms_fpath = (f"{self._vocabulary_dir}/"+
+                           f"{len(self._manifest.completed_units)}_"+
+                           f"{self._output_file}")
+            write_forms(forms, forms_fpath)
+            self._manifest.add_vocabulary(forms_fpath)
+        self._manifest.set_subindex(subindex)
+        self._save_manifest()
+
+        if not completed_subindex:
+            return subindex
+        else:
             return None
 
+    # _adjust_max_read_bytes sizes the chunks of the next jobs after the
+    # memory used by the worker of the last one, so that workers peak at
+    # about _target_memory_fraction of their memory limit instead of hitting
+    # it: the memory a chunk adds to its worker grows with its size, by as much
+    # as the headroom left below the target. The size changes at most twofold
+    # per job, and is halved after a worker runs out of memory. Jobs get the
+    # size when submitted, since the indexer is sent to the workers with every
+    # job.
+    def _adjust_max_read_bytes(self, bytes_read, base_vm, peak_vm,
+                               out_of_memory):
+        if out_of_memory:
+            max_read_bytes = self._max_read_bytes // 2
+        elif peak_vm == None or bytes_read == 0:
+            return
+        else:
+            target_vm = (self._target_memory_fraction *
+                         self._memory_per_subprocess * MEGABYTE)
+            chunk_vm = max(peak_vm - base_vm, MEGABYTE)
+            scale = 1 + (target_vm - peak_vm) / chunk_vm
+            if scale >= 1:
+                # The last chunk of a file may be smaller than the limit.
+                max_read_bytes = max(self._max_read_bytes,
+                                     int(bytes_read * min(scale, 2)))
+            else:
+                max_read_bytes = int(bytes_read * max(scale, 0.5))
+
+        max_read_bytes = min(max(max_read_bytes, self._min_read_bytes),
+                             self._max_read_bytes_cap)
+        if max_read_bytes != self._max_read_bytes:
+            logger.info(f"Adjusting max_read_bytes from {self._max_read_bytes} "+
+                        f"to {max_read_bytes}. Last chunk: {bytes_read} bytes, "+
+                        f"peak virtual memory {(peak_vm or 0) / MEGABYTE:.2f}MB, "+
+                        f"out of memory: {out_of_memory}")
+            self._max_read_bytes = max_read_bytes
+
     def _cleanup(self):
-        try:
-            shutil.rmtree(self._subindexes_dir)
-            shutil.rmtree(self._urlmapping_dir)
-        except FileNotFoundError:
-            pass
+        for dpath in [self._subindexes_dir, self._urlmapping_dir,
+                      self._offsets_dir, self._vocabulary_dir]:
+            try:
+                shutil.rmtree(dpath)
+            except FileNotFoundError:
+                pass
+        self._manifest.remove()
 
-    # _gather_statistics reads the final output file, counting the number of
+    # _gather_statistics reads the final output files, counting the number of
     # lists etc to generate final statistics for the indexer run.
-    def _gather_statistics(self):
-        index_size = int(os.stat(self._output_file).st_size / MEGABYTE)
+    def _gather_statistics(self, index_fpaths):
+        index_size = int(sum(os.stat(fpath).st_size for fpath in index_fpaths) /
+                         MEGABYTE)
 
-        num_lists = 0
-        posting_lens = []
+        # The lists of a word in several shards are one list of the index, so
+        # every list of every shard is counted, whatever its length.
+        word_posting_lens = {}
         avg_list_size = 0
 
-        checkpoint = skip_url_mapping(self._output_file, 0)
-        checkpoint = skip_index_metadata(self._output_file, checkpoint)
-        while checkpoint != None:
-            index, checkpoint = read_index(
-                self._output_file, checkpoint, self._max_read_chars_subindex)
-
-            for word in index:
-                posting_lens.append(len(index[word]))
-                num_lists += 1
+        for index_fpath in index_fpaths:
+            for word, (docids, _) in read_index_lists(index_fpath):
+                if len(docids) == 0:
+                    continue
+                word_posting_lens[word] = (word_posting_lens.get(word, 0) +
+                                           len(docids))
 
-            del index
-            gc.collect()
+        num_lists = len(word_posting_lens)
+        posting_lens = list(word_posting_lens.values())
+        del word_posting_lens
 
         if len(posting_lens) == 0:
             avg_list_size = 0
@@ -248,10 +669,13 @@ class Indexer:
 
         return statistics
 
+    # Each chunk is a unit of work of the sampled traces.
+    @log.trace_unit
     def _run(self, subindex):
         memory_limit(self._memory_per_subprocess)
 
         gc.collect()
+        base_vm, _ = reset_peak()
 
         pid = os.getpid()
 
@@ -260,322 +684,294 @@ class Indexer:
         try:
             fpath, old_checkpoint = subindex.pop_file()
 
-            docs, doc_lens, completed, checkpoint = self._streamize(
+            records, completed, checkpoint = self._streamize(
                 fpath, old_checkpoint, pid)
+            preprocessed_docs, doc_lens, doc_locations, num_tokens, forms = (
+                self._tokenize_and_preprocess(records, pid))
+            del records
             for length in doc_lens.values():
                 sum_doc_lens += length
-            tokenized_docs, num_tokens = self._tokenize(docs, pid)
-            del docs
-            preprocessed_docs = self._preprocess(tokenized_docs, pid)
-            del tokenized_docs
+            metrics.add("indexer.docs", len(doc_lens))
+            metrics.add("indexer.tokens", num_tokens)
             gc.collect()
-            index, new_docid = self._produce_index(subindex, preprocessed_docs,
-                                                   doc_lens, pid)
-            self._flush_index(subindex, index, pid)
+            index, positions_index, new_docid, urlmapping_fpath = (
+                self._produce_index(subindex, fpath, preprocessed_docs,
+                                    doc_lens, doc_locations, pid))
+            run_fpath = self._flush_index(subindex, index, positions_index, pid)
             # Only increment subindex docid after really done with portion of
             # index.
             subindex.docid = new_docid
             del index
+            del positions_index
             gc.collect()
 
         except Exception as e:
-            logger.error(f"({pid}) Received unexpected exception: "+
-                         f"{e}. Returning immediately.", exc_info=True)
+            logger.error("(%s) Received unexpected exception: %s. Returning "+
+                         "immediately.", pid, e, exc_info=True)
+            chunk_memory = (0, None, None, isinstance(e, MemoryError))
             try:
                 # Here we don't care if the file was fully processed or not. We
                 # need to restore the previous state so that we can try again.
                 subindex.docid = old_docid
                 subindex.push_file(fpath, old_checkpoint)
-                return subindex, False, 0, 0
+                return (subindex, False, 0, 0, {}, None, metrics.collect(),
+                        chunk_memory)
             except Exception as e:
-                logger.error(f"({pid}) Error pushing file to subindex: {e}.")
-                return subindex, False, 0, 0
+                logger.error("(%s) Error pushing file to subindex: %s.", pid, e)
+                return (subindex, False, 0, 0, {}, None, metrics.collect(),
+                        chunk_memory)
 
         try:
             if not completed:
                 subindex.push_file(fpath, checkpoint)
         except Exception as e:
-            logger.error(f"({pid}) Error pushing file to subindex: {e}.")
+            logger.error("(%s) Error pushing file to subindex: %s.", pid, e)
 
         completed_subindex = False
         if len(subindex) == 0:
-            logger.info(f"({pid}) Completed subindex with id {subindex.id}")
+            logger.info("(%s) Completed subindex with id %d", pid, subindex.id)
             completed_subindex = True
 
-        return subindex, completed_subindex, sum_doc_lens, num_tokens
+        work_unit = (fpath, old_checkpoint, checkpoint, run_fpath,
+                     urlmapping_fpath, subindex.id)
 
-    def _streamize(self, fpath: str, old_checkpoint: int, pid="Unknown"):
-        logger.info(f"({pid}) Streamizing doc for path '{fpath}', "+
-                    f"with old_checkpoint {old_checkpoint}")
-        log_memory_usage(logger)
-
-        new_docs = {}
-        doc_lens = {}
-        parsed_whole_file = True
-        with open(fpath, 'rb') as stream:
-
-            for record in ArchiveIterator(stream):
-                if stream.tell() < old_checkpoint:
-                    continue
-                if (stream.tell() - old_checkpoint >=
-                    self._max_read_bytes
-                ):
-                    parsed_whole_file = False
-                    break
+        peak_vm, _ = peak_memory_usage()
+        chunk_memory = (checkpoint - old_checkpoint, base_vm, peak_vm, False)
 
-                url = get_warcio_record_url(record)
-                text = record.content_stream().read()
-                normalized_text = PlaintextParser.normalize_text(text)
-                new_docs[url] = normalized_text
+        return (subindex, completed_subindex, sum_doc_lens, num_tokens, forms,
+                work_unit, metrics.collect(), chunk_memory)
 
-                doc_lens[url] = len(normalized_text)
-
-            new_checkpoint = stream.tell()
-
-        logger.info(f"({pid}) Successfully streamized doc for path '{fpath}'. "+
-                    f"Size of docs: {len(new_docs)}. Number of bytes read: "+
-                    f"{new_checkpoint - old_checkpoint}")
+    # _streamize reads the raw records of the next chunk of a file. Checkpoints
+    # are record offsets, so the chunk starts by seeking to its first record.
+    @metrics.timed("indexer.streamize")
+    def _streamize(self, fpath: str, old_checkpoint: int, pid="Unknown"):
+        logger.info("(%s) Streamizing doc for path '%s', with old_checkpoint "+
+                    "%s", pid, fpath, old_checkpoint)
         log_memory_usage(logger)
 
-        return new_docs, doc_lens, parsed_whole_file, new_checkpoint
+        offsets = record_offsets(self._offsets_dir, fpath)
+        records, parsed_whole_file, new_checkpoint = read_records(
+            fpath, offsets, old_checkpoint, self._max_read_bytes)
+        del offsets
 
-    def _tokenize(self, docs, pid="Unknown") -> Mapping[str, List[str]]:
-        logger.info(f"({pid}) Tokenizing docs")
+        logger.info("(%s) Successfully streamized doc for path '%s'. Number "+
+                    "of records: %d. Number of bytes read: %d", pid, fpath,
+                    len(records), new_checkpoint - old_checkpoint)
         log_memory_usage(logger)
 
-        num_tokens = 0
-        for doc in docs:
-            docs[doc] = tokenize(docs[doc])
-            num_tokens += len(docs[doc])
+        return records, parsed_whole_file, new_checkpoint
 
-        logger.info(f"({pid}) Successfully tokenized docs")
-        logger.debug(f"({pid}) Tokenized docs len: {len(docs)}")
+    # _tokenize_and_preprocess decompresses, parses, tokenizes and normalizes
+    # the records of a chunk. The records are split in batches of consecutive
+    # records, one per tokenizer: the worker processes the first batch itself
+    # while its tokenizer pool processes the others. Batches are combined in
+    # order, so docids do not depend on the number of tokenizers. The metrics
+    # of every batch are added to the ones of the worker.
+    def _tokenize_and_preprocess(self, records, pid="Unknown"):
+        logger.info("(%s) Tokenizing and preprocessing docs", pid)
         log_memory_usage(logger)
 
-        return docs, num_tokens
-
-    def _preprocess(self, tokenized_docs, pid="Unknown") -> Mapping[str, Mapping[str, int]]:
-        logger.info(f"({pid}) Preprocessing docs")
-        log_memory_usage(logger)
-
-        preprocessed_docs = tokenized_docs
-        for doc in tokenized_docs:
-            doc_words = tokenized_docs[doc]
-
-            # map word -> freq
-            processed_word_freq = {}
-            for word in doc_words:
-                normalized_word = normalize_word(word)
-                if normalized_word == None:
-                    continue
-
-                # Increment frequency
-                if normalized_word not in processed_word_freq:
-                    processed_word_freq[normalized_word] = 0
-                processed_word_freq[normalized_word] += 1
-
-            preprocessed_docs[doc] = processed_word_freq
-
-        logger.info(f"({pid}) Successfully preprocessed docs")
-        logger.debug(f"({pid}) Preprocessed docs len: {len(preprocessed_docs)}")
+        batches = [(batch, self._positions) for batch in
+                   split_batches(records, self._num_tokenizers)]
+        pending = None
+        if len(batches) > 1:
+            pending = tokenizer_pool(self._num_tokenizers - 1).map_async(
+                process_batch, batches[1:])
+        results = [process_batch(batches[0])]
+        if pending != None:
+            results += pending.get()
+
+        preprocessed_docs = {}
+        doc_lens = {}
+        doc_locations = {}
+        num_tokens = 0
+        forms = {}
+        for (batch_docs, batch_doc_lens, batch_doc_locations, batch_num_tokens,
+             batch_forms, batch_metrics) in results:
+            preprocessed_docs.update(batch_docs)
+            doc_lens.update(batch_doc_lens)
+            doc_locations.update(batch_doc_locations)
+            num_tokens += batch_num_tokens
+            for form, (word, count) in batch_forms.items():
+                if form in forms:
+                    count += forms[form][1]
+                forms[form] = (word, count)
+            metrics.merge(batch_metrics)
+
+        logger.info("(%s) Successfully tokenized and preprocessed docs in %d "+
+                    "batches", pid, len(batches))
+        logger.debug("(%s) Preprocessed docs len: %d", pid,
+                     len(preprocessed_docs))
         log_memory_usage(logger)
 
-        return preprocessed_docs
+        return preprocessed_docs, doc_lens, doc_locations, num_tokens, forms
 
-    def _produce_index(self, subindex, preprocessed_docs, doc_lens, pid="Unknown"):
-        logger.info(f"({pid}) Indexing docs")
+    # _produce_index also writes the URL mapping run of the chunk, and its
+    # documents run, with the location of the record of every document in the
+    # file of the chunk.
+    @metrics.timed("indexer.produce")
+    def _produce_index(self, subindex, fpath, preprocessed_docs, doc_lens,
+                       doc_locations, pid="Unknown"):
+        logger.info("(%s) Indexing docs", pid)
         log_memory_usage(logger)
 
         urlmapping_fpath = (f"{self._urlmapping_dir}/"+
                             f"{subindex.id}_{subindex.docid}_"+
                             f"{self._output_file}")
         index = {}
+        positions_index = None
+        if self._positions:
+            positions_index = {}
         url_mapping = {}
+        documents = {}
+        fpath = os.path.abspath(fpath)
         docid = subindex.docid
+        buffer_bytes = 0
         for url in preprocessed_docs:
             url_mapping[docid + subindex.docid_offset] = (doc_lens[url], url)
+            documents[docid + subindex.docid_offset] = (fpath,
+                                                        *doc_locations[url])
 
             word_freq = preprocessed_docs[url]
             for word in word_freq:
                 freq = word_freq[word]
+                if positions_index != None:
+                    if word not in positions_index:
+                        positions_index[word] = []
+                        buffer_bytes += self._bytes_per_list
+                    positions = positions_str(freq)
+                    positions_index[word].append((docid, positions))
+                    buffer_bytes += self._bytes_per_posting + len(positions)
+                    freq = len(freq)
                 if word not in index:
                     index[word] = []
+                    buffer_bytes += self._bytes_per_list
                 index[word].append((docid, freq))
+                buffer_bytes += self._bytes_per_posting
             docid += 1
+        metrics.add("indexer.buffer_bytes", buffer_bytes)
 
         write_url_mapping(url_mapping, urlmapping_fpath)
-
-        logger.info(f"({pid}) Successfully indexed docs")
-        logger.debug(f"({pid}) Index result: {index}")
+        write_documents_run(documents, documents_fpath(urlmapping_fpath))
+
+        logger.info("(%s) Successfully indexed docs. Size of index buffer: "+
+                    "%.2fMB", pid, buffer_bytes / MEGABYTE)
+        if log.enabled(log.DEBUG):
+            logger.debug("(%s) Index result: %s", pid, index)
+        log.trace("(%s) Index of chunk of subindex %d: %d words, %s postings",
+                  pid, subindex.id, len(index),
+                  log.lazy(sum, map(len, index.values())))
         log_memory_usage(logger)
 
-        return index, docid
+        return index, positions_index, docid, urlmapping_fpath
 
-    def _flush_index(self, subindex, index, pid="Unknown"):
+    @metrics.timed("indexer.flush")
+    def _flush_index(self, subindex, index, positions_index, pid="Unknown"):
         outfpath = (f"{self._subindexes_dir}/"+
                     f"{subindex.id}_{subindex.docid}_{self._output_file}")
 
-        logger.info(f"({pid}) Flushing index to path '{outfpath}'")
+        logger.info("(%s) Flushing index to path '%s'", pid, outfpath)
         log_memory_usage(logger)
 
         write_index(index, outfpath, subindex.docid_offset)
+        if positions_index != None:
+            write_positions_run(positions_index, outfpath, subindex.docid_offset)
 
-        logger.info(f"({pid}) Successfully flushed index to path '{outfpath}'")
+        logger.info("(%s) Successfully flushed index to path '%s'", pid,
+                    outfpath)
         log_memory_usage(logger)
 
-    def _merge_url_mappings(self):
+        return outfpath
+
+    def _merge_url_mappings(self, outfpath, fpaths):
         logger.info(f"Merging URL mapping from dir '{self._urlmapping_dir}' to "+
-                    f"file '{self._output_file}'")
+                    f"file '{outfpath}'")
         log_memory_usage(logger)
 
-        write_url_mapping_begin(self._output_file)
+        write_url_mapping_begin(outfpath)
 
-        fpaths = glob.glob(f"{self._urlmapping_dir}/*")
         if len(fpaths) == 0:
-            write_url_mapping_end(self._output_file)
+            write_url_mapping_end(outfpath)
             return
 
+        # URL mappings are copied, not moved, so that the output can be
+        # assembled again if the run is resumed. They are removed on cleanup.
         for infpath in fpaths:
-            move_file(infpath, self._output_file, self._max_read_chars_subindex * 4)
+            copy_file(infpath, outfpath, self._max_read_chars_subindex * 4)
 
-        write_url_mapping_end(self._output_file)
+        write_url_mapping_end(outfpath)
 
         logger.info(f"Successfully merged URL mapping from dir "+
-                    f"'{self._urlmapping_dir}' to file '{self._output_file}'")
+                    f"'{self._urlmapping_dir}' to file '{outfpath}'")
         log_memory_usage(logger)
 
-    def _append_index_metadata(self):
-        logger.info(f"Appending index metadata to '{self._output_file}'")
-
-        write_index_metadata_begin(self._output_file)
+    def _append_index_metadata(self, outfpath, max_docid):
+        logger.info(f"Appending index metadata to '{outfpath}'")
 
+        # The number of documents and their average length are the ones of
+        # the whole index, even if the file is only a shard of it.
         num_docs = self._num_docs
-        max_docid = self._max_docid
         if num_docs != 0:
             avg_doc_len = self._sum_doc_lens / num_docs
         else:
             avg_doc_len = 0
 
-        with open(self._output_file, "a") as f:
-            f.write(f"{NUM_DOCS_KEY} {num_docs}\n")
-            f.write(f"{MAX_DOCID_KEY} {max_docid}\n")
-            f.write(f"{AVG_DOC_LEN_KEY} {avg_doc_len}\n")
+        write_index_metadata(outfpath, num_docs, max_docid, avg_doc_len)
 
-        write_index_metadata_end(self._output_file)
+        logger.info(f"Successfully appended index metadata to '{outfpath}'")
 
-        logger.info(f"Successfully appended index metadata to '{self._output_file}'")
+    # _run_first_docid returns the first docid of a run, named after the id of
+    # its subindex and the docid of its first document in the subindex.
+    def _run_first_docid(self, run_fpath):
+        id, docid = os.path.basename(run_fpath).split("_")[:2]
+        subindex = self._manifest.subindexes[int(id)]
+        return subindex["docid_offset"] + int(docid)
 
-    def _merge_index(self):
+    @metrics.timed("indexer.merge_index")
+    def _merge_index(self, outfpath, fpaths):
         logger.info(f"Merging index from dir '{self._subindexes_dir}' to file "+
-                    f"'{self._output_file}'")
+                    f"'{outfpath}'")
         log_memory_usage(logger)
 
-        fpaths = glob.glob(f"{self._subindexes_dir}/*")
+        # Runs are merged in docid order, so that every merged run covers a
+        # contiguous docid range, and the postings of a word in different runs
+        # never interleave.
+        fpaths = sorted(fpaths, key=self._run_first_docid)
         if len(fpaths) == 0:
             return
 
+        # Runs are merged _merge_fan_in at a time, so that the number of open
+        # files stays bounded.
         while len(fpaths) > 1:
             log_memory_usage(logger)
 
-            index1_fpath = fpaths.pop(0)
-            index2_fpath = fpaths.pop(0)
-            merged_index_outfpath = index2_fpath + "_"
-
-            checkpoint1 = 0
-            checkpoint2 = 0
-            while checkpoint1 != None:
-                index1, checkpoint1 = read_index(index1_fpath, checkpoint1,
-                                                 self._max_read_chars_subindex)
-                logger.info(f"Read index 1. Size: {len(index1)}")
-
-                if checkpoint2 != None:
-                    sorted_words_index1 = sorted(list(index1.keys()))
-                while checkpoint2 != None:
-                    if len(sorted_words_index1) == 0:
-                        break
-
-                    index2, checkpoint2 = read_index(index2_fpath, checkpoint2,
-                                                     self._max_read_chars_subindex)
-                    logger.info(f"Read index 2. Size: {len(index2)}")
-                    if len(index2) == 0:
-                        continue
-
-                    sorted_words_index2 = sorted(list(index2.keys()))
-                    last_index1 = len(sorted_words_index1) - 1
-                    while checkpoint1 != None:
-                        while (sorted_words_index2[-1] <
-                               sorted_words_index1[last_index1] and last_index1 > 0
-                        ):
-                            last_index1 -= 1
-                        if last_index1 != len(sorted_words_index1) - 1:
-                            break
-
-                        for word in sorted_words_index1:
-                            if word in index2:
-                                index2[word] = sorted(index2[word] + index1[word])
-                            else:
-                                index2[word] = index1[word]
-                        del index1
-                        del sorted_words_index1
-                        gc.collect()
-
-                        # If index1 is entirely within index2, we should read
-                        # new piece of index1 from file, to make sure that we
-                        # aren't missing out on some piece of index1 when
-                        # merging with index2.
-                        #
-                        # Example:
-                        #
-                        # index1 = {
-                        #  "a": [(1,2)],
-                        #  "b": [(1,1)]
-                        # }
-                        #
-                        # index2 = {
-                        #  "b": [(3,4)]
-                        # }
-                        #
-                        # Notice that b >= b >= a, so last_index1 == 1
-                        #
-                        index1, checkpoint1 = read_index(
-                            index1_fpath, checkpoint1, self._max_read_chars_subindex)
-                        logger.info(f"Read index 1 inside internal loop. "+
-                                    f"Size: {len(index1)}")
-                        sorted_words_index1 = sorted(list(index1.keys()))
-                        last_index1 = len(sorted_words_index1) - 1
-                        while (sorted_words_index2[-1] <
-                               sorted_words_index1[last_index1] and last_index1 > 0
-                        ):
-                            last_index1 -= 1
-
-                    for word in sorted_words_index1[:last_index1]:
-                        if word in index2:
-                            index2[word] = sorted(index2[word] + index1[word])
-                        else:
-                            index2[word] = index1[word]
-
-                    # Remove merged words from index1
-                    for word in sorted_words_index1[:last_index1 + 1]:
-                        index1.pop(word)
-                    sorted_words_index1 = sorted_words_index1[last_index1 + 1:]
-
-                    write_index(index2, merged_index_outfpath, 0)
-                    del index2
-                    gc.collect()
-
-                write_index(index1, merged_index_outfpath, 0)
-                del index1
-                gc.collect()
-
-            shutil.move(merged_index_outfpath, index2_fpath)
-
-            logger.info(f"Done with file '{index1_fpath}'")
-            os.remove(index1_fpath)
-            fpaths.append(index2_fpath)
+            infpaths = fpaths[:self._merge_fan_in]
+            fpaths = fpaths[self._merge_fan_in:]
+            merged_index_outfpath = infpaths[0] + "_"
+
+            merge_index_files(infpaths, merged_index_outfpath)
+            if self._positions:
+                merge_index_files([positions_fpath(f) for f in infpaths],
+                                  positions_fpath(merged_index_outfpath))
+
+            # The merged run only replaces its inputs in the manifest once it
+            # is complete, so an interrupted merge is simply redone.
+            self._manifest.replace_runs(infpaths, merged_index_outfpath)
+            self._save_manifest()
+
+            for infpath in infpaths:
+                logger.info("Done with file '%s'", infpath)
+                os.remove(infpath)
+                if self._positions:
+                    os.remove(positions_fpath(infpath))
+            fpaths.append(merged_index_outfpath)
 
         log_memory_usage(logger)
-        move_file(fpaths.pop(), self._output_file, self._max_read_chars_subindex*4)
+        run_fpath = fpaths.pop()
+        copy_file(run_fpath, outfpath, self._max_read_chars_subindex*4)
+        if self._positions:
+            write_positions(positions_fpath(run_fpath), positions_fpath(outfpath))
 
         logger.info(f"Successfully merged index from dir '{self._subindexes_dir}'"+
-                    f" to file '{self._output_file}'")
+                    f" to file '{outfpath}'")
         log_memory_usage(logger)
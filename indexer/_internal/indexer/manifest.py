@@ -0,0 +1,105 @@
+import json
+import os
+
+from common.log import log
+from .subindex import Subindex
+
+logger = log.logger()
+
+PHASE_PRODUCING = "producing"
+PHASE_MERGING   = "merging"
+
+# Manifest keeps track of the work already done by an indexer run, so that a
+# crashed run can be resumed instead of restarted from scratch. It is always
+# written atomically: a crash in the middle of save() leaves the previous
+# version of the manifest intact.
+class Manifest:
+    def __init__(self, fpath):
+        self._fpath = fpath
+
+        self.phase = PHASE_PRODUCING
+        self.subindexes = {}
+        # (file, old_checkpoint, new_checkpoint) of every chunk of a WARC file
+        # that has been indexed and flushed.
+        self.completed_units = []
+        # Flushed index and URL mapping runs, in the subindexes and urlmapping
+        # directories respectively, mapped to the id of their subindex.
+        self.runs = {}
+        self.url_mappings = {}
+        # Forms of the vocabulary of every completed unit, in the vocabulary
+        # directory, since the vocabulary of the run is only kept in memory.
+        self.vocabularies = []
+        self.counters = {}
+
+    def set_subindex(self, subindex: Subindex):
+        self.subindexes[subindex.id] = subindex.to_dict()
+
+    def get_subindexes(self):
+        return [Subindex.from_dict(self.subindexes[id])
+                for id in sorted(self.subindexes)]
+
+    def add_completed_unit(self, fpath, old_checkpoint, new_checkpoint,
+                           run_fpath, url_mapping_fpath, subindex_id):
+        self.completed_units.append([fpath, old_checkpoint, new_checkpoint])
+        # A chunk without documents does not advance the subindex docid, so
+        # its run shares the file of the previous one.
+        self.runs[run_fpath] = subindex_id
+        self.url_mappings[url_mapping_fpath] = subindex_id
+
+    def add_vocabulary(self, vocabulary_fpath):
+        self.vocabularies.append(vocabulary_fpath)
+
+    # replace_runs replaces runs by the result of merging them. The merged run
+    # is attributed to the subindex of the first of them.
+    def replace_runs(self, old_runs, new_run):
+        subindex_id = self.runs[old_runs[0]]
+        for run in old_runs:
+            self.runs.pop(run)
+        self.runs[new_run] = subindex_id
+
+    def save(self):
+        manifest_map = {
+            "phase": self.phase,
+            "subindexes": self.subindexes,
+            "completed_units": self.completed_units,
+            "runs": self.runs,
+            "url_mappings": self.url_mappings,
+            "vocabularies": self.vocabularies,
+            "counters": self.counters,
+        }
+
+        tmp_fpath = self._fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump(manifest_map, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fpath, self._fpath)
+
+    def remove(self):
+        try:
+            os.remove(self._fpath)
+        except FileNotFoundError:
+            pass
+
+def read_manifest(fpath):
+    logger.info(f"Reading indexer manifest from '{fpath}'")
+
+    with open(fpath, "r") as f:
+        manifest_map = json.load(f)
+
+    manifest = Manifest(fpath)
+    manifest.phase = manifest_map["phase"]
+    # JSON object keys are always strings.
+    manifest.subindexes = {int(id): state for id, state in
+                           manifest_map["subindexes"].items()}
+    manifest.completed_units = manifest_map["completed_units"]
+    manifest.runs = manifest_map["runs"]
+    manifest.url_mappings = manifest_map["url_mappings"]
+    manifest.vocabularies = manifest_map["vocabularies"]
+    manifest.counters = manifest_map["counters"]
+
+    logger.info(f"Successfully read indexer manifest from '{fpath}'. Phase: "+
+                f"{manifest.phase}. Completed units: "+
+                f"{len(manifest.completed_units)}. Runs: {len(manifest.runs)}")
+
+    return manifest
@@ -0,0 +1,30 @@
+from common.log import log
+from common.utils.marks import SKIPS_MARK_SPACING
+
+logger = log.logger()
+
+# write_marks writes the marks file of an index from its skips file: a mark for
+# the first line of the skips file, and then for the first line starting at
+# least SKIPS_MARK_SPACING bytes after the previous mark.
+def write_marks(skips_fpath, outfpath):
+    logger.info(f"Writing marks of '{skips_fpath}' to '{outfpath}'")
+
+    num_marks = 0
+    # The skips file is read in binary mode, so that offsets are byte offsets.
+    with open(skips_fpath, "rb") as f:
+        with open(outfpath, "w", encoding="utf-8") as outf:
+            offset = 0
+            mark_offset = None
+            for line in f:
+                line_offset = offset
+                offset += len(line)
+                if (mark_offset != None and
+                    line_offset < mark_offset + SKIPS_MARK_SPACING
+                ):
+                    continue
+                word = line.decode("utf-8").split(" ", 1)[0]
+                outf.write(f"{word} {line_offset}\n")
+                mark_offset = line_offset
+                num_marks += 1
+
+    logger.info(f"Successfully wrote {num_marks} marks to '{outfpath}'")
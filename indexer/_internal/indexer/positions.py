@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import struct
+
+from common.log import log
+from common.utils.index import SKIP_INTERVAL
+from common.utils.positions import (positions_fpath,
+                                    encode_positions,
+                                    decode_varint,
+                                    read_dictionary,
+                                    POSITIONS_MAGIC,
+                                    HEADER_FORMAT,
+                                    WORD_FORMAT,
+                                    ENTRY_FORMAT,
+                                    SKIPS_FORMAT,
+                                    FOOTER_FORMAT)
+from .utils import write_index
+
+logger = log.logger()
+
+# Positions runs are text files with the same layout as index runs, with the
+# positions of each posting joined by POSITIONS_SEPARATOR in place of its
+# frequency, so they can be merged like index runs.
+POSITIONS_SEPARATOR = ":"
+
+def write_positions_run(positions_index, run_fpath, docid_offset):
+    write_index(positions_index, positions_fpath(run_fpath), docid_offset)
+
+def positions_str(positions):
+    return POSITIONS_SEPARATOR.join(str(position) for position in positions)
+
+# _write_positions_file writes a positions file with the given (word, postings)
+# lists, where each posting is already encoded.
+def _write_positions_file(lists, outfpath):
+    num_words = 0
+    dictionary = bytearray()
+    with open(outfpath, "wb") as outf:
+        outf.write(struct.pack(HEADER_FORMAT, POSITIONS_MAGIC))
+        for word, postings in lists:
+            offset = outf.tell()
+            skips = []
+            block = bytearray()
+            for i, posting in enumerate(postings):
+                if i > 0 and i % SKIP_INTERVAL == 0:
+                    skips.append(len(block))
+                block += posting
+            outf.write(block)
+
+            encoded_word = word.encode("utf-8")
+            dictionary += struct.pack(WORD_FORMAT, len(encoded_word))
+            dictionary += encoded_word
+            dictionary += struct.pack(ENTRY_FORMAT, offset, len(block),
+                                      len(skips))
+            dictionary += struct.pack(SKIPS_FORMAT.format(len(skips)), *skips)
+            num_words += 1
+
+        dictionary_offset = outf.tell()
+        outf.write(dictionary)
+        outf.write(struct.pack(FOOTER_FORMAT, dictionary_offset))
+
+    return num_words
+
+def _run_lists(run_fpath):
+    with open(run_fpath, "r", encoding="utf-8") as f:
+        for line in f:
+            split_by_space = line.rstrip("\n").split(" ")
+            if len(split_by_space) <= 1:
+                continue
+            postings = []
+            for posting_str in split_by_space[1:]:
+                _, positions = posting_str.split(",")
+                posting = bytearray()
+                encode_positions([int(position) for position in
+                                  positions.split(POSITIONS_SEPARATOR)],
+                                 posting)
+                postings.append(posting)
+            yield split_by_space[0], postings
+
+# write_positions encodes the merged positions run of an index file into its
+# positions file.
+def write_positions(run_fpath, outfpath):
+    logger.info(f"Writing positions of '{run_fpath}' to '{outfpath}'")
+
+    num_words = _write_positions_file(_run_lists(run_fpath), outfpath)
+
+    logger.info(f"Successfully wrote positions of {num_words} words to "+
+                f"'{outfpath}'")
+
+def _split_postings(block):
+    postings = []
+    pos = 0
+    while pos < len(block):
+        length, end = decode_varint(block, pos)
+        postings.append(block[pos:end + length])
+        pos = end + length
+    return postings
+
+def _positions_file_lists(fpath):
+    with open(fpath, "rb") as f:
+        for word, (offset, length, _), _ in read_dictionary(fpath):
+            f.seek(offset)
+            yield word, _split_postings(f.read(length))
+
+# merge_positions merges the positions files of index files with disjoint and
+# increasing docid ranges, like the segments of an index, in that order.
+def merge_positions(fpaths, outfpath):
+    logger.info(f"Merging positions files {fpaths} into '{outfpath}'")
+
+    lists = heapq.merge(*[_positions_file_lists(fpath) for fpath in fpaths],
+                        key=lambda l: l[0])
+    merged_lists = ((word, [posting for _, postings in word_lists
+                            for posting in postings])
+                    for word, word_lists in
+                    itertools.groupby(lists, key=lambda l: l[0]))
+    num_words = _write_positions_file(merged_lists, outfpath)
+
+    logger.info(f"Successfully merged positions of {num_words} words into "+
+                f"'{outfpath}'")
@@ -0,0 +1,313 @@
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+
+from common.log import log
+from common.utils.segments import (segments_fpath,
+                                   segments_lock_fpath,
+                                   FPATH_KEY,
+                                   CORPUS_FILES_KEY,
+                                   NUM_DOCS_KEY,
+                                   MIN_DOCID_KEY,
+                                   MAX_DOCID_KEY,
+                                   SUM_DOC_LENS_KEY)
+from common.utils.term_stats import term_stats_fpath
+from common.utils.impacts import (impacts_fpath,
+                                  has_impacts)
+from common.utils.skips import skips_fpath
+from common.utils.marks import marks_fpath
+from common.utils.positions import (positions_fpath,
+                                    has_positions)
+from common.utils.documents import (documents_fpath,
+                                    has_documents)
+from common.utils.url_mapping import (BEGIN_URL_MAPPING, END_URL_MAPPING)
+from common.utils.utils import (relative_fpath,
+                                resolve_fpath)
+from .index_metadata import (write_index_metadata,
+                             skip_index_metadata)
+from .url_mapping import (write_url_mapping_begin,
+                          write_url_mapping_end,
+                          skip_url_mapping)
+from .term_stats import write_term_stats
+from .impacts import write_impacts
+from .skips import write_skips
+from .marks import write_marks
+from .positions import merge_positions
+from .documents import merge_documents
+from .utils import (merge_index_files,
+                    remove_index_file,
+                    replace_index_file)
+
+logger = log.logger()
+
+# SegmentList is the writable view of the segments of an index. Every
+# modification must happen inside locked(), since incremental runs and
+# background merges may update the list concurrently. Segments merged away are
+# retired: they stay on disk, and in the list of retired segments, until no
+# query processor uses them anymore.
+class SegmentList:
+    def __init__(self, index_fpath):
+        self._index_fpath = index_fpath
+        self._fpath = segments_fpath(index_fpath)
+        self.next_segment_id = 1
+        self.next_merge_id = 1
+        self.segments = []
+        self.retired = []
+
+    @contextmanager
+    def locked(self):
+        with open(segments_lock_fpath(self._index_fpath), "a") as lockf:
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+            try:
+                self._read()
+                yield self
+            finally:
+                fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(self._fpath)
+
+    def _read(self):
+        if not self.exists():
+            self.next_segment_id = 1
+            self.next_merge_id = 1
+            self.segments = []
+            self.retired = []
+            return
+        with open(self._fpath, "r") as f:
+            segments_map = json.load(f)
+        self.next_segment_id = segments_map["next_segment_id"]
+        self.next_merge_id = segments_map.get("next_merge_id", 1)
+        self.segments = segments_map["segments"]
+        for segment in self.segments:
+            segment[FPATH_KEY] = resolve_fpath(segment[FPATH_KEY],
+                                               self._index_fpath)
+        self.retired = [resolve_fpath(fpath, self._index_fpath)
+                        for fpath in segments_map.get("retired", [])]
+
+    def save(self):
+        segments_map = {
+            "next_segment_id": self.next_segment_id,
+            "next_merge_id": self.next_merge_id,
+            "segments": [dict(segment, **{FPATH_KEY: relative_fpath(
+                segment[FPATH_KEY], self._index_fpath)})
+                         for segment in self.segments],
+            "retired": [relative_fpath(fpath, self._index_fpath)
+                        for fpath in self.retired],
+        }
+        tmp_fpath = self._fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump(segments_map, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fpath, self._fpath)
+
+    # remove deletes all the segments of the index, retired or not, the
+    # segments list and its lock.
+    def remove(self):
+        for segment in self.segments:
+            remove_index_file(segment[FPATH_KEY])
+        for fpath in self.retired:
+            remove_index_file(fpath)
+        self.segments = []
+        self.retired = []
+        if self.exists():
+            os.remove(self._fpath)
+        if os.path.exists(segments_lock_fpath(self._index_fpath)):
+            os.remove(segments_lock_fpath(self._index_fpath))
+
+    # delete_retired deletes the retired segments that no query processor
+    # holds a lock on, and returns whether the list changed.
+    def delete_retired(self):
+        retired = []
+        for fpath in self.retired:
+            if _in_use(fpath):
+                retired.append(fpath)
+            else:
+                logger.info(f"Deleting retired segment '{fpath}'")
+                remove_index_file(fpath)
+        changed = len(retired) != len(self.retired)
+        self.retired = retired
+        return changed
+
+    def new_segment_fpath(self):
+        return f"{self._index_fpath}.{self.next_segment_id}"
+
+    # Merged segments are named apart from the segments of incremental runs,
+    # which only register their segment once they are done.
+    def new_merged_segment_fpath(self):
+        return f"{self._index_fpath}.m{self.next_merge_id}"
+
+    def max_docid(self):
+        if len(self.segments) == 0:
+            return 0
+        return max(segment[MAX_DOCID_KEY] for segment in self.segments)
+
+    def corpus_files(self):
+        corpus_files = set()
+        for segment in self.segments:
+            corpus_files.update(segment[CORPUS_FILES_KEY])
+        return corpus_files
+
+# _in_use tells whether a query processor holds a shared lock on the segment.
+def _in_use(fpath):
+    try:
+        with open(fpath, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(f, fcntl.LOCK_UN)
+    except FileNotFoundError:
+        return False
+    except BlockingIOError:
+        return True
+    return False
+
+def new_segment(fpath, corpus_files, num_docs, min_docid, max_docid,
+                sum_doc_lens):
+    return {
+        FPATH_KEY: fpath,
+        CORPUS_FILES_KEY: corpus_files,
+        NUM_DOCS_KEY: num_docs,
+        MIN_DOCID_KEY: min_docid,
+        MAX_DOCID_KEY: max_docid,
+        SUM_DOC_LENS_KEY: sum_doc_lens,
+    }
+
+# TieredMergePolicy groups segments in tiers of exponentially growing number of
+# documents, and merges merge_factor adjacent segments of the same tier into
+# one segment of the next tier. Segments are only merged with their neighbours,
+# so that the docids of the segment list stay in order.
+class TieredMergePolicy:
+    def __init__(self, merge_factor=4, min_segment_docs=1000):
+        self._merge_factor = merge_factor
+        self._min_segment_docs = min_segment_docs
+
+    def _tier(self, num_docs):
+        tier = 0
+        tier_max_docs = self._min_segment_docs
+        while num_docs >= tier_max_docs:
+            tier_max_docs *= self._merge_factor
+            tier += 1
+        return tier
+
+    # find_merge returns the indexes of the segments to merge next, or None if
+    # no merge is needed.
+    def find_merge(self, segments):
+        tiers = [self._tier(segment[NUM_DOCS_KEY]) for segment in segments]
+        first = 0
+        for i in range(1, len(tiers) + 1):
+            if i == len(tiers) or tiers[i] != tiers[first]:
+                if i - first >= self._merge_factor:
+                    return list(range(first, first + self._merge_factor))
+                first = i
+        return None
+
+# MergeAllPolicy merges all the segments of the index into one.
+class MergeAllPolicy:
+    def find_merge(self, segments):
+        if len(segments) <= 1:
+            return None
+        return list(range(len(segments)))
+
+def _copy_url_mapping_body(infpath, outfpath):
+    with open(infpath, "r") as inf:
+        with open(outfpath, "a") as outf:
+            assert inf.readline() == BEGIN_URL_MAPPING
+            for line in inf:
+                if line == END_URL_MAPPING:
+                    break
+                outf.write(line)
+
+def _write_merged_segment(segments, outfpath):
+    logger.info(f"Merging segments {[s[FPATH_KEY] for s in segments]} into "+
+                f"'{outfpath}'")
+
+    open(outfpath, "w").close()
+
+    write_url_mapping_begin(outfpath)
+    for segment in segments:
+        _copy_url_mapping_body(segment[FPATH_KEY], outfpath)
+    write_url_mapping_end(outfpath)
+
+    merged = new_segment(
+        fpath=outfpath,
+        corpus_files=[f for s in segments for f in s[CORPUS_FILES_KEY]],
+        num_docs=sum(s[NUM_DOCS_KEY] for s in segments),
+        min_docid=segments[0][MIN_DOCID_KEY],
+        max_docid=max(s[MAX_DOCID_KEY] for s in segments),
+        sum_doc_lens=sum(s[SUM_DOC_LENS_KEY] for s in segments),
+    )
+    if merged[NUM_DOCS_KEY] != 0:
+        avg_doc_len = merged[SUM_DOC_LENS_KEY] / merged[NUM_DOCS_KEY]
+    else:
+        avg_doc_len = 0
+    write_index_metadata(outfpath, merged[NUM_DOCS_KEY], merged[MAX_DOCID_KEY],
+                         avg_doc_len)
+
+    checkpoints = []
+    for segment in segments:
+        checkpoint = skip_url_mapping(segment[FPATH_KEY], 0)
+        checkpoints.append(skip_index_metadata(segment[FPATH_KEY], checkpoint))
+    merge_index_files([s[FPATH_KEY] for s in segments], outfpath, checkpoints)
+    write_skips(outfpath, skips_fpath(outfpath))
+    write_marks(skips_fpath(outfpath), marks_fpath(outfpath))
+    write_term_stats([outfpath], term_stats_fpath(outfpath))
+    # The merged segment keeps impacts, positions and documents tables if its
+    # input segments had them.
+    if all(has_impacts(segment[FPATH_KEY]) for segment in segments):
+        write_impacts(outfpath, term_stats_fpath(outfpath),
+                      impacts_fpath(outfpath))
+    if all(has_positions(segment[FPATH_KEY]) for segment in segments):
+        merge_positions([positions_fpath(segment[FPATH_KEY])
+                         for segment in segments], positions_fpath(outfpath))
+    if all(has_documents(segment[FPATH_KEY]) for segment in segments):
+        merge_documents([documents_fpath(segment[FPATH_KEY])
+                         for segment in segments], documents_fpath(outfpath))
+
+    logger.info(f"Successfully merged segments into '{outfpath}'")
+
+    return merged
+
+# merge_segments applies the merge policy to the segments of the index until no
+# more merges are needed. The merged segment is written to a file of its own,
+# and replaces its input segments in the segments list atomically, so the index
+# can be queried while it is being merged. The input segments are retired, and
+# deleted once no query processor uses them.
+def merge_segments(index_fpath, policy=None):
+    policy = policy or TieredMergePolicy()
+    segment_list = SegmentList(index_fpath)
+
+    while True:
+        with segment_list.locked():
+            if segment_list.delete_retired():
+                segment_list.save()
+            merge_idxs = policy.find_merge(segment_list.segments)
+            if merge_idxs == None:
+                break
+            segments = [segment_list.segments[i] for i in merge_idxs]
+            merged_fpath = segment_list.new_merged_segment_fpath()
+            segment_list.next_merge_id += 1
+            segment_list.save()
+
+        # The merged segment only gets its name once it is complete.
+        tmp_fpath = merged_fpath + ".merging"
+        merged = _write_merged_segment(segments, tmp_fpath)
+        merged[FPATH_KEY] = merged_fpath
+
+        with segment_list.locked():
+            fpaths = [segment[FPATH_KEY] for segment in segment_list.segments]
+            input_fpaths = [segment[FPATH_KEY] for segment in segments]
+            if not all(fpath in fpaths for fpath in input_fpaths):
+                logger.warning(f"Segments {input_fpaths} changed while being "+
+                               f"merged. Discarding merge.")
+                remove_index_file(tmp_fpath)
+                continue
+
+            first = fpaths.index(input_fpaths[0])
+            replace_index_file(tmp_fpath, merged_fpath)
+            segment_list.segments[first:first + len(segments)] = [merged]
+            segment_list.retired.extend(input_fpaths)
+            segment_list.delete_retired()
+            segment_list.save()
+
+        logger.info(f"Merged segments {input_fpaths} into '{merged_fpath}'")
@@ -0,0 +1,27 @@
+import json
+import os
+
+from common.log import log
+from common.utils.shards import (shards_fpath,
+                                 read_shards)
+from common.utils.utils import relative_fpath
+from .utils import remove_index_file
+
+logger = log.logger()
+
+def write_shards(index_fpath, shard_fpaths):
+    fpath = shards_fpath(index_fpath)
+    tmp_fpath = fpath + ".tmp"
+    with open(tmp_fpath, "w") as f:
+        json.dump({"shards": [relative_fpath(shard_fpath, index_fpath)
+                              for shard_fpath in shard_fpaths]}, f)
+    os.replace(tmp_fpath, fpath)
+    logger.info(f"Wrote {len(shard_fpaths)} shards to '{fpath}'")
+
+def remove_shards(index_fpath):
+    shard_fpaths = read_shards(index_fpath)
+    if shard_fpaths == None:
+        return
+    for shard_fpath in shard_fpaths:
+        remove_index_file(shard_fpath)
+    os.remove(shards_fpath(index_fpath))
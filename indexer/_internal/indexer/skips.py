@@ -0,0 +1,43 @@
+from common.log import log
+from common.utils.index import SKIP_INTERVAL
+from .index_metadata import skip_index_metadata
+from .url_mapping import skip_url_mapping
+
+logger = log.logger()
+
+# write_skips writes the skips file of an index file.
+def write_skips(index_fpath, outfpath):
+    logger.info(f"Writing skips of '{index_fpath}' to '{outfpath}'")
+
+    checkpoint = skip_url_mapping(index_fpath, 0)
+    checkpoint = skip_index_metadata(index_fpath, checkpoint)
+
+    num_lists = 0
+    num_skips = 0
+    # The index is read in binary mode, so that offsets are byte offsets.
+    with open(index_fpath, "rb") as f:
+        with open(outfpath, "w", encoding="utf-8") as outf:
+            f.seek(checkpoint)
+            offset = checkpoint
+            for line in f:
+                line_offset = offset
+                offset += len(line)
+                split_line = line.decode("utf-8").rstrip("\n").split(" ", 1)
+                if len(split_line) < 2:
+                    continue
+                word, postings_str = split_line
+
+                outf.write(f"{word} {line_offset}")
+                # Postings are ASCII, so character and byte offsets match.
+                skip_offset = 0
+                for i, posting_str in enumerate(postings_str.split(" ")):
+                    if i > 0 and i % SKIP_INTERVAL == 0:
+                        docid = posting_str[:posting_str.index(",")]
+                        outf.write(f" {docid},{skip_offset}")
+                        num_skips += 1
+                    skip_offset += len(posting_str) + 1
+                outf.write("\n")
+                num_lists += 1
+
+    logger.info(f"Successfully wrote {num_skips} skips of {num_lists} lists to "+
+                f"'{outfpath}'")
@@ -9,6 +9,7 @@ class Statistics:
         self.num_docs = None
         self.num_tokens = None
         self.posting_lens = None
+        self.phase_times = None
 
     def set_index_size(self, index_size):
         self.index_size = index_size
@@ -31,6 +32,9 @@ class Statistics:
     def set_posting_lens(self, posting_lens):
         self.posting_lens = posting_lens
 
+    def set_phase_times(self, phase_times):
+        self.phase_times = phase_times
+
     def to_json(self, extra_statistics=False):
         statistics_map = {
             "Index Size": self.index_size,
@@ -43,5 +47,9 @@ class Statistics:
             statistics_map["Number of documents"] = self.num_docs
             statistics_map["Number of tokens"] = self.num_tokens
             statistics_map["Distribution of posting lengths"] = self.posting_lens
+            statistics_map["Phase times"] = {
+                phase: round(seconds, 3)
+                for phase, seconds in (self.phase_times or {}).items()
+            }
 
         return json.dumps(statistics_map)
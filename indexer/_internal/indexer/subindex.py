@@ -16,3 +16,19 @@ class Subindex:
 
     def pop_file(self):
         return self._files.popitem()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "docid": self.docid,
+            "docid_offset": self.docid_offset,
+            "files": list(self._files.items()),
+        }
+
+    def from_dict(d):
+        subindex = Subindex(d["id"])
+        subindex.docid = d["docid"]
+        subindex.docid_offset = d["docid_offset"]
+        for fpath, checkpoint in d["files"]:
+            subindex.push_file(fpath, checkpoint)
+        return subindex
@@ -0,0 +1,51 @@
+import heapq
+import itertools
+
+from common.log import log
+from common.utils.index_metadata import read_index_metadata
+from common.utils.scoring import (idf,
+                                  bm25)
+from .url_mapping import (read_doc_lens,
+                          skip_url_mapping)
+from .utils import read_index_lists
+
+logger = log.logger()
+
+# write_term_stats writes the term statistics table of the index made of the
+# given index files, streaming over their sorted lists. The number of documents
+# and average document length are taken from the metadata of the first file,
+# which for shards are the ones of the whole index.
+def write_term_stats(index_fpaths, outfpath):
+    logger.info(f"Writing term statistics of {index_fpaths} to '{outfpath}'")
+
+    checkpoint = skip_url_mapping(index_fpaths[0], 0)
+    metadata, _ = read_index_metadata(index_fpaths[0], checkpoint)
+    doc_lens = {}
+    for index_fpath in index_fpaths:
+        read_doc_lens(index_fpath, doc_lens)
+
+    num_words = 0
+    lists = heapq.merge(*[read_index_lists(fpath) for fpath in index_fpaths],
+                        key=lambda l: l[0])
+    with open(outfpath, "w", encoding="utf-8") as outf:
+        for word, word_lists in itertools.groupby(lists, key=lambda l: l[0]):
+            docids = []
+            freqs = []
+            for _, (word_docids, word_freqs) in word_lists:
+                docids.extend(word_docids)
+                freqs.extend(word_freqs)
+            df = len(docids)
+            cf = 0
+            max_tf = 0
+            max_bm25 = 0
+            term_idf = idf(metadata.num_docs, df)
+            for docid, freq in zip(docids, freqs):
+                cf += freq
+                max_tf = max(max_tf, freq)
+                max_bm25 = max(max_bm25, bm25(freq, doc_lens[docid],
+                                              metadata.avg_doc_len, term_idf))
+            outf.write(f"{word} {df} {cf} {max_tf} {max_bm25}\n")
+            num_words += 1
+
+    logger.info(f"Successfully wrote term statistics of {num_words} words to "+
+                f"'{outfpath}'")
@@ -0,0 +1,121 @@
+import multiprocessing
+from multiprocessing import util
+from typing import Mapping, List, Tuple
+
+from common.metrics import metrics
+from common.profiling import profiler
+from common.utils.workers import (init_worker,
+                                  worker_initargs)
+from common.preprocessing.normalize import (tokenize,
+                                            normalize_word)
+from .warc import parse_records
+
+# map doc -> word -> freq, or word -> positions if positions are indexed.
+PreprocessedDocs = Mapping[str, Mapping[str, int]]
+# map form -> (normalized word, count)
+Forms = Mapping[str, Tuple[str, int]]
+
+# Each indexer worker process parses, tokenizes and normalizes the records of
+# its chunks in batches, with a pool of tokenizer processes of its own. The
+# pool is created on the first chunk and reused for the following ones. Its
+# processes are daemonic, so they are terminated along with the worker. When
+# profiling, the pool is closed instead, before the worker exits, so that its
+# processes exit by themselves and write their profiles.
+_tokenizer_pool = None
+
+def tokenizer_pool(num_processes):
+    global _tokenizer_pool
+
+    if _tokenizer_pool == None:
+        _tokenizer_pool = multiprocessing.Pool(
+            num_processes, initializer=init_worker,
+            initargs=worker_initargs())
+        if profiler.enabled():
+            # Finalizers of higher priority run first, and the pool registers
+            # one of priority 15 that terminates it.
+            util.Finalize(None, _close_tokenizer_pool, exitpriority=20)
+    return _tokenizer_pool
+
+def _close_tokenizer_pool():
+    _tokenizer_pool.close()
+    _tokenizer_pool.join()
+
+# split_batches splits the records in at most num_batches batches of
+# consecutive records. There is always at least one batch.
+def split_batches(records, num_batches):
+    batch_size = max(1, -(-len(records) // num_batches))
+    batches = [records[i:i + batch_size]
+               for i in range(0, len(records), batch_size)]
+    if len(batches) == 0:
+        batches.append([])
+    return batches
+
+@metrics.timed("indexer.tokenize")
+def tokenize_docs(docs) -> Tuple[Mapping[str, List[str]], int]:
+    num_tokens = 0
+    for doc in docs:
+        docs[doc] = tokenize(docs[doc])
+        num_tokens += len(docs[doc])
+    return docs, num_tokens
+
+# preprocess_docs also returns the (word, count) of every surface form that
+# normalizes to a word. Each form is only normalized once.
+@metrics.timed("indexer.preprocess")
+def preprocess_docs(tokenized_docs,
+                    positions) -> Tuple[PreprocessedDocs, Forms]:
+    preprocessed_docs = tokenized_docs
+    # map form -> [normalized word, count]
+    forms = {}
+    for doc in tokenized_docs:
+        doc_words = tokenized_docs[doc]
+
+        # map word -> freq, or word -> positions if positions are indexed.
+        # Positions only count the words that survive normalization.
+        processed_word_freq = {}
+        position = 0
+        for word in doc_words:
+            form = forms.get(word)
+            if form == None:
+                form = [normalize_word(word), 0]
+                forms[word] = form
+            form[1] += 1
+            normalized_word = form[0]
+            if normalized_word == None:
+                continue
+
+            if positions:
+                if normalized_word not in processed_word_freq:
+                    processed_word_freq[normalized_word] = []
+                processed_word_freq[normalized_word].append(position)
+                position += 1
+                continue
+
+            # Increment frequency
+            if normalized_word not in processed_word_freq:
+                processed_word_freq[normalized_word] = 0
+            processed_word_freq[normalized_word] += 1
+
+        preprocessed_docs[doc] = processed_word_freq
+
+    return preprocessed_docs, {form: tuple(forms[form]) for form in forms
+                               if forms[form][0] != None}
+
+# process_batch decompresses, parses, tokenizes and normalizes a batch of raw
+# records. It takes a single (records, positions) argument, so that it can be
+# mapped by the tokenizer pool. Docs are keyed by URL, so a URL that appears
+# more than once keeps the text, and the (offset, length), of its last record.
+# It also returns the metrics of the batch, so that the ones of the tokenizer
+# processes reach the worker.
+def process_batch(batch):
+    records, positions = batch
+    docs = {}
+    doc_lens = {}
+    doc_locations = {}
+    for url, text, offset, length in parse_records(records):
+        docs[url] = text
+        doc_lens[url] = len(text)
+        doc_locations[url] = (offset, length)
+    tokenized_docs, num_tokens = tokenize_docs(docs)
+    preprocessed_docs, forms = preprocess_docs(tokenized_docs, positions)
+    return (preprocessed_docs, doc_lens, doc_locations, num_tokens, forms,
+            metrics.collect())
@@ -21,6 +21,17 @@ def write_url_mapping(url_mapping, outfpath):
             f.write(f"{docid} {doclen} {url}\n")
     logger.info(f"Successfully wrote URL mapping of size {len(url_mapping)}")
 
+# read_doc_lens adds the length of every document in the URL mapping of the
+# index file to doc_lens.
+def read_doc_lens(index_fpath, doc_lens):
+    with open(index_fpath, "r") as f:
+        assert f.readline() == BEGIN_URL_MAPPING
+        for line in f:
+            if line == END_URL_MAPPING:
+                break
+            docid, doc_len, _ = line.split(" ", 2)
+            doc_lens[int(docid)] = int(doc_len)
+
 def skip_url_mapping(infpath, checkpoint):
     logger.info(f"Skipping URL mapping from '{infpath}'")
 
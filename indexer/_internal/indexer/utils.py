@@ -1,9 +1,55 @@
+import heapq
 import os
 
 from common.log import log
+from common.utils.index import decode_list
+from common.utils.impacts import IMPACTS_SUFFIX
+from common.utils.positions import POSITIONS_SUFFIX
+from common.utils.skips import SKIPS_SUFFIX
+from common.utils.marks import MARKS_SUFFIX
+from common.utils.term_stats import TERM_STATS_SUFFIX
+from common.utils.documents import DOCUMENTS_SUFFIX
+from .index_metadata import skip_index_metadata
+from .url_mapping import skip_url_mapping
 
 logger = log.logger()
 
+# Files that are written next to an index file, named after it.
+INDEX_SIDECAR_SUFFIXES = [TERM_STATS_SUFFIX, IMPACTS_SUFFIX, SKIPS_SUFFIX,
+                          MARKS_SUFFIX, POSITIONS_SUFFIX, DOCUMENTS_SUFFIX]
+
+def _index_file_fpaths(index_fpath):
+    return [index_fpath] + [index_fpath + suffix
+                            for suffix in INDEX_SIDECAR_SUFFIXES]
+
+# remove_index_file removes an index file and its sidecar files.
+def remove_index_file(index_fpath):
+    for fpath in _index_file_fpaths(index_fpath):
+        if os.path.exists(fpath):
+            os.remove(fpath)
+
+# replace_index_file replaces an index file and its sidecar files. Files are
+# replaced one by one, so the destination must not be in use. Sidecar files of
+# the destination that the source does not have are removed, so that none is
+# left over from the replaced index file.
+def replace_index_file(src_index_fpath, dst_index_fpath):
+    for src, dst in zip(_index_file_fpaths(src_index_fpath),
+                        _index_file_fpaths(dst_index_fpath)):
+        if os.path.exists(src):
+            os.replace(src, dst)
+        elif os.path.exists(dst):
+            os.remove(dst)
+
+# read_index_lists yields the (word, (docids, freqs)) of every list of an index
+# file, in the order of the file.
+def read_index_lists(index_fpath):
+    checkpoint = skip_url_mapping(index_fpath, 0)
+    checkpoint = skip_index_metadata(index_fpath, checkpoint)
+    with open(index_fpath, "r", encoding="utf-8") as f:
+        f.seek(checkpoint)
+        for line in f:
+            yield decode_list(line)
+
 def write_index(index, outfpath, docid_offset):
     logger.info(f"Writing index to '{outfpath}'")
     with open(outfpath, 'a', encoding='utf-8') as outf:
@@ -16,8 +62,68 @@ def write_index(index, outfpath, docid_offset):
             outf.write("\n")
     logger.info(f"Successfully wrote index to '{outfpath}'")
 
+def _merge_key(line):
+    word, postings_str = line.rstrip("\n").split(" ", 1)
+    first_docid = int(postings_str[:postings_str.index(",")])
+    return word, first_docid, postings_str
+
+# merge_index_files merges index files whose lines are sorted by word, keeping
+# only one line of each file in memory at a time, and appends the result to
+# outfpath. The docids of the files are expected to be disjoint, as is the case
+# for the runs of different subindexes, and the postings of a word are written
+# in docid order. The lists of each file start at its checkpoint, if given.
+def merge_index_files(infpaths, outfpath, checkpoints=None):
+    logger.info(f"Merging {len(infpaths)} index files into '{outfpath}'")
+
+    infiles = [open(infpath, 'r', encoding='utf-8') for infpath in infpaths]
+    try:
+        if checkpoints != None:
+            for inf, checkpoint in zip(infiles, checkpoints):
+                inf.seek(checkpoint)
+
+        heap = []
+        for file_idx, inf in enumerate(infiles):
+            line = inf.readline()
+            if line != '':
+                word, first_docid, postings_str = _merge_key(line)
+                heap.append((word, first_docid, file_idx, postings_str))
+        heapq.heapify(heap)
+
+        with open(outfpath, 'a', encoding='utf-8') as outf:
+            last_word = None
+            while len(heap) > 0:
+                word, _, file_idx, postings_str = heap[0]
+                if word != last_word:
+                    if last_word != None:
+                        outf.write("\n")
+                    outf.write(word)
+                    last_word = word
+                outf.write(" " + postings_str)
+
+                line = infiles[file_idx].readline()
+                if line == '':
+                    heapq.heappop(heap)
+                else:
+                    word, first_docid, postings_str = _merge_key(line)
+                    heapq.heapreplace(heap, (word, first_docid, file_idx,
+                                             postings_str))
+            if last_word != None:
+                outf.write("\n")
+    finally:
+        for inf in infiles:
+            inf.close()
+
+    logger.info(f"Successfully merged {len(infpaths)} index files into "+
+                f"'{outfpath}'")
+
 def move_file(infpath, outfpath, max_read_chars):
     logger.info(f"Moving index from '{infpath}' to '{outfpath}'")
+    copy_file(infpath, outfpath, max_read_chars)
+    os.remove(infpath)
+    logger.info(f"Successfully moved index from '{infpath}' to '{outfpath}'")
+
+# copy_file appends the contents of infpath to outfpath.
+def copy_file(infpath, outfpath, max_read_chars):
     with open(infpath, "r") as inf:
         with open(outfpath, "a") as outf:
             while True:
@@ -25,8 +131,6 @@ def move_file(infpath, outfpath, max_read_chars):
                 if len(s) == 0:
                     break
                 outf.write(s)
-    os.remove(infpath)
-    logger.info(f"Successfully moved index from '{infpath}' to '{outfpath}'")
 
 def is_useful_warcio_record(record):
     return (record.rec_type == 'response' and
@@ -0,0 +1,56 @@
+import heapq
+import os
+
+from common.log import log
+from common.utils.vocabulary import read_vocabulary_counts
+
+logger = log.logger()
+
+# Only the most frequent forms are kept in the vocabulary snapshot, since they
+# are the ones queries are most likely to have. Rare forms are stemmed when
+# queried.
+MAX_VOCABULARY_FORMS = 100000
+
+# add_forms adds the (word, count) of the forms of a run to the ones of the
+# index. When there are too many forms, the least frequent are dropped, so the
+# counts of forms that are rare in some runs and frequent in others may be
+# underestimated.
+def add_forms(vocabulary, forms, max_forms=MAX_VOCABULARY_FORMS):
+    for form, (word, count) in forms.items():
+        if form in vocabulary:
+            count += vocabulary[form][1]
+        vocabulary[form] = (word, count)
+
+    if len(vocabulary) > 4 * max_forms:
+        kept = heapq.nlargest(2 * max_forms, vocabulary.items(),
+                              key=lambda item: item[1][1])
+        vocabulary.clear()
+        vocabulary.update(kept)
+
+# write_forms writes all the forms of a unit of work, in the format of the
+# vocabulary snapshot but unsorted, so that a resumed run can read them back
+# with read_vocabulary_counts.
+def write_forms(forms, outfpath):
+    with open(outfpath, "w", encoding="utf-8") as outf:
+        for form, (word, count) in forms.items():
+            outf.write(f"{form} {word} {count}\n")
+
+# write_vocabulary writes the most frequent forms of the vocabulary to the
+# vocabulary snapshot. If merge is set, the forms already in the snapshot are
+# added to them.
+def write_vocabulary(vocabulary, outfpath, merge=False,
+                     max_forms=MAX_VOCABULARY_FORMS):
+    logger.info(f"Writing vocabulary to '{outfpath}'")
+
+    if merge and os.path.exists(outfpath):
+        vocabulary = dict(vocabulary)
+        add_forms(vocabulary, read_vocabulary_counts(outfpath), max_forms)
+
+    forms = heapq.nlargest(max_forms, vocabulary.items(),
+                           key=lambda item: (item[1][1], item[0]))
+    with open(outfpath, "w", encoding="utf-8") as outf:
+        for form, (word, count) in forms:
+            outf.write(f"{form} {word} {count}\n")
+
+    logger.info(f"Successfully wrote {len(forms)} forms of vocabulary to "+
+                f"'{outfpath}'")
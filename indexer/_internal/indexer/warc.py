@@ -0,0 +1,110 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import hashlib
+import io
+import os
+
+from warcio.archiveiterator import ArchiveIterator
+
+from common.log import log
+from common.metrics import metrics
+from .parser import PlaintextParser
+from .utils import get_warcio_record_url
+
+logger = log.logger()
+
+OFFSETS_SUFFIX = ".offsets"
+
+# The record offsets of a WARC file are the byte offsets where each of its
+# records starts, followed by the size of the file. In compressed WARC files
+# every record is a gzip member of its own, so records can be read, and
+# decompressed, independently of each other once their offsets are known.
+# Offsets are stored as native uint64, after the modification time of the file
+# in nanoseconds. They are kept under the name of the file and a hash of its
+# absolute path, since files in different directories may have the same name.
+def offsets_fpath(offsets_dir, warc_fpath):
+    path_hash = hashlib.sha1(
+        os.path.abspath(warc_fpath).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(offsets_dir, f"{os.path.basename(warc_fpath)}."+
+                        f"{path_hash}{OFFSETS_SUFFIX}")
+
+# scan_record_offsets finds the record offsets of a WARC file, reading it once.
+def scan_record_offsets(fpath):
+    logger.info(f"Scanning record offsets of '{fpath}'")
+
+    offsets = array("Q")
+    with open(fpath, "rb") as stream:
+        records = ArchiveIterator(stream)
+        for _ in records:
+            offsets.append(records.get_record_offset())
+    offsets.append(os.path.getsize(fpath))
+
+    logger.info(f"Successfully scanned {len(offsets) - 1} record offsets of "+
+                f"'{fpath}'")
+
+    return offsets
+
+# record_offsets returns the record offsets of a WARC file. They are scanned
+# the first time the file is read and kept in offsets_dir, so that the
+# following chunks of the file, and resumed runs, seek to their first record
+# directly. Offsets kept for a file whose size or modification time changed
+# since are scanned again.
+def record_offsets(offsets_dir, fpath):
+    outfpath = offsets_fpath(offsets_dir, fpath)
+    stat = os.stat(fpath)
+    if os.path.exists(outfpath):
+        offsets = array("Q")
+        with open(outfpath, "rb") as f:
+            offsets.frombytes(f.read())
+        if (len(offsets) >= 2 and offsets[0] == stat.st_mtime_ns and
+            offsets[-1] == stat.st_size
+        ):
+            return offsets[1:]
+        logger.info(f"Record offsets of '{fpath}' are out of date")
+
+    offsets = scan_record_offsets(fpath)
+    # The offsets are written to a temporary file first, so that a run
+    # interrupted while writing them does not leave them incomplete.
+    with open(outfpath + "_", "wb") as f:
+        array("Q", [stat.st_mtime_ns]).tofile(f)
+        offsets.tofile(f)
+    os.replace(outfpath + "_", outfpath)
+    return offsets
+
+# read_records reads the raw records of a WARC file that start at or after
+# checkpoint, up to max_read_bytes of them but at least one. It returns the
+# (offset, bytes) of each record, whether the end of the file was reached, and
+# the offset of the first record not read, which is the checkpoint of the next
+# chunk of the file.
+def read_records(fpath, offsets, checkpoint, max_read_bytes):
+    num_records = len(offsets) - 1
+    first = bisect_left(offsets, checkpoint, 0, num_records)
+    last = bisect_right(offsets, offsets[first] + max_read_bytes, first,
+                        num_records + 1) - 1
+    last = min(max(last, first + 1), num_records)
+
+    records = []
+    if first < num_records:
+        with open(fpath, "rb") as f:
+            f.seek(offsets[first])
+            data = f.read(offsets[last] - offsets[first])
+        for i in range(first, last):
+            start = offsets[i] - offsets[first]
+            records.append((offsets[i],
+                            data[start:start + offsets[i + 1] - offsets[i]]))
+
+    return records, last == num_records, offsets[last]
+
+# parse_records decompresses and parses raw records, returning the URL and
+# normalized text of each of them, along with the offset and length of the raw
+# record it was read from.
+@metrics.timed("indexer.parse")
+def parse_records(records):
+    docs = []
+    for offset, data in records:
+        for record in ArchiveIterator(io.BytesIO(data)):
+            url = get_warcio_record_url(record)
+            text = record.content_stream().read()
+            docs.append((url, PlaintextParser.normalize_text(text), offset,
+                         len(data)))
+    return docs
@@ -1,8 +1,33 @@
+import os
+import subprocess
+import sys
+
 from common.log import log
+from common.metrics import metrics
+from common.profiling import profiler
 from ._internal.indexer.indexer import Indexer
 
 logger = log.logger()
 
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# start_merge merges the segments of the index in a process of its own, in a
+# session of its own, so that the indexer returns right away and the merge
+# outlives it. The merge can also be run by hand with
+# 'python3 -m indexer.merge -i <INDEX>'.
+def start_merge(index_fpath, log_level=None):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [REPO_DIR] + ([env["PYTHONPATH"]] if "PYTHONPATH" in env else []))
+    command = [sys.executable, "-m", "indexer.merge",
+               "-i", os.path.abspath(index_fpath)]
+    if log_level != None:
+        command += ["-log-level", log_level]
+    merger = subprocess.Popen(command, env=env, start_new_session=True,
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL)
+    return merger.pid
+
 def main(args):
     logger.info("Starting indexer run")
 
@@ -10,4 +35,18 @@ def main(args):
     indexer.init()
     indexer.run()
 
+    if args.metrics != None:
+        metrics.write(args.metrics, args.metrics_format)
+        logger.info(f"Wrote metrics to '{args.metrics}'")
+
+    if args.profile != None:
+        profiler.write(args.profile)
+        logger.info(f"Wrote profile to '{args.profile}'")
+
+    if args.incremental:
+        # Segments are merged in the background, while the new segment is
+        # already available to queries.
+        pid = start_merge(args.output_file, args.log_level)
+        logger.info(f"Started background merge of segments (pid {pid})")
+
     logger.info("Successfully finished indexer run")
@@ -0,0 +1,46 @@
+import argparse
+
+from common.log import log
+from ._internal.indexer.segments import (merge_segments,
+                                         MergeAllPolicy)
+
+logger = log.logger()
+
+def main(args):
+    logger.info(f"Merging segments of index '{args.output_file}'")
+    policy = MergeAllPolicy() if args.all else None
+    merge_segments(args.output_file, policy)
+    logger.info(f"Successfully merged segments of index '{args.output_file}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Merge the segments of an incremental index.')
+    parser.add_argument(
+        '-i',
+        dest='output_file',
+        action='store',
+        required=True,
+        type=str,
+        help='path to the index whose segments are merged'
+    )
+    parser.add_argument(
+        '-all',
+        dest='all',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to merge all the segments into one, instead of "+
+              "following the tiered merge policy.")
+    )
+    parser.add_argument(
+        '-log-level',
+        dest='log_level',
+        action='store',
+        required=False,
+        type=str,
+        help="logging level"
+    )
+    args = parser.parse_args()
+    if args.log_level != None:
+        log.set_level(args.log_level)
+    main(args)
@@ -2,6 +2,9 @@ import argparse
 
 from processor.main import main as processor_main
 from common.log import log
+from common.metrics import metrics
+from common.memory import tracker
+from common.profiling import profiler
 
 logger = log.logger()
 
@@ -27,7 +30,7 @@ def parse_args():
         '-q',
         dest='queries',
         action='store',
-        required=True,
+        required=False,
         type=str,
         help='path to a file with a list of queries to process'
     )
@@ -63,7 +66,198 @@ def parse_args():
         type=bool,
         help="Print only benchmarking (timing) information"
     )
+    parser.add_argument(
+        '-engine',
+        dest='engine',
+        action='store',
+        required=False,
+        type=str,
+        help=("['DAAT' | 'SAAT'] query evaluation strategy. 'SAAT' ranks "+
+              "score-at-a-time over the impacts written by the indexer with "+
+              "'-impacts True', and only supports the 'BM25' ranker")
+    )
+    parser.add_argument(
+        '-mode',
+        dest='mode',
+        action='store',
+        required=False,
+        type=str,
+        help=("['OR' | 'AND' | 'PHRASE'] whether documents must have any of "+
+              "the query words, all of them, or all of them in sequence. "+
+              "'PHRASE' needs an index built with '-positions True'")
+    )
+    parser.add_argument(
+        '-batch',
+        dest='batch',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to rank all queries together term at a time, reading "+
+              "the list of each distinct query word only once")
+    )
+    parser.add_argument(
+        '-fetch',
+        dest='fetch',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to fetch the top 10 documents of each query from the "+
+              "corpus, seeking directly to their records, and add a snippet "+
+              "of each one to the results")
+    )
+    parser.add_argument(
+        '-rerank',
+        dest='rerank',
+        action='store',
+        required=False,
+        type=str,
+        help=("['FEATURES'] reranker to re-score the top candidates of the "+
+              "ranker with term proximity, URL depth and document length")
+    )
+    parser.add_argument(
+        '-candidates',
+        dest='candidates',
+        action='store',
+        required=False,
+        type=int,
+        help="Number of candidates to rerank, with '-rerank'. Defaults to 100"
+    )
+    parser.add_argument(
+        '-first-stage-budget',
+        dest='first_stage_budget',
+        action='store',
+        required=False,
+        type=float,
+        help=("Time budget of the first ranking stage of each query, in "+
+              "milliseconds, with '-rerank'")
+    )
+    parser.add_argument(
+        '-rerank-budget',
+        dest='rerank_budget',
+        action='store',
+        required=False,
+        type=float,
+        help=("Time budget of the reranking of each query, in milliseconds, "+
+              "with '-rerank'")
+    )
+    parser.add_argument(
+        '-query-budget',
+        dest='query_budget',
+        action='store',
+        required=False,
+        type=float,
+        help=("Time budget of the ranking of each query, in milliseconds. "+
+              "Queries over budget return the best documents found so far, "+
+              "flagged as approximate")
+    )
+    parser.add_argument(
+        '-postings-budget',
+        dest='postings_budget',
+        action='store',
+        required=False,
+        type=int,
+        help=("Maximum number of postings scored for each query. Queries over "+
+              "budget return the best documents found so far, flagged as "+
+              "approximate")
+    )
+    parser.add_argument(
+        '-max-df',
+        dest='max_df',
+        action='store',
+        required=False,
+        type=float,
+        help=("Fraction of the documents above which the document frequency "+
+              "of a query word is too high for its list to be scored in "+
+              "full. Such words are dropped or demoted, as '-high-df' says, "+
+              "unless they are the rarest word of the query")
+    )
+    parser.add_argument(
+        '-high-df',
+        dest='high_df',
+        action='store',
+        required=False,
+        type=str,
+        help=("['DEMOTE' | 'DROP'] what to do with the query words above "+
+              "'-max-df': only score them for the documents of the other "+
+              "words, or leave them out of the query. Defaults to DEMOTE")
+    )
+    parser.add_argument(
+        '-port',
+        dest='port',
+        action='store',
+        required=False,
+        type=int,
+        help=("Port to serve queries on, one per line, instead of processing "+
+              "a file of queries")
+    )
+    parser.add_argument(
+        '-host',
+        dest='host',
+        action='store',
+        required=False,
+        type=str,
+        help="Host to serve queries on, with '-port'. Defaults to localhost"
+    )
+    parser.add_argument(
+        '-metrics',
+        dest='metrics',
+        action='store',
+        required=False,
+        type=str,
+        help=("Path to write the metrics of the run to when it ends: the time "+
+              "spent in each phase, and counters of the postings scored")
+    )
+    parser.add_argument(
+        '-metrics-format',
+        dest='metrics_format',
+        action='store',
+        required=False,
+        type=str,
+        help="['JSON' | 'PROMETHEUS'] format of the metrics. Defaults to JSON"
+    )
+    parser.add_argument(
+        '-track-memory',
+        dest='track_memory',
+        action='store',
+        required=False,
+        type=bool,
+        help=("Whether to log the memory usage of the processor once its "+
+              "index is loaded: its resident, unique and virtual sizes")
+    )
+    parser.add_argument(
+        '-profile',
+        dest='profile',
+        action='store',
+        required=False,
+        type=str,
+        help=("Path to write the profile of the run to, merged over the main "+
+              "process, its threads and the shard processes: <PATH>.pstats, "+
+              "for pstats, and <PATH>.collapsed, with the sampled stacks, for "+
+              "flame graphs")
+    )
+    parser.add_argument(
+        '-profile-mode',
+        dest='profile_mode',
+        action='store',
+        required=False,
+        type=str,
+        help=("['DETERMINISTIC' | 'SAMPLING'] how to profile. Deterministic "+
+              "profiling times every call, which slows the run down, while "+
+              "sampling only records the stacks every 10ms. Defaults to "+
+              "DETERMINISTIC")
+    )
+    parser.add_argument(
+        '-trace-sample',
+        dest='trace_sample',
+        action='store',
+        required=False,
+        type=float,
+        help=("Fraction of the queries whose detailed trace is logged, "+
+              "whatever the logging level, between 0 and 1. Defaults to 0")
+    )
     args = parser.parse_args()
+    if args.queries == None and args.port == None:
+        raise InvalidConfigError('-q', "either '-q' or '-port' must be given")
     return args
 
 def main():
@@ -71,6 +265,14 @@ def main():
         args = parse_args()
         if args.log_level != None:
             log.set_level(args.log_level)
+        if args.trace_sample != None:
+            log.set_trace_sample_rate(args.trace_sample)
+        if args.metrics != None:
+            metrics.enable()
+        if args.track_memory:
+            tracker.track()
+        if args.profile != None:
+            profiler.start(args.profile, args.profile_mode)
 
         processor_main(args)
 
@@ -0,0 +1,18 @@
+from .ranker import Ranker
+from .impact_ranker import ImpactRanker
+
+# Query evaluation strategies: document-at-a-time over the text lists, or
+# score-at-a-time over the impact-ordered lists.
+ENGINE_DAAT = "DAAT"
+ENGINE_SAAT = "SAAT"
+
+ENGINES = {
+    ENGINE_DAAT: Ranker,
+    ENGINE_SAAT: ImpactRanker,
+}
+
+def ranker_class(engine):
+    engine = engine or ENGINE_DAAT
+    if engine not in ENGINES:
+        raise ValueError(f"Invalid engine {engine}")
+    return ENGINES[engine]
@@ -0,0 +1,271 @@
+import heapq
+import os
+import time
+
+from common.log import log
+from common.utils.index import ArrayCursor
+from common.utils.impacts import (ImpactIndex,
+                                  impacts_fpath,
+                                  has_impacts)
+from common.utils.index_metadata import read_index_metadata
+from common.utils.segments import acquire_segments
+from common.utils.term_stats import (read_term_stats,
+                                     term_stats_fpath)
+from common.utils.url_mapping import read_url_mapping
+from .ranker import (Ranker,
+                     RANKER_TYPE_BM25,
+                     MODE_OR)
+from .planner import ACTION_DROP
+
+logger = log.logger()
+
+# ImpactSegment is one index file of the index being queried, read through its
+# impacts file instead of its text lists.
+class ImpactSegment:
+    def __init__(self, fpath):
+        self.fpath = fpath
+
+        self.url_mapping = None
+        self.metadata = None
+        self.term_stats = None
+        self.impacts = None
+
+    def init(self, words):
+        logger.info(f"Initializing impacts of index segment '{self.fpath}'")
+
+        if not has_impacts(self.fpath):
+            raise ValueError(f"index file '{self.fpath}' has no impacts file. "+
+                             f"It must be built with '-impacts True'")
+        self.url_mapping, checkpoint = read_url_mapping(self.fpath, 0)
+        self.metadata, _ = read_index_metadata(self.fpath, checkpoint)
+        # The term statistics are only read to plan queries.
+        if os.path.exists(term_stats_fpath(self.fpath)):
+            self.term_stats = read_term_stats(term_stats_fpath(self.fpath),
+                                              words)
+        self.impacts = ImpactIndex(impacts_fpath(self.fpath))
+        self.impacts.init(words)
+
+        logger.info(f"Successfully initialized impacts of index segment "+
+                    f"'{self.fpath}'")
+
+    # Impact-ordered lists have no positions.
+    def has_positions(self):
+        return False
+
+    def has_word(self, word):
+        return self.impacts.has_word(word)
+
+# ImpactRanker ranks queries score-at-a-time (SAAT) over impact-ordered lists:
+# the blocks of all query terms are processed by decreasing impact, adding
+# their precomputed BM25 contributions to the documents in them, and ranking
+# stops as soon as the remaining blocks cannot change the top 10. Scores are
+# the sum of the quantized contributions, so they are close to, but not
+# exactly, the ones of the BM25 Ranker. With a reranker, the top 10 is the top
+# of as many documents as the reranker has candidates. Terms dropped by the
+# plan of a query are left out, but demoted ones are ranked as the others:
+# their blocks have the lowest impacts, so they are processed last anyway.
+class ImpactRanker(Ranker):
+    def __init__(self, ranker_type: str, index_fpath: str, parallelism: int = None,
+                 benchmarking: bool = None, term_stats_fpath: str = None,
+                 mode: str = None, batch: bool = None, fetch: bool = None,
+                 rerank: str = None, num_candidates: int = None,
+                 first_stage_budget: float = None,
+                 rerank_budget: float = None, query_budget: float = None,
+                 postings_budget: int = None, max_df: float = None,
+                 high_df: str = None):
+        super().__init__(ranker_type, index_fpath, parallelism, benchmarking,
+                         term_stats_fpath, mode, batch, fetch, rerank,
+                         num_candidates, first_stage_budget, rerank_budget,
+                         query_budget, postings_budget, max_df, high_df)
+        if ranker_type != RANKER_TYPE_BM25:
+            raise ValueError(f"Score-at-a-time ranking only supports the "+
+                             f"{RANKER_TYPE_BM25} ranker")
+        if self._mode != MODE_OR:
+            raise ValueError(f"Score-at-a-time ranking only supports the "+
+                             f"{MODE_OR} query mode")
+
+    def init(self, queries=None):
+        logger.info("Initializing impact ranker")
+
+        all_tokens = self._init_tokens(queries or [])
+        words = all_tokens if queries != None else None
+
+        # Impacts are quantized with the statistics, and the scale, of their
+        # own segment, so the scores of different segments are not comparable.
+        segment_fpaths, self._segment_locks = acquire_segments(
+            self._index_fpath)
+        if len(segment_fpaths) > 1:
+            raise ValueError(f"Score-at-a-time ranking needs an index of a "+
+                             f"single segment, but '{self._index_fpath}' has "+
+                             f"{len(segment_fpaths)}. Merge its segments "+
+                             f"first with 'python3 -m indexer.merge -i "+
+                             f"{self._index_fpath} -all True'")
+        self._segments = [ImpactSegment(fpath) for fpath in segment_fpaths]
+        for segment in self._segments:
+            segment.init(words)
+        self._init_index_stats()
+        self._init_documents()
+        self._init_reranker()
+        self._init_term_stats(words)
+        self._planner.init(self._term_stats, self._num_docs)
+
+        words_not_found = set(word for word in all_tokens if not any(
+            segment.has_word(word) for segment in self._segments))
+        self._remove_words_not_found(words_not_found)
+
+        logger.info("Successfully initialized impact ranker")
+
+    # _blocks returns an iterator over the (score, block) pairs of the term in
+    # the segment, by decreasing score. Blocks are read as ranking gets to
+    # them, so the ones left when it stops are never read.
+    def _blocks(self, segment, term):
+        impacts = segment.impacts
+        for block in impacts.blocks(term):
+            yield block.impact * impacts.scale, block
+
+    # Queries are ranked one by one even in batches, since each one stops on
+    # its own.
+    def _rank_batch(self, queries_tokens, deadline=None):
+        return {query: self._rank_tokens(queries_tokens[query],
+                                         deadline=deadline)
+                for query in queries_tokens}
+
+    def _rank_tokens(self, tokens, tid="Unknown", deadline=None):
+        # A term repeated in the query is only scored once, as in the DAAT
+        # Ranker, and the ones dropped by the plan of the query not at all.
+        plan = self._plan(tokens, tid)
+        tokens = [token for token in dict.fromkeys(tokens)
+                  if plan.action(token) != ACTION_DROP]
+        logger.info("(%s) Scoring tokens %s score-at-a-time", tid, tokens)
+
+        # heads[i] is the first (score, block) of term i not processed yet, or
+        # None once all its blocks are. Blocks are processed in decreasing
+        # score, so its score bounds the contribution of term i to the score
+        # of any document from now on. The bits of seen_terms[docid] are the
+        # terms already found in the document, which cannot contribute to its
+        # score anymore.
+        term_blocks = [self._blocks(self._segments[0], term)
+                       for term in tokens]
+        heads = [next(blocks, None) for blocks in term_blocks]
+        schedule = [(-head[0], term_idx) for term_idx, head in enumerate(heads)
+                    if head != None]
+        heapq.heapify(schedule)
+
+        accumulators = {}
+        seen_terms = {}
+        num_processed = 0
+        since_check = 0
+        approximate = False
+        while len(schedule) > 0:
+            _, term_idx = heapq.heappop(schedule)
+            score, block = heads[term_idx]
+            # The block is cut at the postings left in the budget. A cut block
+            # is not done, and the rest of it is left to _complete_top10.
+            docids = block.docids
+            if self._postings_budget != None:
+                docids = docids[:self._postings_budget - num_processed]
+            term_bit = 1 << term_idx
+            for docid in docids:
+                accumulators[docid] = accumulators.get(docid, 0) + score
+                seen_terms[docid] = seen_terms.get(docid, 0) | term_bit
+            if len(docids) == len(block.docids):
+                heads[term_idx] = next(term_blocks[term_idx], None)
+                if heads[term_idx] != None:
+                    heapq.heappush(schedule,
+                                   (-heads[term_idx][0], term_idx))
+            num_processed += len(docids)
+            since_check += len(docids)
+
+            # Blocks are processed by decreasing score, so the postings left
+            # out when the budget runs out are the ones that add the least.
+            if (((deadline != None and time.perf_counter() >= deadline) or
+                 (self._postings_budget != None and
+                  num_processed >= self._postings_budget)) and
+                (len(docids) < len(block.docids) or len(schedule) > 0)
+            ):
+                logger.warning("(%s) Budget exceeded scoring tokens %s. "+
+                               "Returning the best documents so far", tid,
+                               tokens)
+                approximate = True
+                break
+
+            # Checking costs a pass over the accumulators, so it is only done
+            # once a quarter as many postings as accumulators have been
+            # processed.
+            if since_check >= len(accumulators) // 4:
+                since_check = 0
+                if self._settled(accumulators, seen_terms, heads):
+                    break
+
+        logger.info("(%s) Processed %d postings of tokens %s", tid,
+                    num_processed, tokens)
+        self._add_postings(num_processed)
+
+        return (self._complete_top10(accumulators, seen_terms, term_blocks,
+                                     heads),
+                approximate)
+
+    # _remaining_bound returns the highest score that a document can still get
+    # from the terms not in seen_terms.
+    def _remaining_bound(self, heads, seen_terms=0):
+        bound = 0
+        for term_idx, head in enumerate(heads):
+            if seen_terms & (1 << term_idx):
+                continue
+            if head != None:
+                bound += head[0]
+        return bound
+
+    # _settled tells whether no document out of the current top 10, including
+    # the ones not seen yet, can still make it to the top 10. Ties are broken
+    # by docid, as in the DAAT Ranker.
+    def _settled(self, accumulators, seen_terms, heads):
+        if len(accumulators) < self._num_results:
+            return False
+        top10 = heapq.nsmallest(self._num_results, accumulators.items(),
+                                key=lambda item: (-item[1], item[0]))
+        last_docid, last_score = top10[-1]
+        if self._remaining_bound(heads) >= last_score:
+            return False
+
+        top10_docids = set(docid for docid, _ in top10)
+        bounds = {}
+        for docid, score in accumulators.items():
+            if docid in top10_docids:
+                continue
+            terms = seen_terms[docid]
+            if terms not in bounds:
+                bounds[terms] = self._remaining_bound(heads, terms)
+            max_score = score + bounds[terms]
+            if (max_score > last_score or
+                (max_score == last_score and docid < last_docid)
+            ):
+                return False
+        return True
+
+    # _complete_top10 adds the contributions of the blocks not processed yet to
+    # the documents of the top 10, so that their scores, and order, are final.
+    # A document is in one block of each term at most, so the terms already
+    # found in it, as in the processed part of a cut block, are skipped, and
+    # the blocks of a term stop being read once all its documents are found.
+    def _complete_top10(self, accumulators, seen_terms, term_blocks, heads):
+        top10 = heapq.nsmallest(self._num_results, accumulators.items(),
+                                key=lambda item: (-item[1], item[0]))
+        scores = dict(top10)
+        top10_docids = sorted(scores)
+        for term_idx, (blocks, head) in enumerate(zip(term_blocks, heads)):
+            term_bit = 1 << term_idx
+            docids = [docid for docid in top10_docids
+                      if not seen_terms[docid] & term_bit]
+            while head != None and len(docids) > 0:
+                score, block = head
+                cursor = ArrayCursor(block.docids)
+                not_found = []
+                for docid in docids:
+                    if cursor.next_geq(docid) == docid:
+                        scores[docid] += score
+                    else:
+                        not_found.append(docid)
+                docids = not_found
+                head = next(blocks, None)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,129 @@
+import json
+
+# The planner decides how the terms of a query are evaluated, from their
+# document frequencies in the term statistics, without reading their lists.
+# Terms are ordered by increasing document frequency, the most selective
+# first. Terms in more than a max_df fraction of the documents are stopwords of
+# the corpus in all but name: their lists are the longest, and add the least
+# to the scores. They can be dropped from the query, or demoted, so that their
+# lists are only probed, with skips, for the documents matched by the other
+# terms.
+
+ACTION_SCORE  = "SCORE"
+ACTION_DEMOTE = "DEMOTE"
+ACTION_DROP   = "DROP"
+
+# Actions for terms above max_df.
+HIGH_DF_ACTIONS = [ACTION_DEMOTE, ACTION_DROP]
+
+# TermPlan is how a term of a query is evaluated, and how many postings it is
+# estimated to cost. Both df and the estimate are None if the index has no
+# term statistics.
+class TermPlan:
+    def __init__(self, term, df, action, estimated_postings):
+        self.term = term
+        self.df = df
+        self.action = action
+        self.estimated_postings = estimated_postings
+
+    def to_json(self):
+        return {
+            "Term": self.term,
+            "Df": self.df,
+            "Action": self.action,
+            "EstimatedPostings": self.estimated_postings,
+        }
+
+# QueryPlan is the plan of every distinct term of a query, by increasing
+# document frequency.
+class QueryPlan:
+    def __init__(self, term_plans):
+        self.term_plans = term_plans
+        self._actions = {term_plan.term: term_plan.action
+                         for term_plan in term_plans}
+        self._dfs = {term_plan.term: term_plan.df for term_plan in term_plans}
+
+    def action(self, term):
+        return self._actions.get(term)
+
+    # terms returns the terms of the plan with the given action, by increasing
+    # document frequency.
+    def terms(self, action):
+        return [term_plan.term for term_plan in self.term_plans
+                if term_plan.action == action]
+
+    def df(self, term):
+        return self._dfs.get(term)
+
+    def estimated_postings(self):
+        if any(term_plan.estimated_postings == None
+               for term_plan in self.term_plans):
+            return None
+        return sum(term_plan.estimated_postings
+                   for term_plan in self.term_plans)
+
+    def to_json(self):
+        return {
+            "Terms": [term_plan.to_json() for term_plan in self.term_plans],
+            "EstimatedPostings": self.estimated_postings(),
+        }
+
+    def __str__(self):
+        return json.dumps(self.to_json(), ensure_ascii=False)
+
+class QueryPlanner:
+    def __init__(self, max_df: float = None, high_df: str = None):
+        if max_df != None and (max_df <= 0 or max_df > 1):
+            raise ValueError(f"Invalid maximum document frequency {max_df}. "+
+                             f"Should be a fraction of the documents, "+
+                             f"between 0 and 1")
+        self._max_df = max_df
+
+        self._high_df = high_df or ACTION_DEMOTE
+        if self._high_df not in HIGH_DF_ACTIONS:
+            raise ValueError(f"Invalid action for high document frequency "+
+                             f"terms {high_df}")
+
+        self._term_stats = None
+        self._num_docs = 0
+
+    # init gives the planner the term statistics of the index, or None if it
+    # has none, and its number of documents.
+    def init(self, term_stats, num_docs):
+        self._term_stats = term_stats
+        self._num_docs = num_docs
+
+    # plan returns the plan of the tokenized query. Terms above max_df are
+    # only dropped or demoted if prune is set, and the most selective term of
+    # the query in the index is always scored. Scored terms cost their whole
+    # list, and demoted ones a probe per document of the scored lists, at most.
+    def plan(self, tokens, prune=True):
+        terms = list(dict.fromkeys(tokens))
+        if self._term_stats == None:
+            return QueryPlan([TermPlan(term, None, ACTION_SCORE, None)
+                              for term in terms])
+
+        dfs = {term: self._term_stats[term].df if term in self._term_stats
+               else 0 for term in terms}
+        terms.sort(key=lambda term: dfs[term])
+
+        actions = {term: ACTION_SCORE for term in terms}
+        if prune and self._max_df != None:
+            found_terms = [term for term in terms if dfs[term] > 0]
+            for term in found_terms[1:]:
+                if dfs[term] > self._max_df * self._num_docs:
+                    actions[term] = self._high_df
+
+        scored_postings = sum(dfs[term] for term in terms
+                              if actions[term] == ACTION_SCORE)
+        term_plans = []
+        for term in terms:
+            if actions[term] == ACTION_SCORE:
+                estimated_postings = dfs[term]
+            elif actions[term] == ACTION_DEMOTE:
+                estimated_postings = min(dfs[term], scored_postings)
+            else:
+                estimated_postings = 0
+            term_plans.append(TermPlan(term, dfs[term], actions[term],
+                                       estimated_postings))
+        return QueryPlan(term_plans)
@@ -1,7 +1,17 @@
+import asyncio
 from datetime import datetime
+import json
 
 from common.log import log
-from .ranker import Ranker
+from common.metrics import metrics
+from common.utils.shards import read_shards
+from common.utils.vocabulary import (read_vocabulary,
+                                     vocabulary_fpath,
+                                     has_vocabulary)
+from .engines import ranker_class
+from .server import (QueryServer,
+                     DEFAULT_HOST)
+from .shards import ShardedRanker
 
 logger = log.logger()
 
@@ -11,18 +21,67 @@ class Processor:
         self._queries_file = config.queries
         self._parallelism = config.parallelism
         self._benchmarking = config.benchmarking
-        self._ranker = Ranker(config.ranker, self._index_file, self._parallelism,
-                              self._benchmarking)
+        self._host = config.host if config.host != None else DEFAULT_HOST
+        self._port = config.port
+        if read_shards(self._index_file) != None:
+            self._ranker = ShardedRanker(config.ranker, self._index_file,
+                                         self._parallelism, self._benchmarking,
+                                         config.engine, config.mode,
+                                         config.batch, config.fetch,
+                                         **self._rerank_args(config),
+                                         **self._budget_args(config),
+                                         max_df=config.max_df,
+                                         high_df=config.high_df)
+        else:
+            self._ranker = ranker_class(config.engine)(
+                config.ranker, self._index_file, self._parallelism,
+                self._benchmarking, mode=config.mode, batch=config.batch,
+                fetch=config.fetch, **self._rerank_args(config),
+                **self._budget_args(config), max_df=config.max_df,
+                high_df=config.high_df)
+
+        self._rerank = config.rerank
 
         self._time_init = None
         self._time_run = None
 
+    # _rerank_args returns the reranking arguments of the ranker. Budgets are
+    # given in milliseconds.
+    def _rerank_args(self, config):
+        first_stage_budget = None
+        if config.first_stage_budget != None:
+            first_stage_budget = config.first_stage_budget / 1000
+        rerank_budget = None
+        if config.rerank_budget != None:
+            rerank_budget = config.rerank_budget / 1000
+        return {
+            "rerank": config.rerank,
+            "num_candidates": config.candidates,
+            "first_stage_budget": first_stage_budget,
+            "rerank_budget": rerank_budget,
+        }
+
+    # _budget_args returns the budgets of each query of the ranker. The time
+    # budget is given in milliseconds.
+    def _budget_args(self, config):
+        query_budget = None
+        if config.query_budget != None:
+            query_budget = config.query_budget / 1000
+        return {
+            "query_budget": query_budget,
+            "postings_budget": config.postings_budget,
+        }
+
+    @metrics.timed("processor.init")
     def init(self):
         logger.info(f"Initializing query processor")
 
         before = datetime.now()
 
-        self._queries = open(self._queries_file, "r").read().strip().split("\n")
+        # Without a queries file, the ranker is initialized to serve any query.
+        self._queries = None
+        if self._queries_file != None:
+            self._queries = open(self._queries_file, "r").read().strip().split("\n")
         self._ranker.init(self._queries)
 
         self._time_init = (datetime.now() - before).total_seconds()
@@ -30,15 +89,24 @@ class Processor:
 
         logger.info(f"Successfully initialized query processor")
 
+    @metrics.timed("processor.run")
     def run(self):
         logger.info("Running query processor")
 
         before = datetime.now()
 
         results_json = self._ranker.rank_all()
+        if isinstance(self._ranker, ShardedRanker):
+            self._ranker.close()
 
         self._time_run = (datetime.now() - before).total_seconds()
         logger.info(f"Total time spent ranking: {self._time_run}")
+        if self._rerank != None:
+            logger.info(f"Time spent in each ranking stage, in milliseconds: "+
+                        f"{json.dumps(self._ranker.stage_times())}")
+        if self._ranker.num_approximate() > 0:
+            logger.warning(f"Queries over budget, with approximate results: "+
+                           f"{self._ranker.num_approximate()}")
 
         for result in results_json:
             print(result)
@@ -48,3 +116,23 @@ class Processor:
             print(f"{self._time_run:.6f}")
 
         logger.info("Successfully ran query processor")
+
+    def serve(self):
+        logger.info("Serving queries")
+
+        vocabulary = None
+        if has_vocabulary(self._index_file):
+            vocabulary = read_vocabulary(vocabulary_fpath(self._index_file))
+        server = QueryServer(self._ranker, self._parallelism,
+                             vocabulary=vocabulary)
+        try:
+            asyncio.run(server.serve(self._host, self._port))
+        except KeyboardInterrupt:
+            pass
+        if isinstance(self._ranker, ShardedRanker):
+            self._ranker.collect_metrics()
+            self._ranker.close()
+
+        logger.info(f"Successfully served {server.num_queries} queries in "+
+                    f"{server.num_batches} batches. Queries coalesced: "+
+                    f"{server.num_coalesced}")
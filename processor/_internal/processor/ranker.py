@@ -1,33 +1,102 @@
 import concurrent.futures
 import gc
+import heapq
 import json
-from math import log as natural_log
 import threading
+import time
 
 from common.log import log
+from common.metrics import metrics
 from common.memory.defs import MEGABYTE
-from common.memory.utils import sizeof
-from common.utils.index import (read_index,
-                                index_docids)
-from common.utils.index_metadata import read_index_metadata
-from common.utils.url_mapping import read_url_mapping
+from common.memory.tracker import log_memory_usage
+from common.utils.segments import acquire_segments
+from common.utils.scoring import (idf,
+                                  tf,
+                                  bm25)
+from common.utils.term_stats import (read_term_stats,
+                                     combine_term_stats)
+from common.utils.url_mapping import UrlMapping
+from common.utils.positions import has_positions
+from common.utils.documents import (DocumentsTable,
+                                    documents_fpath,
+                                    has_documents,
+                                    read_document)
 from common.preprocessing.normalize import tokenize_and_normalize
-from .utils import (preprocess_entire_index,
-                    find_checkpoints_marks,
-                    subindex_from_words_marks)
+from .segment import IndexSegment
 from .score_heap import ScoreHeap
+from .planner import (QueryPlanner,
+                      ACTION_SCORE,
+                      ACTION_DEMOTE)
+from .rerank import (reranker_class,
+                     DEFAULT_NUM_CANDIDATES)
 
 logger = log.logger()
 
 MAX_READ_CHARS    = 256 * MEGABYTE
 NUM_RESULTS       = 10
+SNIPPET_CHARS     = 200
 RANKER_TYPE_TFIDF = "TFIDF"
 RANKER_TYPE_BM25  = "BM25"
 
+# Query modes: disjunctive (documents with any of the words), conjunctive
+# (documents with all the words), and phrase (documents with all the words in
+# consecutive positions, ignoring stopwords).
+MODE_OR     = "OR"
+MODE_AND    = "AND"
+MODE_PHRASE = "PHRASE"
+
+# Stages of two-stage ranking: the first stage retrieves the candidates, and
+# the reranker re-scores them. Budgets are checked every BUDGET_CHECK_INTERVAL
+# documents or postings scored.
+STAGE_FIRST           = "FirstStage"
+STAGE_RERANK          = "Rerank"
+BUDGET_CHECK_INTERVAL = 1024
+
+def _expired(deadline):
+    return deadline != None and time.perf_counter() >= deadline
+
+def _deadline(start, budget):
+    if budget == None:
+        return None
+    return start + budget
+
+def _earliest(*deadlines):
+    deadlines = [deadline for deadline in deadlines if deadline != None]
+    if len(deadlines) == 0:
+        return None
+    return min(deadlines)
+
+# _postings yields the docids of the postings of the cursor. The frequency of
+# the cursor is the one of the last docid yielded.
+def _postings(cursor):
+    docid = cursor.docid
+    while docid != None:
+        yield docid
+        docid = cursor.next()
+
+# _probed_postings yields the docids of the postings of the cursor that are in
+# docids, a sorted list, advancing the cursor with skips.
+def _probed_postings(cursor, docids):
+    for docid in docids:
+        found = cursor.next_geq(docid)
+        if found == None:
+            return
+        if found == docid:
+            yield docid
+
 class Ranker:
     def __init__(self, ranker_type: str, index_fpath: str, parallelism: int = None,
-                 benchmarking: bool = None):
+                 benchmarking: bool = None, term_stats_fpath: str = None,
+                 mode: str = None, batch: bool = None, fetch: bool = None,
+                 rerank: str = None, num_candidates: int = None,
+                 first_stage_budget: float = None,
+                 rerank_budget: float = None, query_budget: float = None,
+                 postings_budget: int = None, max_df: float = None,
+                 high_df: str = None):
         self._index_fpath = index_fpath
+        self._batch = batch
+        self._fetch = fetch
+        self._term_stats_fpath = term_stats_fpath
         self._checkpoint = 0
         self._max_num_thread = parallelism or 4
         self._benchmarking = benchmarking
@@ -36,20 +105,79 @@ class Ranker:
             raise ValueError(f"Invalid ranker type {ranker_type}")
         self._ranker_type = ranker_type
 
-        # k1 in [1.2, 2.0]
-        self._bm25_k1 = 1.5
-        self._bm25_b = 0.75
+        self._mode = mode or MODE_OR
+        if self._mode not in [MODE_OR, MODE_AND, MODE_PHRASE]:
+            raise ValueError(f"Invalid query mode {mode}")
+
+        # With a reranker, the first stage keeps num_candidates documents
+        # instead of the top 10. Budgets are in seconds.
+        self._rerank = rerank
+        self._num_results = NUM_RESULTS
+        if rerank != None:
+            reranker_class(rerank)
+            self._num_results = max(num_candidates or DEFAULT_NUM_CANDIDATES,
+                                    NUM_RESULTS)
+        self._first_stage_budget = first_stage_budget
+        self._rerank_budget = rerank_budget
+        self._reranker = None
+        # Budgets of each query, or batch of queries: the time to rank it, in
+        # seconds, and the number of postings to score. Queries over budget
+        # return the best documents found so far, and are approximate.
+        self._query_budget = query_budget
+        self._postings_budget = postings_budget
+        # Terms in more than max_df of the documents are dropped or demoted,
+        # as high_df says, by the planner.
+        self._planner = QueryPlanner(max_df, high_df)
+        # map stage -> [count, total time, max time, times over budget]
+        self._stage_times = {STAGE_FIRST: [0, 0, 0, 0],
+                             STAGE_RERANK: [0, 0, 0, 0]}
+        # Number of postings visited by all queries, as a measure of their
+        # cost. Intersections count every posting of the leading list once per
+        # list.
+        self._num_postings = 0
+        self._num_approximate = 0
+        self._stats_lock = threading.Lock()
 
         self._max_num_thread = 4
 
-    def init(self, queries):
+    # init loads what is needed to rank the given queries. If queries is None,
+    # the ranker is initialized to rank any query, with top10_tokens, loading
+    # the whole lexicon of the index.
+    def init(self, queries=None):
         logger.info("Initializing ranker")
 
-        url_mapping, checkpoint = read_url_mapping(self._index_fpath, 0)
+        all_tokens = self._init_tokens(queries or [])
+        words = all_tokens if queries != None else None
+
+        # The segments are locked for as long as the ranker lives, so that
+        # merges do not delete them.
+        segment_fpaths, self._segment_locks = acquire_segments(
+            self._index_fpath)
+        self._segments = [IndexSegment(fpath) for fpath in segment_fpaths]
+        # The positions of the index are also read to rerank by proximity, if
+        # it has them.
+        positions = self._mode == MODE_PHRASE or (
+            self._rerank != None and
+            all(has_positions(segment.fpath) for segment in self._segments))
+        for segment in self._segments:
+            segment.init(words, positions=positions)
+        self._init_index_stats()
+        self._init_documents()
+        self._init_reranker()
+
+        self._init_term_stats(words)
+        self._planner.init(self._term_stats, self._num_docs)
+
+        log_memory_usage(logger)
+        words_not_found = set(word for word in all_tokens if not any(
+            segment.has_word(word) for segment in self._segments))
+        self._remove_words_not_found(words_not_found)
+        gc.collect()
 
-        index_metadata, checkpoint = read_index_metadata(self._index_fpath,
-                                                         checkpoint)
+        logger.info("Successfully initialized ranker")
 
+    # _init_tokens tokenizes the queries, and returns all their distinct tokens.
+    def _init_tokens(self, queries):
         self._tokens = {}
         all_tokens = []
         for query in queries:
@@ -58,39 +186,132 @@ class Ranker:
             for word in tokenized_query:
                 if word not in all_tokens:
                     all_tokens.append(word)
-        self._url_mapping = url_mapping
-        self._num_docs = index_metadata.num_docs
-        self._max_docid = index_metadata.max_docid
-        self._avg_doc_len = index_metadata.avg_doc_len
-
-        #logger.info(f"Size of subindex: {sizeof(self._subindex)}.")
-        #logger.info(f"Size of url_mapping: {sizeof(self._url_mapping._m)}")
-
-        # URL mapping takes a lot of memory. We want to filter it to contain
-        # only documents relevant to the queries.
-        #
-        # preprocess_entire_index also returns marks every MB of the file, for
-        # easy access by slave threads.
-        subindex, marks, words_not_found = preprocess_entire_index(
-            self._index_fpath, checkpoint, all_tokens)
-        all_docids = index_docids(subindex)
-        #self._url_mapping.filter_docids(all_docids)
-        logger.info(f"Size of url_mapping: {sizeof(self._url_mapping._m)}")
-        del subindex, all_docids
-        self._marks = marks
-        self._words_not_found = set(words_not_found)
-        gc.collect()
+        return all_tokens
 
-        # Delete tokens that are not found in the index. This preprocessing can
-        # reduce the number of loops traversed in the DAAT matching.
+    # Delete tokens that are not found in the index. This preprocessing can
+    # reduce the number of loops traversed in the DAAT matching. Conjunctive
+    # and phrase queries with such tokens cannot match any document.
+    def _remove_words_not_found(self, words_not_found):
+        self._words_not_found = words_not_found
         for query in self._tokens:
             tokens = self._tokens[query]
+            if (self._mode != MODE_OR and
+                any(token in words_not_found for token in tokens)
+            ):
+                logger.info("Query '%s' has tokens not found in index", query)
+                self._tokens[query] = []
+                continue
             for i in range(len(tokens)-1, -1, -1):
                 if tokens[i] in words_not_found:
-                    logger.info(f"Token '{tokens[i]}' not found in index")
+                    logger.info("Token '%s' not found in index", tokens[i])
                     self._tokens[query].pop(i)
 
-        logger.info("Successfully initialized ranker")
+    # _init_term_stats loads the statistics of the query words, so that their
+    # document frequencies are known without loading their postings. When the
+    # index is a shard of a bigger index, they must come from the term
+    # statistics of the whole index.
+    def _init_term_stats(self, words):
+        self._term_stats = None
+        if self._term_stats_fpath != None:
+            self._term_stats = read_term_stats(self._term_stats_fpath, words)
+        elif all(segment.term_stats != None for segment in self._segments):
+            self._term_stats = combine_term_stats(
+                [segment.term_stats for segment in self._segments],
+                [segment.metadata.num_docs for segment in self._segments])
+        else:
+            logger.warning(f"Index '{self._index_fpath}' has no term "+
+                           f"statistics. Document frequencies will be "+
+                           f"computed from the postings.")
+
+    # _init_index_stats combines the metadata and URL mappings of all segments
+    # into the statistics of the whole index.
+    def _init_index_stats(self):
+        url_mapping = {}
+        num_docs = 0
+        max_docid = 0
+        sum_doc_lens = 0
+        for segment in self._segments:
+            metadata = segment.metadata
+            num_docs += metadata.num_docs
+            max_docid = max(max_docid, metadata.max_docid)
+            sum_doc_lens += metadata.avg_doc_len * metadata.num_docs
+            url_mapping.update(segment.url_mapping._m)
+            segment.url_mapping = None
+
+        self._url_mapping = UrlMapping(url_mapping)
+        self._num_docs = num_docs
+        self._max_docid = max_docid
+        if num_docs != 0:
+            self._avg_doc_len = sum_doc_lens / num_docs
+        else:
+            self._avg_doc_len = 0
+
+    # _init_documents opens the documents tables of all segments, if the
+    # documents of the results are fetched.
+    def _init_documents(self):
+        self._documents = []
+        if not self._fetch:
+            return
+        for segment in self._segments:
+            if not has_documents(segment.fpath):
+                raise ValueError(f"index file '{segment.fpath}' has no "+
+                                 f"documents table, so its documents cannot "+
+                                 f"be fetched. It must be built again")
+            documents = DocumentsTable(documents_fpath(segment.fpath))
+            documents.init()
+            self._documents.append(documents)
+
+    def _init_reranker(self):
+        if self._rerank == None:
+            return
+        self._reranker = reranker_class(self._rerank)(
+            self._segments, self._url_mapping, self._avg_doc_len)
+        if not all(segment.has_positions() for segment in self._segments):
+            logger.warning(f"Index '{self._index_fpath}' has no positions. "+
+                           f"Candidates will not be reranked by proximity")
+        logger.info(f"Reranking the top {self._num_results} documents with "+
+                    f"reranker {self._rerank}")
+
+    # stage_times returns the number of queries, or batches, ranked in two
+    # stages, and the mean and maximum time of each stage, in milliseconds.
+    def stage_times(self):
+        stage_times = {}
+        for stage, (count, total, max_time, over_budget) in (
+                self._stage_times.items()):
+            stage_times[stage] = {
+                "Count": count,
+                "Mean": round(1000 * total / max(count, 1), 3),
+                "Max": round(1000 * max_time, 3),
+                "OverBudget": over_budget,
+            }
+        return stage_times
+
+    def _add_stage_time(self, stage, elapsed, over_budget):
+        with self._stats_lock:
+            times = self._stage_times[stage]
+            times[0] += 1
+            times[1] += elapsed
+            times[2] = max(times[2], elapsed)
+            if over_budget:
+                times[3] += 1
+
+    # num_postings returns the number of postings visited by all queries.
+    def num_postings(self):
+        return self._num_postings
+
+    def _add_postings(self, num_postings):
+        with self._stats_lock:
+            self._num_postings += num_postings
+        metrics.add("processor.postings", num_postings)
+
+    # num_approximate returns the number of queries whose ranking ran out of
+    # budget.
+    def num_approximate(self):
+        return self._num_approximate
+
+    def _add_approximate(self, num_approximate):
+        with self._stats_lock:
+            self._num_approximate += num_approximate
 
     # rank uses internally stored queries, initialized in the init() function.
     #
@@ -98,10 +319,20 @@ class Ranker:
     # per query (of course with a maximum number of threads), and waits in a
     # join.
     def rank_all(self):
-        logger.info(f"Ranking queries: {list(self._tokens.keys())}")
+        logger.info("Ranking queries: %s", log.lazy(list, self._tokens))
 
         gc.collect()
 
+        if self._batch:
+            results = [json.dumps(top10_json(query, self._results(top10),
+                                             approximate),
+                                  ensure_ascii=False)
+                       for query, (top10, approximate) in
+                       self._rank_batch_top10(self._tokens).items()]
+            logger.info("Successfully ranked queries: %s",
+                        log.lazy(list, self._tokens))
+            return results
+
         results = []
         with concurrent.futures.ThreadPoolExecutor(
                 max_workers=self._max_num_thread
@@ -118,130 +349,651 @@ class Ranker:
             for future in completed:
                 results.append(future.result())
 
-        logger.info(f"Successfully ranked queries: {list(self._tokens.keys())}")
+        logger.info("Successfully ranked queries: %s",
+                    log.lazy(list, self._tokens))
+
+        return results
+
+    # top10_all returns the top 10 (score, url) pairs of each query, with
+    # unrounded scores, so that they can be merged with the results of other
+    # shards, and whether they are approximate.
+    def top10_all(self):
+        logger.info("Ranking top 10 of queries: %s",
+                    log.lazy(list, self._tokens))
+
+        if self._batch:
+            return {query: (self._results(top10), approximate)
+                    for query, (top10, approximate) in
+                    self._rank_batch_top10(self._tokens).items()}
+
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_num_thread
+        ) as executor:
+            futures = {}
+            for query in self._tokens:
+                futures[query] = executor.submit(self._rank_top10, query)
+            for query in futures:
+                top10, approximate = futures[query].result()
+                results[query] = (self._results(top10), approximate)
+
+        logger.info("Successfully ranked top 10 of queries: %s",
+                    log.lazy(list, self._tokens))
 
         return results
 
+    # top10_tokens returns the top 10 (score, url) pairs of each of the given
+    # tokenized queries, ranking them as a batch, and whether they are
+    # approximate.
+    def top10_tokens(self, tokens_list):
+        top10s = self._rank_batch_top10({i: tokens for i, tokens in
+                                         enumerate(tokens_list)})
+        return [(self._results(top10s[i][0]), top10s[i][1])
+                for i in range(len(tokens_list))]
+
+    # top10 returns the top 10 (score, url) pairs of the tokenized query,
+    # ranking it on its own, and whether they are approximate.
+    def top10(self, tokens):
+        top10, approximate = self._rank_tokens_top10(tokens)
+        return self._results(top10), approximate
+
+    # _rank_batch ranks the given tokenized queries together, term at a time:
+    # the list of each distinct term of the batch is read and scored once, and
+    # its scores are added to the accumulators of every query with the term.
+    # Only disjunctive queries are batched. Terms demoted by the plan of a
+    # query are scored last, and only for the documents of the query found by
+    # then. With a budget, terms are scored by decreasing IDF, if their
+    # document frequencies are known beforehand, as in _score_by_idf. The time
+    # budget is the one of the whole batch, while the postings of each term are
+    # charged to the budget of every query with the term. It returns the top
+    # 10 of each query, and whether it is approximate.
+    def _rank_batch(self, queries_tokens, deadline=None):
+        if self._mode != MODE_OR:
+            return {query: self._rank_tokens(queries_tokens[query],
+                                             deadline=deadline)
+                    for query in queries_tokens}
+
+        logger.info("Ranking batch of %d queries term at a time",
+                    len(queries_tokens))
+
+        # map term -> queries that score the term, or that demote it.
+        term_queries = {}
+        demoted_queries = {}
+        for query in queries_tokens:
+            plan = self._plan(queries_tokens[query])
+            for term in dict.fromkeys(queries_tokens[query]):
+                action = plan.action(term)
+                if action == ACTION_SCORE:
+                    queries = term_queries
+                elif action == ACTION_DEMOTE:
+                    queries = demoted_queries
+                else:
+                    continue
+                if term not in queries:
+                    queries[term] = []
+                queries[term].append(query)
+
+        terms = list(term_queries)
+        demoted = list(demoted_queries)
+        # The postings left in the budget of each query.
+        remaining = None
+        if self._postings_budget != None:
+            remaining = {query: self._postings_budget
+                         for query in queries_tokens}
+        if ((deadline != None or remaining != None) and
+            self._term_stats != None
+        ):
+            for batch_terms in [terms, demoted]:
+                batch_terms.sort(key=lambda term: self._term_stats[term].df
+                                 if term in self._term_stats else 0)
+
+        # Each step scores a term for some queries, or only probes it for the
+        # documents they already have.
+        steps = ([(term, term_queries[term], False) for term in terms] +
+                 [(term, demoted_queries[term], True) for term in demoted])
+        accumulators = {query: {} for query in queries_tokens}
+        num_postings = 0
+        # The steps not fully scored, since the budget ran out.
+        unscored = []
+        for i, (term, queries, probe) in enumerate(steps):
+            if _expired(deadline):
+                unscored.extend(steps[i:])
+                break
+            # A term is scored within the budget of all its queries.
+            max_postings = None
+            if remaining != None:
+                max_postings = min(remaining[query] for query in queries)
+            subindex = self._subindex([term])
+            if term not in subindex:
+                continue
+            query_accumulators = [accumulators[query] for query in queries]
+            docids = None
+            if probe:
+                docids = sorted(set().union(*query_accumulators))
+            term_postings, completed = self._score_term(
+                subindex[term], self._df(term, subindex), query_accumulators,
+                docids, max_postings, deadline)
+            num_postings += term_postings
+            if remaining != None:
+                for query in queries:
+                    remaining[query] -= term_postings
+            if not completed:
+                unscored.append(steps[i])
+
+        approximate = set(query for _, queries, _ in unscored
+                          for query in queries)
+        if len(unscored) > 0:
+            logger.warning("Budget exceeded ranking batch of %d queries. "+
+                           "Terms not fully scored: %s", len(queries_tokens),
+                           [term for term, _, _ in unscored])
+
+        logger.info("Successfully ranked batch of %d queries with %d distinct "+
+                    "terms. Postings read: %d", len(queries_tokens),
+                    len(term_queries), num_postings)
+        self._add_postings(num_postings)
+
+        return {query: (heapq.nsmallest(self._num_results, accumulator.items(),
+                                        key=lambda item: (-item[1], item[0])),
+                        query in approximate)
+                for query, accumulator in accumulators.items()}
+
     # _rank is executed by each slave thread.
     def _rank(self, query, tokens):
         tid = threading.get_ident()
 
         try:
-            logger.info(f"({tid}) Ranking query: '{query}'. Tokens: "+
-                        f"{self._tokens[query]}")
+            logger.info("(%s) Ranking query: '%s'. Tokens: %s", tid, query,
+                        self._tokens[query])
 
-            tokens = self._tokens[query]
-            checkpoints = find_checkpoints_marks(self._marks, tokens, tid)
-            subindex = subindex_from_words_marks(self._index_fpath, checkpoints,
-                                                 tokens, tid)
-
-            scores = self._score(subindex, tokens)
-            result = self._top10_json(query, scores)
+            top10, approximate = self._rank_top10(query, tid)
+            result = top10_json(query, self._results(top10), approximate)
             result_json = json.dumps(result, ensure_ascii=False)
 
         except Exception as e:
-            logger.error(f"({tid}) Received unexpected exception: "+
-                         f"{e}. Returning immediately.", exc_info=True)
+            logger.error("(%s) Received unexpected exception: %s. Returning "+
+                         "immediately.", tid, e, exc_info=True)
 
-        logger.info(f"({tid}) Successfully ranked query: '{query}'. "+
-                    f"Result length: {len(result)}")
+        logger.info("(%s) Successfully ranked query: '%s'. Result length: %d",
+                    tid, query, len(result))
 
         return result_json
 
-    # Scores documents in a Document at a time (DAAT) fashion.
-    def _score(self, subindex, tokens):
-        logger.info(f"Scoring tokens {tokens} with subindex of length: "+
-                    f"{len(subindex)}")
+    def _rank_top10(self, query, tid="Unknown"):
+        return self._rank_tokens_top10(self._tokens[query], tid)
+
+    # _rank_tokens_top10 returns the top 10 of the tokenized query, and
+    # whether it is approximate. Each query is a unit of work of the sampled
+    # traces.
+    @log.trace_unit
+    def _rank_tokens_top10(self, tokens, tid="Unknown"):
+        before = time.perf_counter()
+        deadline = _deadline(before, self._query_budget)
+        if self._reranker == None:
+            top10, approximate = self._rank_tokens(tokens, tid, deadline)
+        else:
+            candidates, approximate = self._rank_tokens(
+                tokens, tid,
+                _earliest(_deadline(before, self._first_stage_budget),
+                          deadline))
+            top10, approximate = self._rerank_candidates(
+                tokens, candidates, approximate, time.perf_counter() - before,
+                deadline, tid)
+        if approximate:
+            self._add_approximate(1)
+        return top10, approximate
+
+    # _rank_batch_top10 ranks a batch of tokenized queries, in two stages if
+    # there is a reranker. The first stage of a batch is timed, and budgeted,
+    # as a whole, and so is the whole batch. Each batch is a unit of work of
+    # the sampled traces.
+    @log.trace_unit
+    def _rank_batch_top10(self, queries_tokens):
+        before = time.perf_counter()
+        deadline = _deadline(before, self._query_budget)
+        if self._reranker == None:
+            top10s = self._rank_batch(queries_tokens, deadline)
+        else:
+            candidates = self._rank_batch(
+                queries_tokens,
+                _earliest(_deadline(before, self._first_stage_budget),
+                          deadline))
+            first_stage_time = time.perf_counter() - before
+            top10s = {query: self._rerank_candidates(queries_tokens[query],
+                                                     *candidates[query],
+                                                     first_stage_time,
+                                                     deadline)
+                      for query in candidates}
+        self._add_approximate(sum(approximate
+                                  for _, approximate in top10s.values()))
+        return top10s
+
+    # _rerank_candidates re-scores the candidates of the first stage with the
+    # reranker, and returns the top 10 of them, and whether it is approximate:
+    # if the first stage was, or not all features were computed.
+    def _rerank_candidates(self, tokens, candidates, approximate,
+                           first_stage_time, deadline=None, tid="Unknown"):
+        before = time.perf_counter()
+        reranked, completed = self._reranker.rerank(
+            tokens, candidates,
+            _earliest(_deadline(before, self._rerank_budget), deadline))
+        rerank_time = time.perf_counter() - before
+
+        self._add_stage_time(STAGE_FIRST, first_stage_time,
+                             self._first_stage_budget != None and
+                             first_stage_time >= self._first_stage_budget)
+        self._add_stage_time(STAGE_RERANK, rerank_time, not completed)
+
+        logger.info("(%s) Ranked tokens %s in two stages. First stage: "+
+                    "%.3f ms, %d candidates. Rerank: %.3f ms, all features: "+
+                    "%s", tid, tokens, 1000 * first_stage_time,
+                    len(candidates), 1000 * rerank_time, completed)
+
+        return reranked[:NUM_RESULTS], approximate or not completed
+
+    # _rank_tokens returns the top 10 of the tokenized query, and whether it
+    # is approximate. Disjunctive queries are scored as planned: with a budget
+    # by decreasing IDF, and otherwise document at a time.
+    def _rank_tokens(self, tokens, tid="Unknown", deadline=None):
+        if self._mode != MODE_OR:
+            scores, approximate = self._score_conjunctive(tokens, tid,
+                                                          deadline)
+            return self._top10(scores), approximate
+
+        plan = self._plan(tokens, tid)
+        if deadline != None or self._postings_budget != None:
+            scores, approximate = self._score_by_idf(tokens, plan, tid,
+                                                     deadline)
+        else:
+            scored = [token for token in tokens
+                      if plan.action(token) == ACTION_SCORE]
+            demoted = plan.terms(ACTION_DEMOTE)
+            scores = self._score(self._subindex(scored + demoted, tid), scored,
+                                 demoted)
+            approximate = False
+        return self._top10(scores), approximate
+
+    # _plan returns the plan of the tokenized query. Only disjunctive queries
+    # can do without some of their terms.
+    def _plan(self, tokens, tid="Unknown"):
+        plan = self._planner.plan(tokens, prune=self._mode == MODE_OR)
+        logger.info("(%s) Plan of tokens %s: %s", tid, tokens, plan)
+        return plan
+
+    # plan returns the plan of the tokenized query: its terms, by increasing
+    # document frequency, with how each one is evaluated and its estimated
+    # cost in postings.
+    def plan(self, tokens):
+        return self._plan(tokens)
+
+    # _subindex gathers the cursors over the postings of the given words in all
+    # segments. Segments cover disjoint docid ranges, so a document is in at
+    # most one of the cursors of a word.
+    def _subindex(self, words, tid="Unknown"):
+        subindex = {}
+        for segment in self._segments:
+            segment_subindex = segment.subindex(words, tid)
+            for word in segment_subindex:
+                if word not in subindex:
+                    subindex[word] = []
+                subindex[word].append(segment_subindex[word])
+        return subindex
+
+    # Scores documents in a Document at a time (DAAT) fashion. The lists of the
+    # demoted terms do not add documents, but are probed, with skips, for the
+    # documents of the other terms.
+    @metrics.timed("processor.score")
+    def _score(self, subindex, tokens, demoted=None):
+        logger.info("Scoring tokens %s with subindex of length: %d", tokens,
+                    len(subindex))
 
         if len(tokens) == 0:
-            logger.info(f"Did not find any of the tokens. Returning empty score.")
+            logger.info("Did not find any of the tokens. Returning empty score.")
             return ScoreHeap()
 
-        # DAAT adapted from 2022-01 Information Retrieval class slides
+        # DAAT adapted from 2022-01 Information Retrieval class slides. Instead
+        # of visiting every docid of the index, the next document scored is the
+        # lowest docid among the cursors. A term repeated in the query is only
+        # scored once.
         #
         scores = ScoreHeap()
         if self._benchmarking:
             scores_list = []
-        posting_idxs = {word: 0 for word in subindex}
-        for target_docid in range(self._max_docid):
-            if target_docid % 10000 == 0:
-                logger.debug(f"Scoring document with ID {target_docid}")
+        terms = [term for term in dict.fromkeys(tokens) if term in subindex]
+        demoted = [term for term in demoted or [] if term in subindex]
+        dfs = {term: self._df(term, subindex) for term in terms + demoted}
+        cursors = [(term, cursor) for term in terms for cursor in subindex[term]
+                   if cursor.docid != None]
+        demoted_cursors = [(term, cursor) for term in demoted
+                           for cursor in subindex[term]]
+        num_scored = 0
+        num_postings = 0
+        traced = log.tracing()
+        while len(cursors) > 0:
+            target_docid = min(cursor.docid for _, cursor in cursors)
 
             score = 0
-            for term in tokens:
-                posting_idx = posting_idxs[term]
-
-                while posting_idx < len(subindex[term]):
-                    docid, weight = subindex[term][posting_idx]
-
-                    if docid > target_docid:
-                        # The inverted list is ordered by docid
-                        break
-                    elif docid == target_docid:
-                        # Scoring policy
-                        if self._ranker_type == RANKER_TYPE_TFIDF:
-                            score += self._tfidf(docid, weight, len(subindex[term]))
-                        elif self._ranker_type == RANKER_TYPE_BM25:
-                            score += self._bm25(docid, weight, len(subindex[term]))
-
-                        posting_idx += 1
-                        break
-                    posting_idx += 1
-
-                posting_idxs[term] = posting_idx
+            exhausted = False
+            for term, cursor in cursors:
+                if cursor.docid != target_docid:
+                    continue
+                num_postings += 1
+                score += self._term_score(target_docid, cursor.freq, dfs[term])
+                if cursor.next() == None:
+                    exhausted = True
+            if exhausted:
+                cursors = [(term, cursor) for term, cursor in cursors
+                           if cursor.docid != None]
+            for term, cursor in demoted_cursors:
+                if cursor.next_geq(target_docid) == target_docid:
+                    num_postings += 1
+                    score += self._term_score(target_docid, cursor.freq,
+                                              dfs[term])
 
             if score != 0:
-                scores.push(docid, score)
+                scores.push(target_docid, score)
                 if self._benchmarking:
                     scores_list.append(score)
+
+            num_scored += 1
+            if traced and num_scored % BUDGET_CHECK_INTERVAL == 0:
+                log.trace("Scored %d documents of tokens %s, up to docid %d, "+
+                          "visiting %d postings", num_scored, tokens,
+                          target_docid, num_postings)
         if self._benchmarking:
             print(json.dumps(scores_list))
 
-        logger.info(f"Successfully scored {tokens} with subindex len "+
-                    f"{len(subindex)}. Scores length: {len(scores)}")
+        self._add_postings(num_postings)
+
+        logger.info("Successfully scored %s with subindex len %d. Scores "+
+                    "length: %d", tokens, len(subindex), len(scores))
 
         return scores
 
+    # _score_by_idf scores documents term at a time, by decreasing IDF, for
+    # queries with a budget, following their plan. The list of each term is
+    # only read once the previous ones are scored, so when the budget runs
+    # out, the lists left unread, or scored only in part, are the ones of the
+    # most common terms, which add the least to the scores. Demoted terms are
+    # scored last, only for the documents found by then. It returns the
+    # scores, and whether the budget ran out.
+    @metrics.timed("processor.score")
+    def _score_by_idf(self, tokens, plan, tid="Unknown", deadline=None):
+        logger.info("(%s) Scoring tokens %s by decreasing IDF", tid, tokens)
+
+        terms = plan.terms(ACTION_SCORE)
+        demoted = plan.terms(ACTION_DEMOTE)
+        # Without term statistics, document frequencies are only known once
+        # the lists are read, so all of them are read first. No term is
+        # demoted then.
+        subindex = None
+        if self._term_stats == None:
+            subindex = self._subindex(terms, tid)
+            terms = [term for term in terms if term in subindex]
+            dfs = {term: self._df(term, subindex) for term in terms}
+            terms.sort(key=lambda term: dfs[term])
+        else:
+            dfs = {term: plan.df(term) for term in terms + demoted}
+
+        # Each step scores a term, or only probes it for the documents found
+        # by the previous ones.
+        steps = ([(term, False) for term in terms] +
+                 [(term, True) for term in demoted])
+        accumulators = {}
+        docids = None
+        num_postings = 0
+        # The terms not fully scored, since the budget ran out.
+        unscored = []
+        for i, (term, probe) in enumerate(steps):
+            max_postings = None
+            if self._postings_budget != None:
+                max_postings = self._postings_budget - num_postings
+            if _expired(deadline) or max_postings == 0:
+                unscored = [term for term, _ in steps[i:]]
+                break
+            if subindex != None:
+                cursors = subindex[term]
+            else:
+                cursors = self._subindex([term], tid).get(term, [])
+            if probe and docids == None:
+                docids = sorted(accumulators)
+            term_postings, completed = self._score_term(
+                cursors, dfs[term], [accumulators], docids if probe else None,
+                max_postings, deadline)
+            num_postings += term_postings
+            if not completed:
+                unscored = [term for term, _ in steps[i:]]
+                break
+            log.trace("(%s) Scored term %s with df %d. Postings scored: %d",
+                      tid, term, dfs[term], num_postings)
+
+        if len(unscored) > 0:
+            logger.warning("(%s) Budget exceeded scoring tokens %s. Terms not "+
+                           "fully scored: %s. Returning the best documents so "+
+                           "far", tid, tokens, unscored)
+        self._add_postings(num_postings)
+
+        scores = ScoreHeap()
+        for docid, score in accumulators.items():
+            scores.push(docid, score)
+
+        logger.info("(%s) Successfully scored %s by decreasing IDF. Scores "+
+                    "length: %d", tid, tokens, len(scores))
+
+        return scores, len(unscored) > 0
+
+    # _score_term adds the scores of the postings of a term, given by the
+    # cursors over its list in every segment, to the accumulators. If docids,
+    # a sorted list, is given, only the postings of those documents are scored,
+    # probing the lists with skips, and only in the accumulators that have the
+    # documents. It stops after max_postings postings, or once the deadline
+    # passed, and returns the number of postings scored and whether all of them
+    # were.
+    def _score_term(self, cursors, df, accumulators, docids=None,
+                    max_postings=None, deadline=None):
+        num_postings = 0
+        for cursor in cursors:
+            if docids == None:
+                postings = _postings(cursor)
+            else:
+                postings = _probed_postings(cursor, docids)
+            for docid in postings:
+                if (num_postings == max_postings or
+                    (num_postings % BUDGET_CHECK_INTERVAL == 0 and
+                     _expired(deadline))
+                ):
+                    return num_postings, False
+                score = self._term_score(docid, cursor.freq, df)
+                for accumulator in accumulators:
+                    if docids == None or docid in accumulator:
+                        accumulator[docid] = accumulator.get(docid, 0) + score
+                num_postings += 1
+        return num_postings, True
+
+    # Scores documents with all the tokens, or with the tokens as a phrase,
+    # intersecting the lists of the tokens in each segment. It returns the
+    # scores, and whether the budget ran out.
+    def _score_conjunctive(self, tokens, tid="Unknown", deadline=None):
+        logger.info("(%s) Scoring tokens %s in mode %s", tid, tokens,
+                    self._mode)
+
+        scores = ScoreHeap()
+        if len(tokens) == 0:
+            logger.info("Did not find all of the tokens. Returning empty score.")
+            return scores, False
+
+        terms = list(dict.fromkeys(tokens))
+        segment_subindexes = [(segment, segment.subindex(terms, tid))
+                              for segment in self._segments]
+        subindex = {term: [segment_subindex[term] for _, segment_subindex in
+                           segment_subindexes if term in segment_subindex]
+                    for term in terms}
+        if any(len(subindex[term]) == 0 for term in terms):
+            logger.info("Did not find all of the tokens. Returning empty score.")
+            return scores, False
+        dfs = {term: self._df(term, subindex) for term in terms}
+
+        num_postings = 0
+        approximate = False
+        for segment, segment_subindex in segment_subindexes:
+            if any(term not in segment_subindex for term in terms):
+                continue
+            positions = None
+            if self._mode == MODE_PHRASE:
+                positions = {term: segment.positions_list(term)
+                             for term in terms}
+            max_postings = None
+            if self._postings_budget != None:
+                max_postings = self._postings_budget - num_postings
+            completed, segment_postings = self._intersect(
+                segment_subindex, tokens, dfs, positions, scores, deadline,
+                max_postings)
+            num_postings += segment_postings
+            if not completed:
+                logger.warning("(%s) Budget exceeded scoring tokens %s. "+
+                               "Returning the best documents so far", tid,
+                               tokens)
+                approximate = True
+                break
+        self._add_postings(num_postings)
+
+        logger.info("(%s) Successfully scored %s in mode %s. Scores length: "+
+                    "%d", tid, tokens, self._mode, len(scores))
+
+        return scores, approximate
+
+    # _intersect scores the documents in all the lists of the subindex. Lists
+    # are intersected smallest first: the smallest list leads, and the others
+    # are only advanced, with skips, to its docids. It returns whether the
+    # lists were fully intersected before the deadline passed, or max_postings
+    # were visited, and the number of postings visited.
+    def _intersect(self, subindex, tokens, dfs, positions, scores,
+                   deadline=None, max_postings=None):
+        cursors = sorted(subindex.items(), key=lambda item: len(item[1]))
+        lead = cursors[0][1]
+        docid = lead.docid
+        max_visited = None
+        if max_postings != None:
+            max_visited = max_postings // len(cursors)
+        num_visited = 0
+        while docid != None:
+            if (num_visited == max_visited or
+                (num_visited % BUDGET_CHECK_INTERVAL == 0 and
+                 _expired(deadline))
+            ):
+                return False, num_visited * len(cursors)
+            num_visited += 1
+            matched = True
+            for _, cursor in cursors[1:]:
+                other_docid = cursor.next_geq(docid)
+                if other_docid == None:
+                    return True, num_visited * len(cursors)
+                if other_docid != docid:
+                    docid = lead.next_geq(other_docid)
+                    matched = False
+                    break
+            if not matched:
+                continue
+
+            if positions == None or self._is_phrase(subindex, tokens,
+                                                    positions):
+                score = 0
+                for term, cursor in cursors:
+                    score += self._term_score(docid, cursor.freq, dfs[term])
+                scores.push(docid, score)
+            docid = lead.next()
+        return True, num_visited * len(cursors)
+
+    # _is_phrase tells whether the tokens are in consecutive positions of the
+    # document all the cursors of the subindex are at.
+    def _is_phrase(self, subindex, tokens, positions):
+        term_positions = {term: set(positions[term].positions(cursor.index))
+                          for term, cursor in subindex.items()}
+        for start in term_positions[tokens[0]]:
+            if all(start + i in term_positions[token]
+                   for i, token in enumerate(tokens)):
+                return True
+        return False
+
+    def _term_score(self, docid, freq, df):
+        # Scoring policy
+        if self._ranker_type == RANKER_TYPE_TFIDF:
+            return self._tfidf(docid, freq, df)
+        elif self._ranker_type == RANKER_TYPE_BM25:
+            return self._bm25(docid, freq, df)
+
+    def _df(self, term, subindex):
+        if self._term_stats != None:
+            return self._term_stats[term].df
+        return sum(len(cursor) for cursor in subindex[term])
+
     def _tf(self, docid, freq):
-        return freq / self._url_mapping.get_doc_len(docid)
+        return tf(freq, self._url_mapping.get_doc_len(docid))
 
-    def _idf(self, len_postings):
-        return natural_log((self._num_docs - len_postings + 0.5) / 
-                           (len_postings + 0.5) + 1)
+    def _idf(self, df):
+        return idf(self._num_docs, df)
 
-    def _tfidf(self, docid, freq, len_postings):
-        return self._tf(docid, freq) * self._idf(len_postings)
+    def _tfidf(self, docid, freq, df):
+        return self._tf(docid, freq) * self._idf(df)
 
-    def _bm25(self, docid, freq, len_postings):
-        return self._idf(len_postings) * (
-            (freq * (self._bm25_k1 + 1)) /
-            freq + self._bm25_k1 * (1 - self._bm25_b + self._bm25_b *
-                                    self._url_mapping.get_doc_len(docid) /
-                                    self._avg_doc_len)
-        )
+    def _bm25(self, docid, freq, df):
+        return bm25(freq, self._url_mapping.get_doc_len(docid),
+                    self._avg_doc_len, self._idf(df))
 
-    def _top10_json(self, query: str, scores: ScoreHeap):
+    def _top10(self, scores: ScoreHeap):
         results = []
-        for _ in range(NUM_RESULTS):
+        for _ in range(self._num_results):
             if len(scores) == 0:
                 break
+            results.append(scores.pop())
+        return results
 
-            docid, score = scores.pop()
-            # while len(scores) > 0:
-            #     new_docid, new_score = scores.pop()
-            #     if new_docid != docid:
-            #         # Put back
-            #         scores.push(new_docid, new_score)
-            #         break
-            #     score += new_score
-
-            results.append({
-                "URL": self._url_mapping.get_url(docid),
-                "Score": round(score, 1),
-            })
-
-        result_json = {}
-        result_json["Query"] = query
-        result_json["Results"] = results
+    # _results returns the (score, url) pairs of the (docid, score) pairs of a
+    # top 10. If documents are fetched, the snippet of each document is added
+    # to its pair.
+    def _results(self, top10):
+        results = []
+        for docid, score in top10:
+            url = self._url_mapping.get_url(docid)
+            if self._fetch:
+                results.append((score, url, self._snippet(docid, url)))
+            else:
+                results.append((score, url))
+        return results
 
-        return result_json
+    # _snippet reads the record of the document by seeking to it in its WARC
+    # file, and returns the beginning of its text.
+    def _snippet(self, docid, url):
+        for documents in self._documents:
+            location = documents.location(docid)
+            if location == None:
+                continue
+            content = read_document(*location, url)
+            if content == None:
+                break
+            text = " ".join(content.decode("utf-8", errors="replace").split())
+            return text[:SNIPPET_CHARS]
+        logger.warning("Document %d with URL '%s' not found", docid, url)
+        return None
+
+# top10_json formats the (score, url) pairs of a top 10, which may be followed
+# by the snippet of the document. Approximate results, of queries over budget,
+# are flagged as such.
+def top10_json(query: str, top10, approximate: bool = False):
+    results = []
+    for result in top10:
+        score, url = result[:2]
+        entry = {
+            "URL": url,
+            "Score": round(score, 1),
+        }
+        if len(result) > 2:
+            entry["Snippet"] = result[2]
+        results.append(entry)
+
+    result_json = {}
+    result_json["Query"] = query
+    result_json["Results"] = results
+    if approximate:
+        result_json["Approximate"] = True
+
+    return result_json
@@ -0,0 +1,135 @@
+import time
+from urllib.parse import urlparse
+
+from common.log import log
+
+logger = log.logger()
+
+# Rerankers: re-score the candidates of the first stage with document features.
+RERANKER_FEATURES = "FEATURES"
+
+DEFAULT_NUM_CANDIDATES = 100
+
+# FeatureReranker re-scores the candidates of the first stage with features
+# that are too expensive to compute while traversing whole lists:
+#
+#   proximity:  the number of distinct query words over the length of the
+#               smallest window of the document with all of them, read from
+#               the positions of the index. 1 if they are consecutive.
+#   URL depth:  1 / (1 + number of path segments of the URL), so that home
+#               pages rank above deep pages.
+#   doc length: doc_len / (doc_len + avg_doc_len), so that very short pages
+#               rank below pages of typical length.
+#
+# Each feature is between 0 and 1. The first stage score of a candidate is
+# raised by a weighted fraction of itself for each feature, so that features
+# only reorder candidates with close scores, and the scores of candidates
+# reranked by different shards stay comparable. Features are computed
+# cheapest first, and the ones not computed when the budget runs out are left
+# out for all candidates, so that candidates stay comparable.
+class FeatureReranker:
+    proximity_weight = 0.3
+    url_depth_weight = 0.1
+    doc_len_weight   = 0.1
+
+    def __init__(self, segments, url_mapping, avg_doc_len):
+        self._segments = segments
+        self._url_mapping = url_mapping
+        self._avg_doc_len = avg_doc_len
+
+    # rerank returns the candidates, (docid, score) pairs, sorted by their new
+    # score, and whether all features were computed before the deadline.
+    def rerank(self, tokens, candidates, deadline=None):
+        if len(candidates) == 0:
+            return candidates, True
+
+        scores = dict(candidates)
+        bonuses = {}
+        for docid, _ in candidates:
+            url = self._url_mapping.get_url(docid)
+            doc_len = self._url_mapping.get_doc_len(docid)
+            bonuses[docid] = (self.url_depth_weight * self._url_depth(url) +
+                              self.doc_len_weight * self._doc_len(doc_len))
+
+        completed = True
+        terms = list(dict.fromkeys(tokens))
+        if len(terms) > 1:
+            positions = self._positions(terms, [docid for docid, _ in
+                                                candidates], deadline)
+            if positions == None:
+                completed = False
+            else:
+                for docid, doc_positions in positions.items():
+                    bonuses[docid] += (self.proximity_weight *
+                                       self._proximity(terms, doc_positions))
+
+        for docid in scores:
+            scores[docid] *= 1 + bonuses[docid]
+        return (sorted(scores.items(), key=lambda item: (-item[1], item[0])),
+                completed)
+
+    def _url_depth(self, url):
+        path = urlparse(url or "").path
+        depth = len([segment for segment in path.split("/") if segment != ""])
+        return 1 / (1 + depth)
+
+    def _doc_len(self, doc_len):
+        if doc_len + self._avg_doc_len == 0:
+            return 0
+        return doc_len / (doc_len + self._avg_doc_len)
+
+    # _positions returns the positions of the terms in each of the documents
+    # that has all of them, or None if the deadline passed before they were
+    # all read. Segments without positions are skipped.
+    def _positions(self, terms, docids, deadline):
+        docids = sorted(docids)
+        positions = {}
+        for segment in self._segments:
+            if not segment.has_positions():
+                continue
+            segment_positions = {docid: {} for docid in docids}
+            subindex = segment.subindex(terms)
+            for term, cursor in subindex.items():
+                if deadline != None and time.perf_counter() >= deadline:
+                    return None
+                positions_list = segment.positions_list(term)
+                for docid in docids:
+                    if cursor.next_geq(docid) == None:
+                        break
+                    if cursor.docid == docid:
+                        segment_positions[docid][term] = (
+                            positions_list.positions(cursor.index))
+            for docid, doc_positions in segment_positions.items():
+                if len(doc_positions) == len(terms):
+                    positions[docid] = doc_positions
+        return positions
+
+    # _proximity finds the smallest window with all the terms, sliding it over
+    # the positions of all of them in order.
+    def _proximity(self, terms, doc_positions):
+        occurrences = sorted((position, term) for term in terms
+                             for position in doc_positions[term])
+        counts = {}
+        min_span = None
+        start = 0
+        for position, term in occurrences:
+            counts[term] = counts.get(term, 0) + 1
+            while len(counts) == len(terms):
+                start_position, start_term = occurrences[start]
+                span = position - start_position + 1
+                if min_span == None or span < min_span:
+                    min_span = span
+                counts[start_term] -= 1
+                if counts[start_term] == 0:
+                    del counts[start_term]
+                start += 1
+        return len(terms) / min_span
+
+RERANKERS = {
+    RERANKER_FEATURES: FeatureReranker,
+}
+
+def reranker_class(reranker):
+    if reranker not in RERANKERS:
+        raise ValueError(f"Invalid reranker {reranker}")
+    return RERANKERS[reranker]
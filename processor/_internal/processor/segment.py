@@ -0,0 +1,122 @@
+import os
+
+from common.log import log
+from common.metrics import metrics
+from common.utils.index import (PostingsCursor,
+                                postings_cursor)
+from common.utils.index_metadata import read_index_metadata
+from common.utils.positions import (PositionsIndex,
+                                    positions_fpath,
+                                    has_positions)
+from common.utils.skips import (read_skips,
+                                skips_fpath)
+from common.utils.marks import (read_marks,
+                                marks_fpath)
+from common.utils.term_stats import (read_term_stats,
+                                     term_stats_fpath)
+from common.utils.url_mapping import read_url_mapping
+from .utils import (preprocess_entire_index,
+                    find_checkpoints_marks,
+                    subindex_from_words_marks)
+
+logger = log.logger()
+
+# IndexSegment is one index file of the index being queried. Segments cover
+# disjoint and increasing docid ranges, so the postings of a word in the whole
+# index are the concatenation of its postings in each segment.
+class IndexSegment:
+    def __init__(self, fpath):
+        self.fpath = fpath
+
+        self.url_mapping = None
+        self.metadata = None
+        self.term_stats = None
+        self._skips = None
+        self._positions = None
+        self._marks = None
+        self._words_not_found = None
+
+    # init loads what is needed to read the lists of the given words, or of
+    # any word if words is None.
+    @metrics.timed("processor.segment_init")
+    def init(self, words, positions=False):
+        logger.info(f"Initializing index segment '{self.fpath}'")
+
+        if positions and not has_positions(self.fpath):
+            raise ValueError(f"index file '{self.fpath}' has no positions "+
+                             f"file. It must be built with '-positions True'")
+
+        self.url_mapping, checkpoint = read_url_mapping(self.fpath, 0)
+        self.metadata, checkpoint = read_index_metadata(self.fpath, checkpoint)
+
+        # Indexes written before the term statistics table existed do not have
+        # one.
+        if os.path.exists(term_stats_fpath(self.fpath)):
+            self.term_stats = read_term_stats(term_stats_fpath(self.fpath),
+                                              words)
+
+        # The skips file has the offset of every list, so the lists of the
+        # words can be read directly, and the marks of the index have the
+        # blocks of the skips file with the words. Indexes written before the
+        # skips file existed are scanned instead.
+        if os.path.exists(skips_fpath(self.fpath)):
+            marks = None
+            if words != None and os.path.exists(marks_fpath(self.fpath)):
+                marks = read_marks(marks_fpath(self.fpath))
+            self._skips = read_skips(skips_fpath(self.fpath), words, marks)
+            self._words_not_found = set(word for word in words or []
+                                        if word not in self._skips)
+            if len(self._words_not_found) > 0:
+                logger.warning(f"The following words were not found in the "+
+                               f"index: {list(self._words_not_found)}")
+        elif words == None:
+            raise ValueError(f"index file '{self.fpath}' has no skips file, "+
+                             f"so it can only be queried with known queries")
+        else:
+            # preprocess_entire_index also returns marks every MB of the file,
+            # for easy access by slave threads.
+            _, marks, words_not_found = preprocess_entire_index(
+                self.fpath, checkpoint, words)
+            self._marks = marks
+            self._words_not_found = set(words_not_found)
+
+        # Positions are only read by phrase queries.
+        if positions:
+            self._positions = PositionsIndex(positions_fpath(self.fpath))
+            self._positions.init(words)
+
+        logger.info(f"Successfully initialized index segment '{self.fpath}'")
+
+    def has_positions(self):
+        return self._positions != None
+
+    def has_word(self, word):
+        if self._skips != None:
+            return word in self._skips
+        return word not in self._words_not_found
+
+    def positions_list(self, word):
+        return self._positions.positions_list(word)
+
+    # subindex returns a cursor over the postings of each of the given words
+    # found in the segment.
+    @metrics.timed("processor.subindex")
+    def subindex(self, words, tid="Unknown"):
+        words = [word for word in words if self.has_word(word)]
+        if len(words) == 0:
+            return {}
+        if self._skips == None:
+            checkpoints = find_checkpoints_marks(self._marks, words, tid)
+            subindex = subindex_from_words_marks(self.fpath, checkpoints, words,
+                                                 tid)
+            return {word: postings_cursor(subindex[word]) for word in subindex}
+
+        subindex = {}
+        with open(self.fpath, "r", encoding="utf-8") as f:
+            for word in words:
+                offset, skips = self._skips[word]
+                f.seek(offset)
+                line_word, postings_str = f.readline().rstrip("\n").split(" ", 1)
+                assert line_word == word, line_word
+                subindex[word] = PostingsCursor(postings_str, skips)
+        return subindex
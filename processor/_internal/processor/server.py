@@ -0,0 +1,155 @@
+import asyncio
+import concurrent.futures
+import json
+
+from common.log import log
+from common.preprocessing.normalize import tokenize_and_normalize
+from .ranker import top10_json
+
+logger = log.logger()
+
+DEFAULT_HOST           = "localhost"
+DEFAULT_BATCH_WINDOW   = 0.002
+DEFAULT_MAX_BATCH_SIZE = 64
+
+# QueryServer answers queries as they arrive, with an initialized ranker.
+#
+# Queries that normalize to the same tokens are coalesced: while one of them is
+# being ranked, the others wait for its result instead of ranking it again.
+# Distinct queries arriving within batch_window seconds of each other are
+# ranked together as one batch, which the ranker can evaluate term at a time,
+# reading the list of each distinct word once. A batch is dispatched early when
+# it reaches max_batch_size queries. Batches are ranked by up to max_workers
+# threads, off the event loop. Queries are normalized with the vocabulary
+# snapshot of the index, if given, so that only the forms not in it are
+# stemmed.
+class QueryServer:
+    def __init__(self, ranker, max_workers: int = None,
+                 batch_window: float = None, max_batch_size: int = None,
+                 vocabulary=None):
+        if batch_window == None:
+            batch_window = DEFAULT_BATCH_WINDOW
+        if max_batch_size == None:
+            max_batch_size = DEFAULT_MAX_BATCH_SIZE
+
+        self._ranker = ranker
+        self._vocabulary = vocabulary
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers)
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+
+        # Futures of the top 10 of the queries being ranked, by tokens, and the
+        # tokens of the queries waiting for the next batch.
+        self._in_flight = {}
+        self._pending = []
+        self._timer = None
+
+        self.num_queries = 0
+        self.num_coalesced = 0
+        self.num_batches = 0
+
+    # search returns the results of the query, in the same format as the
+    # results of the query processor.
+    async def search(self, query: str):
+        loop = asyncio.get_running_loop()
+        key = tuple(tokenize_and_normalize(query, self._vocabulary))
+
+        self.num_queries += 1
+        future = self._in_flight.get(key)
+        if future != None:
+            self.num_coalesced += 1
+        else:
+            future = loop.create_future()
+            self._in_flight[key] = future
+            self._pending.append(key)
+            if len(self._pending) >= self._max_batch_size:
+                self._dispatch()
+            elif self._timer == None:
+                self._timer = loop.call_later(self._batch_window,
+                                              self._dispatch)
+
+        # The future is shared by all the coalesced queries, so it must not be
+        # cancelled along with any one of them.
+        top10, approximate = await asyncio.shield(future)
+        return top10_json(query, top10, approximate)
+
+    def _dispatch(self):
+        if self._timer != None:
+            self._timer.cancel()
+            self._timer = None
+        keys = self._pending
+        self._pending = []
+        if len(keys) == 0:
+            return
+
+        logger.info("Dispatching batch of %d queries", len(keys))
+
+        self.num_batches += 1
+        batch = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._ranker.top10_tokens, [list(key) for key in keys])
+        batch.add_done_callback(lambda batch: self._resolve(keys, batch))
+
+    def _resolve(self, keys, batch):
+        if batch.cancelled():
+            error = asyncio.CancelledError()
+        else:
+            error = batch.exception()
+        if error != None:
+            logger.error("Failed to rank batch of %d queries: %s", len(keys),
+                         error)
+
+        for i, key in enumerate(keys):
+            future = self._in_flight.pop(key)
+            if future.done():
+                continue
+            if error != None:
+                future.set_exception(error)
+            else:
+                future.set_result(batch.result()[i])
+
+    # serve answers queries sent over TCP connections. Clients send one query
+    # per line, and receive the results of each one as a line of JSON, in the
+    # order of the queries. Queries sent without waiting for the previous
+    # results are ranked concurrently.
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self._handle, host, port)
+
+        logger.info(f"Serving queries on {host}:{port}")
+
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        results = asyncio.Queue()
+        writer_task = asyncio.create_task(self._write_results(results, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                query = line.decode("utf-8").strip()
+                if query == "":
+                    continue
+                await results.put(asyncio.create_task(self._search_json(query)))
+        finally:
+            await results.put(None)
+            await writer_task
+            writer.close()
+
+    async def _search_json(self, query):
+        try:
+            result = await self.search(query)
+        except Exception as e:
+            logger.error("Failed to rank query '%s': %s", query, e,
+                         exc_info=True)
+            result = {"Query": query, "Error": str(e)}
+        return json.dumps(result, ensure_ascii=False)
+
+    async def _write_results(self, results, writer):
+        while True:
+            task = await results.get()
+            if task == None:
+                return
+            writer.write((await task + "\n").encode("utf-8"))
+            await writer.drain()
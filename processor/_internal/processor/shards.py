@@ -0,0 +1,211 @@
+import concurrent.futures
+import heapq
+import json
+
+from common.log import log
+from common.metrics import metrics
+from common.utils.shards import read_shards
+from common.utils.term_stats import term_stats_fpath
+from common.utils.workers import (init_worker,
+                                  worker_initargs)
+from .engines import ranker_class
+from .ranker import (NUM_RESULTS,
+                     top10_json)
+
+logger = log.logger()
+
+# Each shard worker process holds the ranker of its shard.
+_shard_ranker = None
+
+def _init_shard(engine, ranker_type, shard_fpath, parallelism, term_stats_fpath,
+                mode, batch, fetch, ranker_args, queries):
+    global _shard_ranker
+
+    _shard_ranker = ranker_class(engine)(ranker_type, shard_fpath, parallelism,
+                                         term_stats_fpath=term_stats_fpath,
+                                         mode=mode, batch=batch, fetch=fetch,
+                                         **ranker_args)
+    _shard_ranker.init(queries)
+
+def _rank_shard():
+    return _shard_ranker.top10_all(), _shard_ranker.stage_times()
+
+def _top10_tokens_shard(tokens_list):
+    return _shard_ranker.top10_tokens(tokens_list)
+
+def _top10_shard(tokens):
+    return _shard_ranker.top10(tokens)
+
+def _num_postings_shard():
+    return _shard_ranker.num_postings()
+
+def _plan_shard(tokens):
+    return _shard_ranker.plan(tokens)
+
+# Shards rank queries in parallel, so the time of a stage is the one of its
+# slowest shard.
+def _combine_stage_times(shard_stage_times):
+    stage_times = {}
+    for stage in shard_stage_times[0]:
+        stage_times[stage] = {
+            key: max(shard[stage][key] for shard in shard_stage_times)
+            for key in shard_stage_times[0][stage]
+        }
+    return stage_times
+
+# _merge_top10 merges the top 10 of a query in every shard, given with whether
+# it is approximate, into the top 10 of the whole index. It is approximate if
+# the one of any shard is.
+def _merge_top10(shard_top10s):
+    top10 = heapq.nlargest(NUM_RESULTS,
+                           (result for shard_top10, _ in shard_top10s
+                            for result in shard_top10),
+                           key=lambda result: result[0])
+    return top10, any(approximate for _, approximate in shard_top10s)
+
+# ShardedRanker ranks queries over a sharded index in a scatter-gather fashion:
+# each shard is loaded and queried by its own worker process, and the top 10
+# of every shard are merged into the top 10 of the whole index. Scores of
+# different shards are comparable because shards share the statistics of the
+# whole index.
+class ShardedRanker:
+    def __init__(self, ranker_type: str, index_fpath: str, parallelism: int = None,
+                 benchmarking: bool = None, engine: str = None,
+                 mode: str = None, batch: bool = None, fetch: bool = None,
+                 rerank: str = None, num_candidates: int = None,
+                 first_stage_budget: float = None,
+                 rerank_budget: float = None, query_budget: float = None,
+                 postings_budget: int = None, max_df: float = None,
+                 high_df: str = None):
+        self._engine = engine
+        self._mode = mode
+        self._batch = batch
+        self._fetch = fetch
+        # Every shard reranks the candidates of its own first stage, budgets
+        # its own ranking of each query, and plans it.
+        self._ranker_args = {
+            "rerank": rerank,
+            "num_candidates": num_candidates,
+            "first_stage_budget": first_stage_budget,
+            "rerank_budget": rerank_budget,
+            "query_budget": query_budget,
+            "postings_budget": postings_budget,
+            "max_df": max_df,
+            "high_df": high_df,
+        }
+        self._num_approximate = 0
+        self._stage_times = {}
+        self._ranker_type = ranker_type
+        self._index_fpath = index_fpath
+        self._parallelism = parallelism
+        self._shard_fpaths = read_shards(index_fpath)
+        self._executors = []
+
+    def init(self, queries=None):
+        logger.info(f"Initializing ranker of {len(self._shard_fpaths)} shards")
+
+        self._queries = queries
+
+        # One single-process executor per shard, so that every call for a shard
+        # reaches the process that loaded it.
+        futures = []
+        for shard_fpath in self._shard_fpaths:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, initializer=init_worker,
+                initargs=worker_initargs())
+            self._executors.append(executor)
+            futures.append(executor.submit(
+                _init_shard, self._engine, self._ranker_type, shard_fpath, self._parallelism,
+                term_stats_fpath(self._index_fpath), self._mode, self._batch,
+                self._fetch, self._ranker_args, queries))
+        for future in futures:
+            future.result()
+
+        logger.info(f"Successfully initialized ranker of "+
+                    f"{len(self._shard_fpaths)} shards")
+
+    def rank_all(self):
+        logger.info("Ranking queries over %d shards", len(self._shard_fpaths))
+
+        futures = [executor.submit(_rank_shard) for executor in self._executors]
+        shard_results = []
+        shard_stage_times = []
+        for future in futures:
+            shard_result, stage_times = future.result()
+            shard_results.append(shard_result)
+            shard_stage_times.append(stage_times)
+        self._stage_times = _combine_stage_times(shard_stage_times)
+        self.collect_metrics()
+
+        results = []
+        for query in shard_results[0]:
+            top10, approximate = self._merge_top10(
+                [shard_result[query] for shard_result in shard_results])
+            results.append(json.dumps(top10_json(query, top10, approximate),
+                                      ensure_ascii=False))
+
+        logger.info("Successfully ranked queries over %d shards",
+                    len(self._shard_fpaths))
+
+        return results
+
+    # collect_metrics adds the metrics recorded by the shard processes since
+    # the last call to the ones of this process.
+    def collect_metrics(self):
+        futures = [executor.submit(metrics.collect)
+                   for executor in self._executors]
+        for future in futures:
+            metrics.merge(future.result())
+
+    # close stops the shard processes. The ranker cannot rank any more queries
+    # afterwards, so it is up to the owner of the ranker to call it once done.
+    def close(self):
+        for executor in self._executors:
+            executor.shutdown()
+
+    # stage_times returns the times of the two ranking stages of the last
+    # rank_all.
+    def stage_times(self):
+        return self._stage_times
+
+    # num_postings returns the number of postings visited by all queries in
+    # all shards.
+    def num_postings(self):
+        futures = [executor.submit(_num_postings_shard)
+                   for executor in self._executors]
+        return sum(future.result() for future in futures)
+
+    # plan returns the plan of the tokenized query. Shards plan with the term
+    # statistics of the whole index, so all of them have the same plan.
+    def plan(self, tokens):
+        return self._executors[0].submit(_plan_shard, tokens).result()
+
+    # num_approximate returns the number of queries whose ranking ran out of
+    # budget in any shard.
+    def num_approximate(self):
+        return self._num_approximate
+
+    def _merge_top10(self, shard_top10s):
+        top10, approximate = _merge_top10(shard_top10s)
+        if approximate:
+            self._num_approximate += 1
+        return top10, approximate
+
+    # top10 returns the top 10 (score, url) pairs of the tokenized query over
+    # all shards, ranking it on its own, and whether they are approximate.
+    def top10(self, tokens):
+        futures = [executor.submit(_top10_shard, tokens)
+                   for executor in self._executors]
+        return self._merge_top10([future.result() for future in futures])
+
+    # top10_tokens returns the top 10 (score, url) pairs of each of the given
+    # tokenized queries over all shards, and whether they are approximate.
+    # Unlike rank_all, it keeps the shard processes running, so that it can be
+    # called again.
+    def top10_tokens(self, tokens_list):
+        futures = [executor.submit(_top10_tokens_shard, tokens_list)
+                   for executor in self._executors]
+        shard_results = [future.result() for future in futures]
+        return [self._merge_top10([shard_result[i]
+                                   for shard_result in shard_results])
+                for i in range(len(tokens_list))]
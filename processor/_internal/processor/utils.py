@@ -1,13 +1,13 @@
 import threading
 
 from common.log import log
-from common.memory.defs import MEGABYTE
-from common.utils.index import (read_index,
-                                postings_from_str)
+from common.metrics import metrics
+from common.utils.index import read_index
+from common.utils.marks import (Marks,
+                                MARK_SPACING)
 
 logger = log.logger()
 
-INDEX_FILE_MARK_SPACING = MEGABYTE
 INDEX_FILE_MUTEX = threading.Lock()
 
 def first_word(s):
@@ -20,28 +20,29 @@ def first_word(s):
         i += 1
     return word
 
-# Returns subindex with given terms, and a map of marks in the index file to
-# facilitate traversal, each spaced by at least INDEX_FILE_MARK_SPACING bytes.
+# Returns subindex with given terms, and the marks of the index file to
+# facilitate traversal, each spaced by at least MARK_SPACING bytes. It is only
+# needed by index files written before the indexer wrote their skips file.
+@metrics.timed("processor.preprocess_index")
 def preprocess_entire_index(index_fpath, checkpoint, words):
     logger.info(f"Preprocessing index '{index_fpath}' with words {words}")
 
     subindex = {}
     words_not_found = []
-    marks = {}
+    marks = Marks()
     words_set = set(words)
-    checkpoint_before = checkpoint
-    while True:
+    while checkpoint != None:
+        checkpoint_before = checkpoint
         index, checkpoint = read_index(index_fpath, checkpoint,
-                                       INDEX_FILE_MARK_SPACING)
-        if checkpoint == None:
-            break
+                                       MARK_SPACING)
+        if len(index) == 0:
+            continue
 
-        first_word = sorted(list(index.keys()))[0]
-        if first_word not in marks:
-            marks[first_word] = checkpoint_before
-            logger.debug(f"Added mark '{first_word}': "+
-                         f"{checkpoint_before}")
-            checkpoint_before = checkpoint
+        # Lists are sorted by word in the index file, so the words of a block
+        # all come after the ones of the previous blocks.
+        first_word = min(index)
+        marks.add(first_word, checkpoint_before)
+        logger.debug("Added mark '%s': %d", first_word, checkpoint_before)
 
         for word in words_set:
             if word in index:
@@ -60,46 +61,36 @@ def preprocess_entire_index(index_fpath, checkpoint, words):
 
     return subindex, marks, words_not_found
 
+# find_checkpoints_marks returns the offsets of the blocks of the index file
+# with the lists of the given words, each once and in increasing order.
 def find_checkpoints_marks(marks, words, tid="Unknown"):
-    checkpoints = []
-    mark_words = sorted(list(marks.keys()))
-    mark_words_idx = 0
-    sorted_words = sorted(list(words))
-    for word in sorted_words:
-        if mark_words_idx >= len(mark_words):
-            break
-        while word > mark_words[mark_words_idx]:
-            mark_words_idx += 1
-        if mark_words_idx > 0:
-            mark_words_idx -= 1
-        logger.debug(f"Last mark for word '{word}': {mark_words[mark_words_idx]}")
-        checkpoints.append(marks[mark_words[mark_words_idx]])
-    logger.debug(f"({tid}) Checkpoints from words {sorted_words}: {checkpoints}")
+    checkpoints = marks.checkpoints(words)
+    logger.debug("(%s) Checkpoints from words %s: %s", tid, words,
+                 checkpoints)
     return checkpoints
 
 # This is made to be accessed by slave threads, so we must take care to preserve
-# mutual exclusion when accessing index file.
+# mutual exclusion when accessing index file. The list of a word is in the block
+# of its mark, so each block is read once, and words not in theirs are not in
+# the index.
+@metrics.timed("processor.subindex_from_marks")
 def subindex_from_words_marks(index_fpath, checkpoints, words, tid="Unknown"):
     INDEX_FILE_MUTEX.acquire()
-    logger.info(f"({tid}) Generating subindex from file '{index_fpath}' and "+
-                f"checkpoints {checkpoints}")
+    logger.info("(%s) Generating subindex from file '%s' and checkpoints %s",
+                tid, index_fpath, checkpoints)
     subindex = {}
     words_set = set(words)
     for checkpoint in checkpoints:
-        not_found = True
-        while not_found:
-            index, checkpoint = read_index(index_fpath, checkpoint,
-                                           INDEX_FILE_MARK_SPACING)
-            for word in words_set:
-                if word == "regist":
-                    logger.info(f"Index for regist: {sorted(list(index.keys()))}")
-                if word in index:
-                    not_found = False
-                    subindex[word] = index[word]
+        log.trace("(%s) Reading index at checkpoint %s", tid, checkpoint)
+        index, _ = read_index(index_fpath, checkpoint, MARK_SPACING)
+        log.trace("(%s) Words read: %s", tid, log.lazy(sorted, index))
+        for word in words_set:
+            if word in index:
+                subindex[word] = index[word]
         if len(subindex) == len(words_set):
             break
-    logger.info(f"({tid}) Successfully generated subindex from file "+
-                f"'{index_fpath}' and checkpoints {checkpoints}. Subindex length: "+
-                f"{len(subindex)}")
+    logger.info("(%s) Successfully generated subindex from file '%s' and "+
+                "checkpoints %s. Subindex length: %d", tid, index_fpath,
+                checkpoints, len(subindex))
     INDEX_FILE_MUTEX.release()
     return subindex
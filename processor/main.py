@@ -1,4 +1,6 @@
 from common.log import log
+from common.metrics import metrics
+from common.profiling import profiler
 from ._internal.processor.processor import Processor
 
 logger = log.logger()
@@ -8,6 +10,17 @@ def main(args):
 
     processor = Processor(args)
     processor.init()
-    processor.run()
+    if args.port != None:
+        processor.serve()
+    else:
+        processor.run()
+
+    if args.metrics != None:
+        metrics.write(args.metrics, args.metrics_format)
+        logger.info(f"Wrote metrics to '{args.metrics}'")
+
+    if args.profile != None:
+        profiler.write(args.profile)
+        logger.info(f"Wrote profile to '{args.profile}'")
 
     logger.info("Successfully finished query processor run")